@@ -7,10 +7,12 @@ import datetime as dt
 import json
 import pipeline_plan_functions.utils.pipe_db_handler as dbh
 import pipeline_plan_functions.utils.data_types as dth
+import alloc_functions.route_model as rm
 # import pipeline_plan_functions.utils.data_handler as rh
 from python_utils.utils.logger import logger
 logger.setLevel(os.getenv('log_level', "DEBUG"))
 DERROGATION = 725
+SIM_MINUTES = 2  # time periods to count simultaneous routes
 
 
 def find_current_allocation(run, cnx):
@@ -166,21 +168,58 @@ def select_vehicle(routes, vspecs, xmpg, icevehicle, threshold=0.05):
     return vehicle1, vehicle2
 
 
+def concurrency(routes, minutes=SIM_MINUTES):
+    """Sweep line over the route departure and fixed arrival events
+
+    A route counts in the time periods strictly between its departure and
+    its fixed arrival, and only in the periods of its own date (every
+    `minutes` from midnight).
+
+    Args:
+        routes (DataFrame): routes with date, departure_time and
+            fixed_arrival
+        minutes (int): length of the time periods
+
+    Returns:
+        array: dates
+        array: date (index in dates) of each change in the count
+        array: time period of each change, from midnight
+        array: number of routes from that time period on
+    """
+    nperiods = int(60*24/minutes)
+    stride = nperiods + 1  # so a day's last event doesn't hit the next day
+    dates, day = np.unique(routes['date'].values, return_inverse=True)
+    day_start = rm.floor_minutes(dates)[day]
+    first = ((rm.floor_minutes(routes['departure_time']) - day_start)
+             // minutes + 1).clip(0, nperiods)
+    last = (-(-(rm.ceil_minutes(routes['fixed_arrival']) - day_start)
+              // minutes)).clip(0, nperiods)
+    on_road = first < last
+    keys = np.concatenate([day[on_road]*stride + first[on_road],
+                           day[on_road]*stride + last[on_road]])
+    deltas = np.repeat([1, -1], on_road.sum())
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    count = np.cumsum(deltas[order])
+    # Keep the count after the last event of each time period
+    last_event = np.flatnonzero(np.append(keys[1:] != keys[:-1],
+                                          len(keys) > 0))
+    keys = keys[last_event]
+    return dates, keys // stride, keys % stride, count[last_event]
+
+
 def num_simultaneous(routes):
-    # Calculate max number of simultaneous journeys
-    dates = routes['date'].unique()
-    N = 0
-    minutes = 2
-    for date in dates:
-        ntimeperiods = int(60*24/minutes)   # (5 minutes)
-        tps = np.array([date + i*np.timedelta64(minutes, 'm')
-                        for i in range(ntimeperiods)])
-        count_busy = np.zeros(ntimeperiods)
-        for route in routes[routes['date'] == date].index:
-            unavailable = ((tps > routes.loc[route, 'departure_time'])
-                           & (tps < routes.loc[route, 'fixed_arrival']))
-            count_busy += unavailable.astype(int)
-        N = max(N, count_busy.max())
+    """Calculates the max number of simultaneous journeys
+
+    Args:
+        routes (DataFrame): routes with date, shift, departure_time and
+            fixed_arrival
+
+    Returns:
+        int: number of vehicles required
+    """
+    _, _, _, count = concurrency(routes)
+    N = count.max() if len(count) > 0 else 0
     count_routes_shift = routes.groupby(
         ['date', 'shift']
         )['allocation_id'].count().max()
@@ -210,7 +249,7 @@ def main(idx):
     try:
         logger.info(f"Allocation function called at {dt.datetime.now()}")
         connection, cur = dbh.database_connection('test')
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         # run = rh.get_current_run(connection, cur)
         # Read the allocation table, find the last one
         # alloc, not_last = find_current_allocation(run, cnx)
@@ -252,9 +291,8 @@ def main(idx):
         logger.error(e)
         SystemExit(e)
     finally:
-        cnx.dispose()
         cur.close()
-        connection.close()
+        dbh.release_connection(connection)
         logger.info("Closed db connection")
     return not_last
 
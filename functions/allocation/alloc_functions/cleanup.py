@@ -14,6 +14,7 @@ import pipeline_plan_functions.utils.pipe_db_handler as dbh
 # import pipeline_plan_functions.utils.data_types as dth
 # import pipeline_plan_functions.utils.data_handler as rh
 import alloc_functions.daily as adf
+import alloc_functions.pairings_writer as pw
 from python_utils.utils.logger import logger
 logger.setLevel(os.getenv('log_level', "DEBUG"))
 
@@ -39,15 +40,13 @@ def get_allocated_routes(allocation_id, connection, cur):
 
 def get_allocation(idx):
     try:
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         sql_query = f"""SELECT * FROM t_allocation WHERE allocation_id={idx}
                 ORDER BY allocation_id ASC """
         allocations = pd.read_sql_query(sql_query, cnx)
     except (Exception, psycopg2.Error) as error:
         logger.error("Error while fetching allocation table")
         raise error
-    finally:
-        cnx.dispose()
     current_allocation = allocations.iloc[0].to_dict()
     current_allocation['vehicle_pool'] = json.loads(
         current_allocation['vehicle_pool'])
@@ -232,25 +231,8 @@ def update_pairings(routes, connection, cur):
     routes_toupdate = routes.droplevel('date')[cols]
     routes_toupdate['diesel_fuel_consumption'] = routes_toupdate[
         'diesel_fuel_consumption'].fillna(0)
-    pairings_string = ", ".join([str(tuple(e)) for e
-                                 in routes_toupdate.reset_index().values])
-    try:
-        sql_query = f"""INSERT INTO t_route_allocated (route_id, allocation_id,
-            allocated_vehicle_id, energy_required_kwh,
-            diesel_fuel_consumption, route_cost, allocated_spec_id)
-            VALUES {pairings_string}
-            ON CONFLICT (route_id, allocation_id) DO UPDATE
-                SET allocated_vehicle_id = excluded.allocated_vehicle_id,
-                    energy_required_kwh = excluded.energy_required_kwh,
-                    diesel_fuel_consumption = excluded.diesel_fuel_consumption,
-                    route_cost = excluded.route_cost,
-                    allocated_spec_id = excluded.allocated_spec_id"""
-        cur.execute(sql_query)
-        connection.commit()
-        logger.debug("Updated t_route_allocated with cleaned allocations")
-    except (Exception, psycopg2.Error) as error:
-        logger.error("Error updating t_allocation table")
-        raise error
+    pw.write_pairings(routes_toupdate, connection, cur)
+    logger.debug("Updated t_route_allocated with cleaned allocations")
     return
 
 
@@ -290,7 +272,7 @@ def main(idx):
         SystemExit(e)
     finally:
         cur.close()
-        connection.close()
+        dbh.release_connection(connection)
         logger.info("Closed db connection")
     return
 
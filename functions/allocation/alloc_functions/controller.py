@@ -137,7 +137,7 @@ def main(run):
         SystemExit(e)
     finally:
         cur.close()
-        connection.close()
+        dbh.release_connection(connection)
         logger.info("Closed db connection")
     return df['allocation_id'].values
     # TODO read a list of lists for vehicles and chargers
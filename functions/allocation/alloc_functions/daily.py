@@ -8,13 +8,18 @@ import os
 import psycopg2
 # import sqlalchemy
 import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, as_completed
 # import json
 import pipeline_plan_functions.utils.pipe_db_handler as dbh
+import alloc_functions.route_store as rs
+import alloc_functions.route_model as rm
+import alloc_functions.pairings_writer as pw
 # import pipeline_plan_functions.utils.data_types as dth
 # import pipeline_plan_functions.utils.data_handler as rh
 from python_utils.utils.logger import logger
 # from pulp import LpMaximize
 import pulp
+from scipy.optimize import linear_sum_assignment
 logger.setLevel(os.getenv('log_level', "DEBUG"))
 
 CHARGER_EFF = 0.9
@@ -22,6 +27,12 @@ CHARGER_EFF = 0.9
 TIME_INT_IS = dt.timedelta(minutes=30)
 TP_FRACT_IS = TIME_INT_IS/dt.timedelta(hours=1)
 DERROGATION = 725
+# Route/vehicle assignment backend: 'lsa' (linear sum assignment) or 'cbc'
+ASSIGNMENT_SOLVER = os.getenv('assignment_solver', 'lsa')
+# Fleet size search: 'linear' or 'bisect' (bracketing + binary search)
+FLEET_SEARCH = os.getenv('fleet_search', 'linear')
+# Number of worker processes allocating dates in parallel (1 is serial)
+DATE_WORKERS = int(os.getenv('date_workers', 1))
 
 
 def find_current_allocation(cnx):
@@ -86,6 +97,21 @@ def get_daily_route_data(routes, params, connection, cur):
     return routes
 
 
+def load_route_store(alloc, connection, cur):
+    """Loads all the routes of an allocation and the vehicle specs at once
+
+    Returns:
+        RouteStore: routes grouped by date, and the vehicle specs
+    """
+    routes = rs.get_allocation_routes(alloc, connection, cur)
+    routes = rs.prepare_routes(routes, alloc)
+    specs = get_vehicle_specs([alloc['vehicle1'], alloc['vehicle2']],
+                              connection, cur)
+    logger.debug(f"Loaded {len(routes)} routes for allocation "
+                 f"{alloc['allocation_id']}")
+    return rs.RouteStore(routes, specs)
+
+
 def get_routes_fromid(routeids, table, source, connection, cur):
     string_list = list_to_string(routeids)
     try:
@@ -116,7 +142,7 @@ def separate_shift_idsx(routes):
 
 def get_turnaround_time(site_id):
     try:
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         sql_query = f"""SELECT turnaround_time, min_to_connect  FROM t_sites
             WHERE site_id={site_id}"""
         site_data = pd.read_sql_query(sql_query, cnx).iloc[0]
@@ -125,8 +151,6 @@ def get_turnaround_time(site_id):
     except (Exception, psycopg2.Error) as error:
         logger.error("Error while fetching routes/no routes available")
         raise error
-    finally:
-        cnx.dispose()
     return turnaround, min_to_connect
 
 
@@ -141,16 +165,18 @@ def get_vehicle_specs(vehicles, connection, cur):
     except (Exception, psycopg2.Error) as error:
         logger.error("Error getting vehicle specs")
         raise error
+    # The first and last specs are vehicle1 and vehicle2
+    vspecs = [rm.VehicleSpec(*row) for row in (spec_array[0], spec_array[-1])]
     specs = {}
-    specs['pack'] = [spec_array[0][2], spec_array[-1][2]]
-    specs['drive'] = [spec_array[0][1], spec_array[-1][1]]
-    specs['rang'] = [specs['pack'][i]/specs['drive'][i] for i in range(2)]
-    specs['payload'] = [spec_array[0][5] + DERROGATION,
-                        spec_array[-1][5] + DERROGATION]
-    specs['crates'] = [spec_array[0][6], spec_array[-1][6]]
-    specs['fuel'] = [spec_array[0][7], spec_array[-1][7]]
-    specs['max_charge_ac'] = [spec_array[0][3], spec_array[-1][3]]
-    specs['max_charge_dc'] = [spec_array[0][4], spec_array[-1][4]]
+    specs['pack'] = [v.battery_size for v in vspecs]
+    specs['drive'] = [v.energy_use for v in vspecs]
+    specs['rang'] = [v.range for v in vspecs]
+    specs['payload'] = [v.max_load + DERROGATION for v in vspecs]
+    specs['crates'] = [v.max_crate for v in vspecs]
+    specs['fuel'] = [v.fuel_type for v in vspecs]
+    specs['max_charge_ac'] = [v.charge_power_ac for v in vspecs]
+    specs['max_charge_dc'] = [v.charge_power_dc for v in vspecs]
+    specs['vehicles'] = vspecs
     return specs
 
 
@@ -222,177 +248,297 @@ def get_parameters(alloc):
     return params
 
 
-def solve_assignment(cost):
-    """Optimisation process to assign best route/vehicle combinations
+def assignment_lsa(cost):
+    """Hungarian (Jonker-Volgenant) assignment on a dense cost array
 
     Args:
-        cost (DataFrame): costs for each vehicle/route combo
+        cost (2D array): score for each route (rows) and vehicle (columns)
 
     Returns:
-        (DataFrame): Vehicle assigned to each route + cost
-        (score): score for each route
+        (array): row index of each assigned route
+        (array): column index of the vehicle assigned to that route
     """
-    # TODO make into numpy arrays, and CVXPY
-    routes = cost.index.get_level_values(0).unique()
-    vehicles = cost.index.get_level_values(1).unique()
-    cost_col = cost.columns[0]
+    M, N = cost.shape
+    if M > N:
+        # Not every route can get a vehicle, same as an infeasible LP
+        return np.array([], dtype=int), np.array([], dtype=int)
+    rows, cols = linear_sum_assignment(cost, maximize=True)
+    return rows, cols
+
+
+def assignment_cbc(cost):
+    """Binary program solved with PuLP/CBC on a dense cost array
+
+    Args:
+        cost (2D array): score for each route (rows) and vehicle (columns)
+
+    Returns:
+        (array): row index of each assigned route
+        (array): column index of the vehicle assigned to that route
+    """
+    M, N = cost.shape
     # Create our variable matrix
     assignment = pulp.LpVariable.dicts(
         "assign",
-        ((route, vehicle) for route, vehicle in cost.index),
+        ((i, j) for i in range(M) for j in range(N)),
         cat='Binary')
     # Create PuLP problem
     shiftprob = pulp.LpProblem('Assigning_double_shifts_to_vehicles',
                                pulp.LpMaximize)
     # Add costs
     shiftprob += pulp.lpSum(
-        [cost.loc[(route, vehicle), cost_col] * assignment[route, vehicle]
-         for route, vehicle in cost.index]
+        [float(cost[i, j]) * assignment[i, j]
+         for i in range(M) for j in range(N)]
     ), 'Feasibility_cost'
 
     # Only one vehicle per route constraint
-    for route in routes:
+    for i in range(M):
         shiftprob += pulp.lpSum(
-            [assignment[route, vehicle] for vehicle in vehicles]
-        ) == 1
+            [assignment[i, j] for j in range(N)]) == 1
 
     # Max one route per vehicle
-    for vehicle in vehicles:
+    for j in range(N):
         shiftprob += pulp.lpSum(
-            [assignment[route, vehicle] for route in routes]
-        ) <= 1
+            [assignment[i, j] for i in range(M)]) <= 1
 
-    # Solve and print to the screen
     shiftprob.solve(pulp.PULP_CBC_CMD(msg=False))
-    # Get output variables
-    assignments = []
-    for route, vehicle in assignment:
-        if shiftprob.status == 1:
-            x = assignment[(route, vehicle)].varValue
-        else:
-            x = 0
-        var_output = {
-            'route_id': route,
-            'allocated_vehicle_id': vehicle,
-            'Feasible': x,
-            'route_cost': cost.loc[(route, vehicle), cost_col]
-        }
-        assignments.append(var_output)
-    df = pd.DataFrame.from_records(assignments)
-    df = df[df['Feasible'] == 1]
-    df.drop(columns='Feasible', inplace=True)
+    if shiftprob.status != 1:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    x = np.array([[assignment[i, j].varValue for j in range(N)]
+                  for i in range(M)]).reshape(M, N)
+    rows, cols = np.nonzero(x > 0.5)
+    return rows, cols
+
+
+ASSIGNMENT_BACKENDS = {
+    'lsa': assignment_lsa,
+    'cbc': assignment_cbc,
+}
+
+
+def assign_routes(cost, routes, vehicles, solver=None):
+    """Assigns the best route/vehicle combinations from a dense cost array
+
+    Args:
+        cost (2D array): score for each route (rows) and vehicle (columns)
+        routes (array): route IDs, matching the rows of cost
+        vehicles (array): vehicle IDs, matching the columns of cost
+        solver (str): assignment backend, one of ASSIGNMENT_BACKENDS.
+            Defaults to the assignment_solver environment variable
+
+    Returns:
+        (DataFrame): Vehicle assigned to each route + cost
+    """
+    cost = np.asarray(cost)
+    rows, cols = solve_routes(cost, solver)
+    return pairings_frame(cost, routes, vehicles, rows, cols)
+
+
+def solve_routes(cost, solver=None):
+    """Runs an assignment backend, falling back to CBC if it fails
+
+    Args:
+        cost (2D array): score for each route (rows) and vehicle (columns)
+        solver (str): assignment backend, one of ASSIGNMENT_BACKENDS.
+            Defaults to the assignment_solver environment variable
+
+    Returns:
+        (array): row index of each assigned route
+        (array): column index of the vehicle assigned to that route
+    """
+    if solver is None:
+        solver = ASSIGNMENT_SOLVER
+    try:
+        rows, cols = ASSIGNMENT_BACKENDS[solver](cost)
+    except ValueError as error:
+        logger.warning(f"{solver} assignment failed, falling back to CBC: "
+                       f"{error}")
+        rows, cols = assignment_cbc(cost)
+    return rows, cols
+
+
+def pairings_frame(cost, routes, vehicles, rows, cols):
+    """Table of the vehicle assigned to each route and its cost"""
+    df = pd.DataFrame({
+        'route_id': np.asarray(routes)[rows],
+        'allocated_vehicle_id': np.asarray(vehicles)[cols],
+        'route_cost': cost[rows, cols],
+    })
     df.set_index(['route_id'], inplace=True)
     return df
 
 
+def solve_assignment(cost, solver=None):
+    """Optimisation process to assign best route/vehicle combinations
+
+    Args:
+        cost (DataFrame): costs for each vehicle/route combo
+        solver (str): assignment backend, see assign_routes
+
+    Returns:
+        (DataFrame): Vehicle assigned to each route + cost
+    """
+    cost_col = cost.columns[0]
+    # Dense table, one row per route and one column per vehicle
+    table = cost[cost_col].unstack()
+    return assign_routes(table.to_numpy(), table.index, table.columns,
+                         solver)
+
+
+def to_seconds(times):
+    """Converts an array of datetimes to int64 seconds since the epoch
+
+    Seconds rather than minutes, so a vehicle arriving at 10:00:40 isn't
+    free at 10:00.
+    """
+    return np.asarray(times, dtype='datetime64[ns]').astype(
+        'datetime64[s]').astype(np.int64)
+
+
+def cost_kernel(end_first, mileage_first, payload_first, crates_first,
+                start_second, mileage_second, payload_second, crates_second,
+                specs, turnaround, min_to_connect, charger_ac, charger_dc,
+                dtype=np.float32, penalty=None):
+    """Scores every vehicle/route combination in a single numpy pass
+
+    Same scoring as cost_matrix(): between 0 and 1 if the vehicle can do the
+    route (lower if it needs intershift charging), -N if it can't.
+
+    Args:
+        end_first (int array): end of the vehicle's last route (epoch sec.)
+        mileage_first (array): equivalent mileage already done by each vehicle
+        payload_first (array): max payload of each vehicle's routes
+        crates_first (array): max number of crates of each vehicle's routes
+        start_second (int array): start of each route to assign (epoch sec.)
+        mileage_second (array): equivalent mileage of each route to assign
+        payload_second (array): payload of each route to assign
+        crates_second (array): number of crates of each route to assign
+        specs (dict): vehicle specs, see get_vehicle_specs
+        turnaround (int): turnaround time at the site in minutes
+        min_to_connect (int): minutes until a returned vehicle is plugged in
+        charger_ac (float): slow charger power in kW
+        charger_dc (float): fast charger power in kW
+        dtype: dtype of the output matrix
+        penalty (float): score of unfeasible combinations, -N by default
+
+    Returns:
+        2D array: (M, N) cost matrix, a row per route and a column per vehicle
+    """
+    N = len(end_first)
+    if penalty is None:
+        penalty = -N
+    pack = [float(p) for p in specs['pack']]
+    drive = [float(d) for d in specs['drive']]
+    rang = [float(r) for r in specs['rang']]
+    max_payload = [float(p) for p in specs['payload']]
+    max_crates = [float(c) for c in specs['crates']]
+    # Routes along the rows, vehicles along the columns
+    end1 = np.asarray(end_first, dtype=np.int64)[np.newaxis, :]
+    start2 = np.asarray(start_second, dtype=np.int64)[:, np.newaxis]
+    mileage1 = np.asarray(mileage_first, dtype=float)[np.newaxis, :]
+    mileage2 = np.asarray(mileage_second, dtype=float)[:, np.newaxis]
+    # NaN payload/crates (unused vehicles) are ignored, like DataFrame.max
+    payload = np.fmax(
+        np.asarray(payload_first, dtype=float)[np.newaxis, :],
+        np.asarray(payload_second, dtype=float)[:, np.newaxis])
+    crates = np.fmax(
+        np.asarray(crates_first, dtype=float)[np.newaxis, :],
+        np.asarray(crates_second, dtype=float)[:, np.newaxis])
+    capacity_large = (payload <= max_payload[-1]) & (crates <= max_crates[-1])
+    capacity_small = (payload <= max_payload[0]) & (crates <= max_crates[0])
+    total_mileage = mileage1 + mileage2
+    on_time = end1 <= start2 - 60 * int(turnaround)
+    # Number of potential intershift charging slots (truncated to int)
+    is_tps = np.trunc((start2 - end1 - 60 * int(min_to_connect))
+                      / (TIME_INT_IS / dt.timedelta(seconds=1)))
+    # Max possible amount of charge delivered
+    is_max0 = charger_ac * CHARGER_EFF * TP_FRACT_IS * is_tps
+    is_max1 = charger_dc * CHARGER_EFF * TP_FRACT_IS * is_tps
+    energy_large = total_mileage * drive[1]
+    energy_small = total_mileage * drive[0]
+    both_in_range = (mileage1 <= rang[0]) & (mileage2 <= rang[0])
+
+    cost = np.full(total_mileage.shape, float(penalty))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Possible with largest vehicle, no IS (0.5)
+        cost[on_time & (total_mileage <= rang[-1]) & capacity_large] = 0.5
+        # Possible with smallest pack, no IS (1)
+        cost[on_time & (total_mileage <= rang[0]) & capacity_small] = 1
+        # Slow IS required for largest pack (0.25-0.5)
+        mask = (on_time & (energy_large > pack[1])
+                & (energy_large - is_max0 <= pack[1]) & capacity_large)
+        cost = np.where(
+            mask, 0.5 - 0.25 * (energy_large - pack[1]) / is_max0, cost)
+        # Fast IS required for largest pack (0-0.25)
+        mask = (on_time & (energy_large > pack[1] + is_max0)
+                & (energy_large - is_max1 <= pack[1]) & capacity_large)
+        cost = np.where(
+            mask, 0.25 - 0.25 * (energy_large - pack[1]) / is_max1, cost)
+        # Possible with smallest pack and slow IS (0.75-1)
+        mask = (on_time & both_in_range & (energy_small > pack[0])
+                & (energy_small - is_max0 < pack[0]) & capacity_small)
+        cost = np.where(
+            mask, 1 - 0.25 * (energy_small - pack[0]) / is_max0, cost)
+        # Possible with smallest pack and fast IS (0.5-0.75)
+        mask = (on_time & both_in_range & (energy_small >= pack[0] + is_max0)
+                & (energy_small - is_max1 < pack[0]) & capacity_small)
+        cost = np.where(
+            mask, 0.75 - 0.25 * (energy_small - pack[0]) / is_max1, cost)
+    return cost.astype(dtype)
+
+
+def shift_costs(first, second, params, specs, dtype=np.float32,
+                penalty=None):
+    """Cost matrix for assigning a shift's routes to the vehicles
+
+    Args:
+        first (DataFrame): a row per vehicle with the routes already done
+        second (DataFrame): routes to assign, sorted by route ID
+        params (dict): allocation parameters
+        specs (dict): vehicle specs, see get_vehicle_specs
+        dtype: dtype of the output matrix
+        penalty (float): score of unfeasible combinations, -N by default
+
+    Returns:
+        2D array: (M, N) cost matrix, a row per route and a column per vehicle
+    """
+    charger_ac = min(specs['max_charge_ac'] + [params['charger1']])
+    charger_dc = min(specs['max_charge_dc'] + [params['charger2']])
+    return cost_kernel(
+        to_seconds(first['arrival_time']),
+        first['equivalent_mileage'].to_numpy(dtype=float),
+        first['payload'].to_numpy(dtype=float),
+        first['number_crates'].to_numpy(dtype=float),
+        to_seconds(second['departure_time']),
+        second['equivalent_mileage'].to_numpy(dtype=float),
+        second['payload'].to_numpy(dtype=float),
+        second['number_crates'].to_numpy(dtype=float),
+        specs, params['turnaround'], params['min_to_connect'],
+        float(charger_ac), float(charger_dc), dtype=dtype, penalty=penalty)
+
+
 def cost_matrix(first, second, params, specs):
     """Calculates the cost for each journey/veh combination
 
     Args:
-        dayJour (DataFrame): all journeys in a branch in a day
-        N (int): number of vehicles available
-        v (list): list of (string) vehicle types to use, in order of
-            increasing pack capacity
-        charger (list): list of (int) charger power to use in kW, in
-            ascending order
+        first (DataFrame): a row per vehicle with the routes already done
+        second (DataFrame): routes to assign
+        params (dict): allocation parameters
+        specs (dict): vehicle specs, see get_vehicle_specs
 
     Returns:
         DataFrame: MultiIndex table of costs per combination.
             First index level is the route, second is the vehicle ID
             Single row is the cost
     """
-    turndelta = dt.timedelta(minutes=int(params['turnaround']))
-    connectdelta = dt.timedelta(minutes=int(params['min_to_connect']))
-    M = len(second.index.unique())
-    # specs = get_vehicle_specs([params['vehicle1'], params['vehicle2']],
-    #                               connection, cur)
-    # N = params['num_v_final']
-    N = len(first)
-    charger_ac = min(specs['max_charge_ac'] + [params['charger1']])
-    charger_dc = min(specs['max_charge_dc'] + [params['charger2']])
-    df = pd.DataFrame({
-        'allocated_vehicle_id': np.repeat(
-            np.array(first['allocated_vehicle_id']), M),
-        'End_First': np.repeat(np.array(first['arrival_time']), M),
-        'Mileage_First': np.repeat(np.array(first['equivalent_mileage']), M),
-        'Payload_First': np.repeat(np.array(first['payload']), M),
-        'Crates_First': np.repeat(np.array(first['number_crates']), M),
-        'route_id': np.tile(np.array(second.index), N),
-        'Start_Second': np.tile(np.array(second['departure_time']), N),
-        'Mileage_Second': np.tile(np.array(second['equivalent_mileage']), N),
-        'Payload_Second': np.tile(np.array(second['payload']), N),
-        'Crates_Second': np.tile(np.array(second['number_crates']), N),
-    })
-    df['Total_Mileage'] = df['Mileage_First'] + df['Mileage_Second']
-    df['Capacity_Large'] = (
-        (df[['Payload_First', 'Payload_Second']].max(axis=1)
-         <= specs['payload'][-1])
-        & (df[['Crates_First', 'Crates_Second']].max(axis=1)
-           <= specs['crates'][-1]))
-    df['Capacity_Small'] = (
-        (df[['Payload_First', 'Payload_Second']].max(axis=1)
-         <= specs['payload'][0])
-        & (df[['Crates_First', 'Crates_Second']].max(axis=1)
-           <= specs['crates'][0]))
-    df['IStps'] = df.apply(lambda row: calculate_IStps(
-            row['End_First'], row['Start_Second'], connectdelta), axis=1)
-    # Max possible amount of charge delivered
-    df['IS_max0'] = (charger_ac * CHARGER_EFF
-                     * TP_FRACT_IS * df['IStps'])
-    df['IS_max1'] = (charger_dc * CHARGER_EFF
-                     * TP_FRACT_IS * df['IStps'])
-    df['Cost'] = -N
-    # Possible with largest vehicle, no IS (0.5)
-    df.loc[(df['End_First'] <= df['Start_Second'] - turndelta)
-           & (df['Total_Mileage'] <= specs['rang'][-1])
-           & (df['Capacity_Large']), 'Cost'] = 0.5
-    # Possible with smallest pack, no IS (1)
-    df.loc[(df['End_First'] <= df['Start_Second'] - turndelta)
-           & (df['Total_Mileage'] <= specs['rang'][0])
-           & (df['Capacity_Small']), 'Cost'] = 1
-    # Slow IS required for largest pack (0.25-0.5)
-    mask = ((df['End_First'] <= df['Start_Second'] - turndelta)
-            & (df['Total_Mileage']*specs['drive'][1] > specs['pack'][1])
-            & ((df['Total_Mileage']*specs['drive'][1] - df['IS_max0'])
-               <= specs['pack'][1])
-            & (df['Capacity_Large']))
-    df.loc[mask, 'Cost'] = (0.5-0.25*(
-        df['Total_Mileage']*specs['drive'][1] - specs['pack'][1])
-                            / df['IS_max0'])
-    # Fast IS required for largest pack (0-0.25)
-    df.loc[(df['End_First'] <= df['Start_Second'] - turndelta)
-           & (df['Total_Mileage']*specs['drive'][1]
-              > specs['pack'][1] + df['IS_max0'])
-           & ((df['Total_Mileage']*specs['drive'][1] - df['IS_max1'])
-              <= specs['pack'][1])
-           & (df['Capacity_Large']), 'Cost'] = (
-               0.25 - 0.25 * (df['Total_Mileage']*specs['drive'][1]
-                              - specs['pack'][1]) / df['IS_max1'])
-    # Possible with smallest pack and slow IS (0.75-1)
-    df.loc[(df['End_First'] <= df['Start_Second'] - turndelta)
-           & (df['Mileage_First'] <= specs['rang'][0])
-           & (df['Mileage_Second'] <= specs['rang'][0])
-           & (df['Total_Mileage']*specs['drive'][0] > specs['pack'][0])
-           & ((df['Total_Mileage']*specs['drive'][0] - df['IS_max0'])
-              < specs['pack'][0])
-           & (df['Capacity_Small']), 'Cost'] = (1-0.25*(
-                  df['Total_Mileage']*specs['drive'][0]
-                  - specs['pack'][0])/df['IS_max0'])
-    # Possible with smallest pack and fast IS (0.5-0.75)
-    df.loc[(df['End_First'] <= df['Start_Second'] - turndelta)
-           & (df['Mileage_First'] <= specs['rang'][0])
-           & (df['Mileage_Second'] <= specs['rang'][0])
-           & (df['Total_Mileage']*specs['drive'][0]
-              >= specs['pack'][0] + df['IS_max0'])
-           & ((df['Total_Mileage']*specs['drive'][0] - df['IS_max1'])
-              < specs['pack'][0])
-           & (df['Capacity_Small']), 'Cost'] = (
-               0.75-0.25*(df['Total_Mileage']*specs['drive'][0]
-                          - specs['pack'][0])/df['IS_max1'])
-
-    df.sort_values(by=['route_id', 'allocated_vehicle_id'], inplace=True)
-    df.set_index(['route_id', 'allocated_vehicle_id'], inplace=True)
-    return df[['Cost']]
+    second = second.sort_index()
+    cost = shift_costs(first, second, params, specs, dtype=float)
+    idx = pd.MultiIndex.from_product(
+        [second.index, first['allocated_vehicle_id']],
+        names=['route_id', 'allocated_vehicle_id'])
+    df = pd.DataFrame({'Cost': cost.reshape(-1)}, index=idx)
+    df.sort_index(inplace=True)
+    return df
 
 
 def update_alloc(alloc, connection, cur):
@@ -411,80 +557,218 @@ def update_alloc(alloc, connection, cur):
 
 
 def update_pairings(pairings, connection, cur):
-    pairings_string = ", ".join(
-        [str(tuple(e)) for e in pairings.reset_index().values])
-    try:
-        sql_query = f"""INSERT INTO t_route_allocated
-            (route_id, allocated_vehicle_id, route_cost, allocation_id)
-            VALUES {pairings_string}
-            ON CONFLICT (route_id, allocation_id) DO UPDATE
-                SET allocated_vehicle_id = excluded.allocated_vehicle_id,
-                    route_cost = excluded.route_cost;"""
-        cur.execute(sql_query)
-        connection.commit()
-    except (Exception, psycopg2.Error) as error:
-        logger.error("Error updating t_route_allocated table")
-        raise error
+    # Upserts allocated_vehicle_id and route_cost
+    pw.write_pairings(pairings, connection, cur)
     return
 
 
-def daily(date, alloc, connection, cur):
+def warm_start(cached, N, busy):
+    """Checks if a shift's previous assignment is still optimal with N vehicles
+
+    The previous solution stays optimal if it had no unfeasible pairs, all
+    the vehicles it used are still there and, when vehicles are added, it
+    already left an idle vehicle unused (the new ones are identical to it).
+
+    Args:
+        cached (dict): cost matrix and solution for the previous N
+        N (int): new number of vehicles
+        busy (array): IDs of the vehicles with earlier routes that day
+
+    Returns:
+        (tuple): rows and columns of the assignment, or None
+    """
+    rows, cols = cached['solution']
+    M = cached['cost'].shape[0]
+    if len(rows) < M or np.isnan(cached['cost'][rows, cols]).any():
+        return None
+    if len(cols) > 0 and cols.max() >= N:
+        return None
+    if N > cached['N']:
+        idle = np.setdiff1d(np.arange(cached['N']), np.asarray(busy) - 1)
+        if len(np.setdiff1d(idle, cols)) == 0:
+            return None
+    return rows, cols
+
+
+def assign_shift(first, second, N, params, specs, cached):
+    """Assigns a shift's routes to N vehicles
+
+    Reuses the cost matrix of a previous N (appending the columns of the
+    new vehicles) and its solution, if the vehicles' earlier routes are the
+    same.
+
+    Args:
+        first (DataFrame): earlier routes of each busy vehicle
+        second (DataFrame): routes to assign, sorted by route ID
+        N (int): number of vehicles
+        params (dict): allocation parameters
+        specs (dict): vehicle specs, see get_vehicle_specs
+        cached (dict): cost matrix and solution from a previous N, updated
+
+    Returns:
+        (DataFrame): Vehicle assigned to each route + cost
+    """
+    vehicleMat = vehicleMatrix(first, N)
+    reuse = ('first' in cached and cached['first'].equals(first)
+             and cached['routes'].equals(second.index))
+    if reuse:
+        # Unfeasible pairs are NaN so the -N penalty can be updated
+        old_N = cached['N']
+        base = cached['cost'][:, :N]
+        if N > old_N:
+            base = np.concatenate([base, shift_costs(
+                vehicleMat.iloc[old_N:], second, params, specs,
+                penalty=np.nan)], axis=1)
+        solution = warm_start(cached, N, first['allocated_vehicle_id'])
+    else:
+        base = shift_costs(vehicleMat, second, params, specs,
+                           penalty=np.nan)
+        solution = None
+    cost = np.where(np.isnan(base), -N, base).astype(base.dtype)
+    if solution is None:
+        solution = solve_routes(cost)
+    cached.update({'first': first, 'routes': second.index, 'N': N,
+                   'cost': base, 'solution': solution})
+    rows, cols = solution
+    return pairings_frame(cost, second.index,
+                          vehicleMat['allocated_vehicle_id'], rows, cols)
+
+
+def allocate_shifts(routes, shiftidx, N, params, specs, cache=None):
+    """Assigns the routes of each shift in turn to N vehicles
+
+    Args:
+        routes (DataFrame): the day's routes, first shift already assigned
+        shiftidx (dict): sorted route IDs of each shift
+        N (int): number of vehicles
+        params (dict): allocation parameters
+        specs (dict): vehicle specs, see get_vehicle_specs
+        cache (dict): cost matrices and solutions per shift, shared between
+            calls with different N
+
+    Returns:
+        (DataFrame): Vehicle assigned to each route + cost
+    """
+    if cache is None:
+        cache = {}
+    allocation_results = {}
+    first_routes = routes.loc[shiftidx[1]]
+    cols = ['allocated_vehicle_id', 'route_cost']
+    allocation_results[1] = first_routes[cols]
+    nshifts = len(shiftidx)
+    i = 2
+    while nshifts - i > -1:  # Iterate over remaining shifts
+        if len(shiftidx[i]) > 0:
+            secondJourneys = routes.loc[shiftidx[i]]
+            allocation_results[i] = assign_shift(
+                first_routes, secondJourneys, N, params, specs,
+                cache.setdefault(i, {}))
+            # if there are more shifts to assign, merge previous shifts
+            # and assing as firstjourneys
+            if nshifts > i:
+                secondJourneys[cols] = allocation_results[i]
+                first_routes = mergeJourneys(
+                    first_routes, secondJourneys, params, specs)
+        i += 1
+    return pd.concat(allocation_results.values())
+
+
+def fleet_size_search(allocate, N, cap_vehicles=False, mode=None):
+    """Finds the smallest number of vehicles that can do all the routes
+
+    The linear mode adds one vehicle at a time. The bisect mode brackets
+    the fleet size with growing steps and then does a binary search, which
+    gives the same N only if routes that fit in N vehicles also fit in N+1.
+    The shifts are assigned greedily one after the other, so that isn't
+    guaranteed and bisect may return a different N.
+
+    Args:
+        allocate (function): returns the pairings for a number of vehicles
+        N (int): starting number of vehicles
+        cap_vehicles (bool): if True, only N vehicles are used
+        mode (str): 'bisect' or 'linear', defaults to FLEET_SEARCH
+
+    Returns:
+        (int): number of vehicles
+        (DataFrame): Vehicle assigned to each route + cost
+    """
+    if mode is None:
+        mode = FLEET_SEARCH
+    results = {}
+
+    def unfeasible(n):
+        if n not in results:
+            results[n] = allocate(n)
+        return results[n]['route_cost'].min() < 0
+
+    if cap_vehicles:  # If the number of vehicles is capped
+        unfeasible(N)
+        return N, results[N]
+    if mode == 'linear':
+        while unfeasible(N):
+            N += 1
+        return N, results[N]
+    # Grow the step until the routes fit
+    low = N - 1
+    step = 1
+    while unfeasible(N):
+        low = N
+        N += step
+        step *= 2
+    # Smallest feasible size between the last two tries
+    while N - low > 1:
+        mid = (low + N) // 2
+        if unfeasible(mid):
+            low = mid
+        else:
+            N = mid
+    return N, results[N]
+
+
+def daily(date, alloc, connection, cur, update_fleet=True, store=None,
+          writer=None):
     # cnx = dbh.create_alch_engine()
-    routes = get_daily_routes(date, alloc['allocation_id'], connection, cur)
+    # Routes and specs come from the route store if there is one
+    if store is None:
+        routes = get_daily_routes(date, alloc['allocation_id'], connection,
+                                  cur)
+    else:
+        routes = store.day_routes(date)
     N = alloc['num_v_final']
     if len(routes) > 0:
-        routes = get_daily_route_data(routes, alloc, connection, cur)
+        if store is None:
+            routes = get_daily_route_data(routes, alloc, connection, cur)
+            specs = get_vehicle_specs([alloc['vehicle1'], alloc['vehicle2']],
+                                      connection, cur)
+        else:
+            specs = store.specs
         shiftidx = separate_shift_idsx(routes)
+        # Bill
+        for i in shiftidx:
+            shiftidx[i] = shiftidx[i].sort_values()
         # Allocate the first shift journeys to vehicles
         M = len(shiftidx[1])
-        # Bill
-        shiftidx[1] = shiftidx[1].sort_values()
         routes.loc[shiftidx[1], 'allocated_vehicle_id'] = (range(1, M+1))
         params = alloc.copy()
-        params['allocation_score'] = -1
-        scorecap = -1
-        specs = get_vehicle_specs([params['vehicle1'], params['vehicle2']],
-                                  connection, cur)
+        cache = {}
+
+        def allocate(n):
+            logger.debug(f"{str(date)[:10]}, {n} vehicles")
+            return allocate_shifts(routes, shiftidx, n, params, specs, cache)
+
         # If the score is negative, keep adding vehicles
-        while max(params['allocation_score'], scorecap) < 0:
-            logger.debug(f"{str(date)[:10]}, {N} vehicles")
-            # shift_scores = {}
-            allocation_results = {}
-            first_routes = routes.loc[shiftidx[1]]
-            # shift_scores[1] = 0
-            cols = ['allocated_vehicle_id', 'route_cost']
-            allocation_results[1] = first_routes[cols]
-            nshifts = len(shiftidx)
-            i = 2
-
-            while nshifts - i > -1:  # Iterate over remaining shifts
-                if len(shiftidx[i]) > 0:
-                    # Bill
-                    shiftidx[i] = shiftidx[i].sort_values()
-                    vehicleMat = vehicleMatrix(first_routes, N)
-                    pair_costs = cost_matrix(
-                        vehicleMat, routes.loc[shiftidx[i]], params, specs)
-                    allocation_results[i] = solve_assignment(pair_costs)
-                    # if there are more shifts to assign, merge previous shifts
-                    # and assing as firstjourneys
-                    if nshifts > i:
-                        secondJourneys = routes.loc[shiftidx[i]]
-                        secondJourneys[cols] = allocation_results[i]
-                        first_routes = mergeJourneys(
-                            first_routes, secondJourneys, params, specs)
-                i += 1
-            pairings = pd.concat(allocation_results.values())
-            params['allocation_score'] = pairings['route_cost'].min()
-            if params['cap_vehicles']:  # If the number of vehicles is capped
-                scorecap = 0  # Stops adding vehicles
-            N += 1
+        N, pairings = fleet_size_search(allocate, N, params['cap_vehicles'])
+        params['allocation_score'] = pairings['route_cost'].min()
         # Update num_v to the parameters table
-        N += -1
         params['num_v_final'] = N
-        update_alloc(params, connection, cur)
+        if update_fleet:
+            update_alloc(params, connection, cur)
         # Update t_route_allocated with the new vehicle IDs and route_cost
         pairings['allocation_id'] = params['allocation_id']
-        update_pairings(pairings, connection, cur)
+        if writer is None:
+            update_pairings(pairings, connection, cur)
+        else:
+            writer.add(pairings)
     # cnx.dispose()
     return N
 
@@ -513,8 +797,71 @@ def find_unallocated_dates(alloc, connection, cur):
     return dates
 
 
-def main(idx):
-    # Iterate over dates and call daily allocation
+def daily_worker(date, alloc, store):
+    """Allocates a single date in a worker process
+
+    Args:
+        date: date to allocate
+        alloc (dict): allocation parameters
+        store (RouteStore): routes of that date and the vehicle specs
+
+    Returns:
+        date, number of vehicles for that date (None if it failed) and the
+        pairings, which are written by the main process
+
+    The worker doesn't need a database connection: the routes come from the
+    store, the fleet size isn't updated and the pairings are only buffered.
+    """
+    writer = pw.PairingsWriter(None, None, flush_rows=0)
+    try:
+        N = daily(date, alloc, None, None, update_fleet=False, store=store,
+                  writer=writer)
+    except Exception as e:
+        logger.error(e)
+        N = None
+    return date, N, writer.pop()
+
+
+def parallel_dates(dates, alloc, store, workers, writer):
+    """Allocates the dates in a process pool, all from the same fleet size
+
+    Args:
+        dates (array): dates to allocate
+        alloc (dict): allocation parameters, num_v_final is the starting
+            number of vehicles
+        store (RouteStore): routes of the allocation and the vehicle specs
+        workers (int): number of worker processes
+        writer (PairingsWriter): buffers the pairings of every date
+
+    Returns:
+        dict: number of vehicles needed on each date
+    """
+    fleet = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Each task only gets the routes of its own date
+        futures = [executor.submit(daily_worker, date, alloc,
+                                   store.subset([date]))
+                   for date in dates]
+        for future in as_completed(futures):
+            date, N, pairings = future.result()
+            if N is not None:
+                fleet[date] = N
+                writer.add(pairings)
+    return fleet
+
+
+def main(idx, workers=None, second_pass=False):
+    """Iterates over dates and calls the daily allocation
+
+    Args:
+        idx (int): allocation ID
+        workers (int): number of processes allocating dates in parallel,
+            defaults to the date_workers environment variable
+        second_pass (bool): when running in parallel, re-run the dates that
+            needed fewer vehicles than the final fleet size
+    """
+    if workers is None:
+        workers = DATE_WORKERS
     try:
         connection, cur = dbh.database_connection('test')
         # cnx = dbh.create_alch_engine()
@@ -527,17 +874,38 @@ def main(idx):
         # Get date range
         date_range = pd.date_range(alloc['start_date'], alloc['end_date']
                                    ).values
-        for date in date_range[:]:
-            try:
-                alloc['num_v_final'] = daily(date, alloc, connection, cur)
-            except Exception as e:
-                logger.error(e)
+        store = load_route_store(alloc, connection, cur)
+        writer = pw.PairingsWriter(connection, cur)
+        if workers > 1:
+            fleet = parallel_dates(date_range, alloc, store, workers, writer)
+            # The fleet is the largest number of vehicles on any day
+            alloc['num_v_final'] = max(
+                [alloc['num_v_final']] + list(fleet.values()))
+            if second_pass:
+                rerun = [date for date in fleet
+                         if fleet[date] < alloc['num_v_final']]
+                logger.info(f"Second pass over {len(rerun)} dates with "
+                            f"{alloc['num_v_final']} vehicles")
+                fleet = parallel_dates(rerun, alloc, store, workers, writer)
+                alloc['num_v_final'] = max(
+                    [alloc['num_v_final']] + list(fleet.values()))
+            writer.flush()
+            update_alloc(alloc, connection, cur)
+        else:
+            for date in date_range[:]:
+                try:
+                    alloc['num_v_final'] = daily(date, alloc, connection,
+                                                 cur, store=store,
+                                                 writer=writer)
+                except Exception as e:
+                    logger.error(e)
+            writer.flush()
     except Exception as e:
         logger.error(e)
         SystemExit(e)
     finally:
         cur.close()
-        connection.close()
+        dbh.release_connection(connection)
         logger.info("Closed db connection")
     return
 
@@ -545,25 +913,27 @@ def main(idx):
 def run_unallocated(idx):
     try:
         connection, cur = dbh.database_connection('test')
-        cnx = dbh.create_alch_engine()
         alloc = get_allocation(idx, connection, cur)
         alloc['turnaround'], alloc['min_to_connect'] = get_turnaround_time(
             alloc['site_id'])
         # Get date range
         date_range = find_unallocated_dates(idx, connection, cur)
         print(idx, '# dates', len(date_range))
+        store = load_route_store(alloc, connection, cur)
+        writer = pw.PairingsWriter(connection, cur)
         for date in date_range:
             try:
-                _ = daily(date, alloc, connection, cur)
+                _ = daily(date, alloc, connection, cur, store=store,
+                          writer=writer)
             except Exception as e:
                 logger.error(e)
+        writer.flush()
     except Exception as e:
         logger.error(e)
         SystemExit(e)
     finally:
-        cnx.dispose()
         cur.close()
-        connection.close()
+        dbh.release_connection(connection)
         logger.info("Closed db connection")
     return
 
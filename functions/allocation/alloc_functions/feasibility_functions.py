@@ -7,6 +7,7 @@ from python_utils.utils.logger import logger
 import alloc_functions.cleanup as cleaner
 import alloc_functions.mixed as mixed
 import alloc_functions.controller as acf
+import alloc_functions.route_model as rm
 import matplotlib.pyplot as plt
 import matplotlib
 import matplotlib.dates as mdates
@@ -104,7 +105,7 @@ def routes_from_veh(routes, vehicle,
 def find_allocation(idx):
     """Find the allocation data based on allocation ID"""
     try:
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         sql_query = f"""SELECT * FROM t_allocation WHERE allocation_id={idx}
             LIMIT 1"""
         current_allocation = pd.read_sql_query(
@@ -112,8 +113,6 @@ def find_allocation(idx):
     except (Exception, psycopg2.Error) as error:
         logger.error("Error while fetching current allocation")
         raise(error)
-    finally:
-        cnx.dispose()
     return current_allocation
 
 
@@ -169,7 +168,7 @@ def tp_journeys(route, turn, tps):
 def find_vehicle_spec(specs):
     """Finds the vehicle specifications based on specification IDs"""
     try:
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         sql_query = f"""SELECT spec_id, vehicle_model, fuel_type, quoted_range_mile, energy_use,
             battery_size, charge_power_ac, charge_power_dc
             FROM t_vehicle_specification WHERE spec_id IN {specs}"""
@@ -177,14 +176,12 @@ def find_vehicle_spec(specs):
     except (Exception, psycopg2.Error) as error:
         logger.error("Error fetching vehicle specs")
         raise(error)
-    finally:
-        cnx.dispose()
     return df
 
 
 def find_tru_spec(specs):
     try:
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         sql_query = f"""SELECT tru_id, name, shorepower_summer_kw, shorepower_winter_kw,
             route_power_summer_kw, route_power_winter_kw
             FROM t_tru_specs WHERE tru_id IN {specs}"""
@@ -192,8 +189,6 @@ def find_tru_spec(specs):
     except (Exception, psycopg2.Error) as error:
         logger.error("Error fetching TRU specs")
         raise(error)
-    finally:
-        cnx.dispose()
     return df
 
 
@@ -221,23 +216,36 @@ def get_routes(alloc, connection, cur):
     return routes
 
 
-def get_intershift_periods(routes, grouped, idx):
-    """Find how many many HH charging periods are available
+def intershift_periods(routes, turn=TURN):
+    """Find how many HH charging periods are available in each vehicle duty
+
+    A half hour is free if the vehicle isn't on a route and has been back
+    for the turn: the free half hours are the ones in the gaps between a
+    route's arrival (plus the turn) and the next departure (minus a half
+    hour) of the same duty.
+
+    Args:
+        routes (DataFrame): routes with duty_id, departure_time and
+            arrival_time
+        turn (int): minutes to connect
+
+    Returns:
+        Series: number of half hours, indexed by duty ID
     """
-    start_dt = grouped.loc[idx, 'departure_time']
-    start_tp = (start_dt
-                - (start_dt - dt.datetime(2022, 1, 1)) % TIME_INT_IS)
-    end_dt = grouped.loc[idx, 'arrival_time']
-    end_tp = end_dt + (dt.datetime(2023, 1, 1) - end_dt) % TIME_INT_IS
-    tps = np.arange(start=start_tp, step=TIME_INT_IS, stop=end_tp)
-    masklist = []
-    dutyR = routes[routes['duty_id'] == idx].index
-    # Calculate IS shifts
-    for r in dutyR:
-        masklist.append(tp_journeys(routes.loc[r], TURN, tps))
-    n = len(masklist)
-    tps = np.sum(np.vstack(masklist).sum(axis=0) == n)
-    return tps
+    step = int(TIME_INT_IS / dt.timedelta(minutes=1))
+    ordered = pd.DataFrame({
+        'duty_id': routes['duty_id'].values,
+        'start': rm.floor_minutes(routes['departure_time']) - step,
+        'end': rm.ceil_minutes(routes['arrival_time']) + int(turn)})
+    ordered.sort_values(['duty_id', 'start'], kind='mergesort', inplace=True)
+    duties = ordered.groupby('duty_id')
+    # Latest return of the previous routes in the duty
+    gap_start = duties['end'].cummax().groupby(ordered['duty_id']).shift()
+    # Half hours in [gap_start, start]
+    first_tp = -(-gap_start // step)
+    last_tp = ordered['start'] // step
+    periods = (last_tp - first_tp + 1).clip(lower=0).fillna(0)
+    return periods.groupby(ordered['duty_id']).sum()
 
 
 def allocation_grouping(alloc, drive, max_rate_ac, max_rate_dc,
@@ -263,9 +271,7 @@ def allocation_grouping(alloc, drive, max_rate_ac, max_rate_dc,
         charging_rate_dc = max_rate_dc*charger_efficiency
         # For each daily duty calculate the number of possible intershift
         # half-hourly charging periods
-        for idx in grouped.index:
-            tps = get_intershift_periods(routes, grouped, idx)
-            grouped.loc[idx, 'TPs'] = tps
+        grouped['TPs'] = intershift_periods(routes).reindex(grouped.index)
         # Calculate real world energy consumption
         kwh_mile = drive / xmpg
         # Calculate how much extra mileage you can get in a vehicle duty
@@ -418,7 +424,7 @@ def upload_new_allocation(alloc, new_id, routes, ev_vehicle_map,
 
 def read_routes(comment):
     try:
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         sql_query = f"""SELECT route_id, actual_start_time, actual_end_time,
             number_order, distance_miles, site_id_start, site_id_end,
             vehicle_id FROM t_route_formatted
@@ -427,8 +433,6 @@ def read_routes(comment):
     except (Exception, psycopg2.Error) as error:
         logger.error("Error while fetching telematics")
         raise error
-    finally:
-        cnx.dispose
     # TODO Check datatypes
     return routes
 
@@ -443,18 +447,15 @@ def get_site_name_dict(client):
         dict: site ID: site name
     """
     try:
-        connection, cur = dbh.database_connection('test')
-        sql_query = f"""SELECT site_id, site_name
-            FROM t_sites WHERE client_id={client}"""
-        cur.execute(sql_query)
-        connection.commit()
-        site_data = cur.fetchall()
+        with dbh.pooled_connection('test') as (connection, cur):
+            sql_query = f"""SELECT site_id, site_name
+                FROM t_sites WHERE client_id={client}"""
+            cur.execute(sql_query)
+            connection.commit()
+            site_data = cur.fetchall()
     except (Exception, psycopg2.Error) as error:
         logger.error("Error while fetching site data")
         raise error
-    finally:
-        cur.close()
-        connection.close()
     site_name_dict = {site[0]: site[1]
                       for site in site_data}
     return site_name_dict
@@ -484,35 +485,31 @@ def read_telematics(runs, con):
 
 def find_runs(runs):
     try:
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         sql_query = f"""SELECT * FROM t_run_allocation
             WHERE run_id IN {runs}"""
         run_table = pd.read_sql_query(sql_query, cnx)
     except (Exception, psycopg2.Error) as error:
         logger.error("Error fetching run data")
         raise(error)
-    finally:
-        cnx.dispose()
     return run_table
 
 
 def load_charging_profile(scen):
     try:
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         sql_query = f"""SELECT * FROM t_charge_demand
             WHERE scenario_id={scen}"""
         demand = pd.read_sql_query(sql_query, cnx)
     except (Exception, psycopg2.Error) as error:
         logger.error("Error getting charge profiles")
         raise(error)
-    finally:
-        cnx.dispose()
     return demand
 
 
 def allocation_summary(allocation, drive, range_wltp):
     try:
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         alloc = find_allocation(allocation, cnx)
         routes = cleaner.get_allocated_routes(allocation)
         routes = cleaner.get_daily_route_data(routes, alloc).sort_index()
@@ -557,15 +554,12 @@ def allocation_summary(allocation, drive, range_wltp):
         n_veh = routes['allocated_vehicle_id'].max()
     except Exception as e:
         raise e
-    finally:
-        cnx.dispose()
     return [feasible, unfeasible_nois, unfeasible_withis, n_duties,
             n_routes, veh, site, n_veh]
 
 
 def allocation_summary2(allocation, range_real, connection, cur):
     try:
-        cnx = dbh.create_alch_engine()
         alloc = find_allocation(allocation)
         routes = cleaner.get_allocated_routes(allocation, connection, cur)
         routes = cleaner.get_daily_route_data(
@@ -580,52 +574,44 @@ def allocation_summary2(allocation, range_real, connection, cur):
         n_veh = len(routes['allocated_vehicle_id'].unique())
     except Exception as e:
         raise e
-    finally:
-        cnx.dispose()
     return [feasible, unfeasible_nois, n_duties, n_routes, n_veh]
 
 
 def original_routes(idx):
     try:
-        connection, cur = dbh.database_connection('test')
-        sql_query = f"""SELECT num_r, num_v_final FROM t_allocation WHERE allocation_id={idx}
-                ORDER BY allocation_id DESC LIMIT 1"""
-        cur.execute(sql_query)
-        connection.commit()
-        num = cur.fetchall()[0]
+        with dbh.pooled_connection('test') as (connection, cur):
+            sql_query = f"""SELECT num_r, num_v_final FROM t_allocation WHERE allocation_id={idx}
+                    ORDER BY allocation_id DESC LIMIT 1"""
+            cur.execute(sql_query)
+            connection.commit()
+            num = cur.fetchall()[0]
     except (Exception, psycopg2.Error) as error:
         logger.error("Error while fetching allocation table")
         raise error
-    finally:
-        cur.close()
-        connection.close()
     return num
 
 
 def find_scenario(allocation):
     scenario = 0
     try:
-        connection, cur = dbh.database_connection('test')
-        sql_query = f"""SELECT scenario_id FROM t_charging_scenarios
-            WHERE allocation_id={allocation}
-            ORDER BY scenario_id LIMIT 1"""
-        cur.execute(sql_query)
-        connection.commit()
-        fetch = cur.fetchall()
-        if len(fetch) > 0:
-            scenario = fetch[0][0]
+        with dbh.pooled_connection('test') as (connection, cur):
+            sql_query = f"""SELECT scenario_id FROM t_charging_scenarios
+                WHERE allocation_id={allocation}
+                ORDER BY scenario_id LIMIT 1"""
+            cur.execute(sql_query)
+            connection.commit()
+            fetch = cur.fetchall()
+            if len(fetch) > 0:
+                scenario = fetch[0][0]
     except (Exception, psycopg2.Error) as error:
         logger.error("Error finding scenario_id")
         raise error
-    finally:
-        cur.close()
-        connection.close()
     return scenario
 
 
 def find_all_scenarios(allocations):
     try:
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         sql_query = f"""SELECT scenario_id, allocation_id, smart_charging,
             output_kwh FROM t_charging_scenarios
             WHERE allocation_id IN {tuple(allocations)}
@@ -635,8 +621,6 @@ def find_all_scenarios(allocations):
     except (Exception, psycopg2.Error) as error:
         logger.error("Error while fetching scenario table")
         raise error
-    finally:
-        cnx.dispose()
     return scenarios
 
 
@@ -659,7 +643,7 @@ def good_scenario_check(df, a, scenarios):
 
 def find_max_demand(scenario):
     try:
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         sql_query = f"""SELECT datetime, power_demand_kw FROM t_charge_demand
             WHERE scenario_id={scenario}"""
         demand = pd.read_sql_query(sql_query, con=cnx
@@ -673,8 +657,6 @@ def find_max_demand(scenario):
     except (Exception, psycopg2.Error) as error:
         logger.error("Error fetching max demand")
         raise error
-    finally:
-        cnx.dispose()
     return max_demand, max_demand_time, mode_time
 
 
@@ -683,7 +665,7 @@ def find_max_demand(scenario):
 
 def plot_profile(scenario, date):
     try:
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         profiles_bau = load_charging_profile(scenario, cnx)
         charge_profiles = profiles_bau.groupby('datetime')['power_demand_kw'
                                                            ].sum()
@@ -711,8 +693,6 @@ def plot_profile(scenario, date):
             bbox_inches="tight", dpi=300)
     except Exception as e:
         logger.error(e)
-    finally:
-        cnx.dispose()
     return
 
 
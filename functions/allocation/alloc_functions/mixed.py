@@ -16,6 +16,7 @@ import pipeline_plan_functions.utils.pipe_db_handler as dbh
 import pipeline_plan_functions.utils.data_handler as dh
 import alloc_functions.cleanup as cleaner
 import alloc_functions.daily as adf
+import alloc_functions.route_model as rm
 from python_utils.utils.logger import logger
 logger.setLevel(os.getenv('log_level', "DEBUG"))
 
@@ -193,47 +194,48 @@ def rearrange_mixed(grouped, v):
 def grouped_mixed_fleet(journeys, v, ch, turn, specs):
     fastch = max(ch)
     groupedJ = group_routes(journeys)
-    for idx in groupedJ.index:
-        masklist = []
-        dutyR = journeys[(journeys['date'] == idx[0])
-                         & (journeys['allocated_vehicle_id'] == idx[1])].index
-        # Calculate IS shifts
-        for r in dutyR:
-            masklist.append(tp_journeys(journeys.loc[r], turn))
-        masklist.append(np.array(POTENTIAL_TPS_IS)
-                        > (groupedJ.loc[idx, 'departure_time']
-                           - groupedJ.loc[idx, 'route_date']))
-        masklist.append(np.array(POTENTIAL_TPS_IS)
-                        < (groupedJ.loc[idx, 'arrival_time']
-                           - groupedJ.loc[idx, 'route_date']))
-        n = len(masklist)
-        tps = np.sum(np.vstack(masklist).sum(axis=0) == n)
-        groupedJ.loc[idx, 'TPs'] = tps
+    duties = dict(rm.RouteTable.from_frame(
+        journeys, by=['date', 'allocated_vehicle_id']).groups())
+    vspecs = {veh: rm.VehicleSpec.from_dict(veh, specs[veh]) for veh in v}
+    step = int(TIME_INT_IS / dt.timedelta(minutes=1))
+    day_tps = np.arange(N) * step
+    mileage = groupedJ['equivalent_mileage'].values
+    ind_mileage = groupedJ['IndMileage'].values
+    payload = groupedJ['payload'].values
+    crates = groupedJ['number_crates'].values
+    all_tps = np.zeros(len(groupedJ))
+    allocated = np.zeros(len(groupedJ))
+    for j, idx in enumerate(groupedJ.index):
+        duty = duties[idx]
+        # Calculate IS shifts, same periods as tp_journeys()
+        tps = rm.floor_minutes([idx[0]])[0] + day_tps
+        busy = ((tps > duty.start[:, None] - step)
+                & (tps < duty.end[:, None] + int(turn)))
+        available = (~busy.any(axis=0) & (tps > duty.start.min())
+                     & (tps < duty.end.max()))
+        tps = np.sum(available)
+        all_tps[j] = tps
         feas = False
         i = 0
         # Calculate minimum vehicle required
         while feas is False:
             # print('v:', v, 'i:', i)
-            veh = v[i]
-            energy_req = (
-                groupedJ.loc[idx, 'equivalent_mileage']
-                * specs[veh]['energy_use'])
-            ind_energy_req = (
-                groupedJ.loc[idx, 'IndMileage'] * specs[veh]['energy_use'])
+            veh = vspecs[v[i]]
+            energy_req = mileage[j] * veh.energy_use
+            ind_energy_req = ind_mileage[j] * veh.energy_use
             isMax = fastch * CHARGER_EFF * TP_FRACT * tps
-            volweight = (
-                (groupedJ.loc[idx, 'payload']
-                 <= specs[veh]['max_load'] + DERROGATION)
-                & (groupedJ.loc[idx, 'number_crates']
-                   <= specs[veh]['max_crate']))
+            volweight = ((payload[j] <= veh.max_payload)
+                         & (crates[j] <= veh.max_crate))
             feasibility_mask = (
-                (energy_req - isMax < specs[veh]['battery_size'])
-                & (ind_energy_req < specs[veh]['battery_size'])
+                (energy_req - isMax < veh.battery_size)
+                & (ind_energy_req < veh.battery_size)
                 & volweight)
             if feasibility_mask:
                 feas = True
-                groupedJ.loc[idx, 'allocated_spec_id'] = veh
+                allocated[j] = veh.spec_id
             i += 1
+    groupedJ['TPs'] = all_tps
+    groupedJ['allocated_spec_id'] = allocated
     groupedJ, vDict = rearrange_mixed(groupedJ, v)
     groupedJ['energy_required_kwh'] = (
             groupedJ['equivalent_mileage']
@@ -372,7 +374,7 @@ def complete_alloc(allocation_id, connection, cur):
 def main(idx):
     try:
         connection, cur = dbh.database_connection('test')
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         # FIND THE MOST UP TO DATE RUN ID
         # run = dh.get_current_run(connection, cur)
         # Get mixed spec setting from t_run_allocation
@@ -433,9 +435,8 @@ def main(idx):
         logger.error(e)
         SystemExit(e)
     finally:
-        cnx.dispose()
         cur.close()
-        connection.close()
+        dbh.release_connection(connection)
         logger.info("Closed db connection")
     return
 
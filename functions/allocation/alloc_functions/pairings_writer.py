@@ -0,0 +1,118 @@
+# Bulk writer for t_route_allocated
+# Buffers the route/vehicle pairings, streams them into a temporary table with
+# COPY and applies them to t_route_allocated with a single upsert
+
+import io
+import os
+import pandas as pd
+import psycopg2
+from python_utils.utils.logger import logger
+logger.setLevel(os.getenv('log_level', "DEBUG"))
+
+TABLE = 't_route_allocated'
+KEY = ['route_id', 'allocation_id']
+# Buffered rows that trigger a flush (0 means only flush when asked to)
+FLUSH_ROWS = int(os.getenv('pairings_flush_rows', 50000))
+
+
+class PairingsWriter():
+    """Buffers pairings and upserts them into t_route_allocated in bulk
+
+    Args:
+        connection: psycopg2 connection
+        cur: psycopg2 cursor
+        flush_rows (int): flushes when this many rows are buffered, 0 to
+            flush only when flush() is called
+    """
+
+    def __init__(self, connection, cur, flush_rows=None):
+        self.connection = connection
+        self.cur = cur
+        self.flush_rows = FLUSH_ROWS if flush_rows is None else flush_rows
+        self._frames = []
+        self._rows = 0
+
+    def __len__(self):
+        return self._rows
+
+    def add(self, pairings):
+        """Adds pairings to the buffer
+
+        Args:
+            pairings (DataFrame): indexed by route_id, with an allocation_id
+                column and the columns to update
+        """
+        if len(pairings) == 0:
+            return
+        self._frames.append(pairings.reset_index())
+        self._rows += len(pairings)
+        if self.flush_rows and self._rows >= self.flush_rows:
+            self.flush()
+
+    def pop(self):
+        """Empties the buffer without writing it
+
+        Returns:
+            DataFrame: buffered pairings, indexed by route_id (None if empty)
+        """
+        if len(self._frames) == 0:
+            return None
+        pairings = pd.concat(self._frames, ignore_index=True)
+        self._frames = []
+        self._rows = 0
+        return pairings.set_index('route_id')
+
+    def flush(self):
+        """Writes the buffered pairings and commits"""
+        pairings = self.pop()
+        if pairings is None:
+            return
+        write_pairings(pairings, self.connection, self.cur)
+
+
+def write_pairings(pairings, connection, cur):
+    """Upserts pairings into t_route_allocated through a temporary table
+
+    Only the columns in pairings are updated. If a route appears more than
+    once, the last row is kept.
+
+    Args:
+        pairings (DataFrame): indexed by route_id, with an allocation_id
+            column and the columns to update
+        connection: psycopg2 connection
+        cur: psycopg2 cursor
+    """
+    pairings = pairings.reset_index()
+    pairings = pairings.drop_duplicates(subset=KEY, keep='last')
+    # COPY doesn't cast 1.0 into an integer column, so whole floats are
+    # written as integers
+    for c in pairings.columns:
+        values = pairings[c]
+        if (values.dtype.kind == 'f'
+                and (values.dropna() % 1 == 0).all()):
+            pairings[c] = values.astype('Int64')
+    cols = list(pairings.columns)
+    col_string = ", ".join(cols)
+    update_string = ", ".join(
+        [f"{c} = excluded.{c}" for c in cols if c not in KEY])
+    buffer = io.StringIO()
+    pairings.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    try:
+        # Keeps the column types, but not the NOT NULL constraints
+        cur.execute(f"""CREATE TEMP TABLE tmp_route_allocated
+            ON COMMIT DROP AS SELECT {col_string} FROM {TABLE}
+            WITH NO DATA""")
+        cur.copy_expert(f"""COPY tmp_route_allocated ({col_string})
+            FROM STDIN WITH (FORMAT csv)""", buffer)
+        cur.execute(f"""INSERT INTO {TABLE} ({col_string})
+            SELECT {col_string} FROM tmp_route_allocated
+            ON CONFLICT ({", ".join(KEY)}) DO UPDATE
+                SET {update_string}""")
+        connection.commit()
+        logger.debug(f"Wrote {len(pairings)} pairings to {TABLE}")
+    except (Exception, psycopg2.Error) as error:
+        connection.rollback()
+        logger.error(f"Error updating {TABLE} table")
+        raise error
+    return
@@ -0,0 +1,163 @@
+# Array-backed models of routes and vehicle specs
+# Routes are kept as numpy columns sorted by group (e.g. date and shift) and
+# departure time, so each group is a slice of the columns. Times are minutes
+# since the epoch.
+
+import numpy as np
+import pandas as pd
+
+DERROGATION = 725
+
+
+def floor_minutes(times):
+    """Minutes since the epoch of a datetime series, rounded down"""
+    values = pd.to_datetime(pd.Series(times)).values.astype('datetime64[ns]')
+    return values.astype('datetime64[m]').astype(np.int64)
+
+
+def ceil_minutes(times):
+    """Minutes since the epoch of a datetime series, rounded up"""
+    values = pd.to_datetime(pd.Series(times)).values.astype('datetime64[ns]')
+    minutes = values.astype('datetime64[m]')
+    return (minutes.astype(np.int64)
+            + (minutes.astype('datetime64[ns]') < values))
+
+
+def as_float(frame, col):
+    """float32 column, zeros if it's missing"""
+    if col not in frame.columns:
+        return np.zeros(len(frame), dtype=np.float32)
+    return frame[col].astype(float).fillna(0).values.astype(np.float32)
+
+
+class RouteTable():
+    """Columns of a set of routes, grouped and sorted by departure time
+
+    Departures are rounded down and arrivals rounded up to the minute, so
+    comparisons with whole-minute time periods (strictly after a departure,
+    strictly before an arrival) are the same as with the original times.
+
+    Args:
+        route_id (array): route IDs
+        start (array): departure time, minutes since the epoch
+        end (array): arrival time, minutes since the epoch
+        miles (array): distance (miles)
+        payload (array): payload (kg)
+        crates (array): number of crates
+        keys (list): group keys, one per group
+        bounds (array): first row of each group, and the number of rows
+    """
+    __slots__ = ('route_id', 'start', 'end', 'miles', 'payload', 'crates',
+                 'keys', 'bounds')
+
+    def __init__(self, route_id, start, end, miles, payload, crates,
+                 keys=None, bounds=None):
+        self.route_id = route_id
+        self.start = start
+        self.end = end
+        self.miles = miles
+        self.payload = payload
+        self.crates = crates
+        if bounds is None:
+            keys, bounds = [None], np.array([0, len(route_id)])
+        self.keys = keys
+        self.bounds = bounds
+
+    @classmethod
+    def from_frame(cls, routes, by=('date',), arrival='arrival_time',
+                   distance='distance_miles'):
+        """Builds the table from a DataFrame of routes indexed by route ID
+
+        Args:
+            routes (DataFrame): routes with departure_time and the arrival
+                and distance columns
+            by (list): columns to group the routes by
+            arrival (str): arrival time column
+            distance (str): distance column
+
+        Returns:
+            RouteTable
+        """
+        by = list(by)
+        frame = routes.sort_values(by + ['departure_time'], kind='mergesort')
+        if len(frame) > 0:
+            codes = frame.groupby(by, sort=True).ngroup().values
+            starts = np.flatnonzero(np.diff(codes)) + 1
+            bounds = np.concatenate([[0], starts, [len(frame)]])
+            first = frame[by].iloc[bounds[:-1]]
+            if len(by) == 1:
+                keys = list(first[by[0]])
+            else:
+                keys = list(first.itertuples(index=False, name=None))
+        else:
+            keys, bounds = [], np.array([0])
+        return cls(frame.index.values.astype(np.int64),
+                   floor_minutes(frame['departure_time']),
+                   ceil_minutes(frame[arrival]),
+                   as_float(frame, distance),
+                   as_float(frame, 'payload'),
+                   as_float(frame, 'number_crates'),
+                   keys, bounds)
+
+    def __len__(self):
+        return len(self.route_id)
+
+    @property
+    def ngroups(self):
+        return len(self.keys)
+
+    def group(self, i):
+        """View of the routes of the i-th group (no copies)"""
+        rows = slice(self.bounds[i], self.bounds[i+1])
+        return RouteTable(self.route_id[rows], self.start[rows],
+                          self.end[rows], self.miles[rows],
+                          self.payload[rows], self.crates[rows],
+                          [self.keys[i]])
+
+    def groups(self):
+        """Iterates over (key, view) for each group"""
+        for i in range(self.ngroups):
+            yield self.keys[i], self.group(i)
+
+    def group_reduce(self, ufunc, values):
+        """Reduces a column over each group, e.g. np.maximum or np.add"""
+        if len(values) == 0:
+            return values[:0]
+        return ufunc.reduceat(values, self.bounds[:-1])
+
+
+class VehicleSpec():
+    """Vehicle specification (a row of t_vehicle_specification)"""
+    __slots__ = ('spec_id', 'energy_use', 'battery_size', 'charge_power_ac',
+                 'charge_power_dc', 'max_load', 'max_crate', 'fuel_type')
+
+    FIELDS = __slots__
+
+    def __init__(self, spec_id, energy_use, battery_size, charge_power_ac,
+                 charge_power_dc, max_load, max_crate, fuel_type):
+        self.spec_id = spec_id
+        self.energy_use = energy_use
+        self.battery_size = battery_size
+        self.charge_power_ac = charge_power_ac
+        self.charge_power_dc = charge_power_dc
+        self.max_load = max_load
+        self.max_crate = max_crate
+        self.fuel_type = fuel_type
+
+    @classmethod
+    def from_dict(cls, spec_id, values):
+        """Builds a spec from a dict of columns, e.g. a DataFrame row"""
+        return cls(spec_id, *[values[f] for f in cls.FIELDS[1:]])
+
+    @property
+    def range(self):
+        """Range in miles (before the xmpg factor)"""
+        return self.battery_size / self.energy_use
+
+    @property
+    def max_payload(self):
+        """Maximum payload, including the derrogation"""
+        return self.max_load + DERROGATION
+
+    def __repr__(self):
+        return f"VehicleSpec({self.spec_id}, {self.fuel_type})"
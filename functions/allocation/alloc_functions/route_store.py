@@ -0,0 +1,94 @@
+# In-memory store of an allocation's routes
+# Loads all the allocated routes with their original route data in a single
+# query, so the daily allocation doesn't need to query the database per date
+
+import pandas as pd
+import os
+import psycopg2
+from python_utils.utils.logger import logger
+logger.setLevel(os.getenv('log_level', "DEBUG"))
+
+ROUTE_COLS = ['departure_time', 'arrival_time', 'distance_miles',
+              'payload', 'number_crates']
+
+
+def get_allocation_routes(alloc, connection, cur):
+    """Fetches every allocated route of an allocation with its route data
+
+    Args:
+        alloc (dict): allocation parameters
+        connection: psycopg2 connection
+        cur: psycopg2 cursor
+
+    Returns:
+        DataFrame: a row per route, indexed by route ID and sorted by date
+    """
+    route_cols = ", ".join([f"rt.{c}" for c in ROUTE_COLS])
+    try:
+        sql_query = f"""SELECT ra.*, {route_cols}
+            FROM t_route_allocated ra
+            JOIN {alloc['route_table']} rt ON rt.route_id = ra.route_id
+            WHERE ra.allocation_id={alloc['allocation_id']}
+            AND rt.source = {alloc['source']}
+            ORDER BY ra.date, ra.route_id"""
+        cur.execute(sql_query)
+        connection.commit()
+        routes_fetch = cur.fetchall()
+        desc = cur.description
+        column_names = [col[0] for col in desc]
+        routes = pd.DataFrame(routes_fetch, columns=column_names)
+        routes.set_index('route_id', inplace=True)
+    except (Exception, psycopg2.Error) as error:
+        logger.error("Error while fetching allocation routes")
+        raise error
+    return routes
+
+
+def prepare_routes(routes, params):
+    """Adds the columns used by the daily allocation"""
+    routes = routes.copy()
+    routes['date'] = pd.to_datetime(routes['date'])
+    routes['route_cost'] = 0
+    routes['allocated_vehicle_id'] = 0
+    routes['equivalent_mileage'] = routes['distance_miles'] / params['xmpg']
+    routes['payload'] = routes['payload'].astype(float).fillna(0)
+    routes['number_crates'] = routes['number_crates'].fillna(0)
+    return routes
+
+
+class RouteStore():
+    """Routes of an allocation grouped by date, and the vehicle specs
+
+    Args:
+        routes (DataFrame): routes from prepare_routes()
+        specs (dict): vehicle specs, see daily.get_vehicle_specs
+    """
+
+    def __init__(self, routes, specs):
+        self.routes = routes
+        self.specs = specs
+        self._date_rows = {
+            pd.Timestamp(date): rows
+            for date, rows in routes.groupby('date').indices.items()}
+
+    def __len__(self):
+        return len(self.routes)
+
+    def dates(self):
+        """Dates that have routes"""
+        return sorted(self._date_rows.keys())
+
+    def day_routes(self, date):
+        """Copy of the routes of a single date"""
+        rows = self._date_rows.get(pd.Timestamp(date), [])
+        return self.routes.iloc[rows].copy()
+
+    def subset(self, dates):
+        """New store with only the routes of some dates"""
+        rows = [self._date_rows[pd.Timestamp(d)] for d in dates
+                if pd.Timestamp(d) in self._date_rows]
+        if len(rows) > 0:
+            routes = pd.concat([self.routes.iloc[r] for r in rows])
+        else:
+            routes = self.routes.iloc[[]]
+        return RouteStore(routes, self.specs)
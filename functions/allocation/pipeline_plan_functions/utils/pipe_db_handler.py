@@ -1,7 +1,10 @@
 import os
 import sys
+import time
+from contextlib import contextmanager
 # import pandas as pd
 import psycopg2
+import psycopg2.pool
 import sqlalchemy
 from python_utils.utils.logger import logger
 
@@ -9,8 +12,22 @@ CDIR = os.path.dirname(os.path.abspath(__file__))
 
 sys.path.append(CDIR)
 
+# Connection pool settings
+POOL_MIN = int(os.getenv('pipe_db_pool_min', 1))
+POOL_MAX = int(os.getenv('pipe_db_pool_max', 5))
+POOL_TIMEOUT = float(os.getenv('pipe_db_pool_timeout', 30))  # seconds
+CONNECT_TIMEOUT = int(os.getenv('pipe_db_connect_timeout', 10))  # seconds
 
-def database_connection(type='test'):
+# Pools and engine of this process, by database type. A forked process must
+# not use (or close) the connections of its parent
+_pools = {}
+_engine = {}
+_inherited = []
+# Process that created them
+_owner_pid = None
+
+
+def connection_params(type='test'):
     if type == 'test':
         db_user = os.getenv('pipe_db_user', "")
         db_pswd = os.getenv('pipe_db_pswd', "")
@@ -32,11 +49,20 @@ def database_connection(type='test'):
         db_host = os.getenv('pipe_prod_host', "")
         db_port = os.getenv('pipe_prod_port', "")
     db_ssl = os.getenv('psgrsql_ssl_mode', "require")
+    return dict(user=db_user, password=db_pswd, host=db_host, port=db_port,
+                database=db_name, sslmode=db_ssl)
+
+
+def database_connection(type='test'):
+    """Checks out a connection from the pool for a long-running caller
+
+    The caller keeps it until it returns it with release_connection().
+
+    Returns:
+        connection, cursor
+    """
     try:
-        connection = psycopg2.connect(
-            user=db_user, password=db_pswd,
-            host=db_host,
-            port=db_port, database=db_name, sslmode=db_ssl)
+        connection = _getconn(get_pool(type))
         cur = connection.cursor()
     except psycopg2.OperationalError as oe:
         logger.exception(oe)
@@ -44,15 +70,110 @@ def database_connection(type='test'):
     return connection, cur
 
 
+def release_connection(connection, type='test'):
+    """Returns a connection from database_connection() to the pool
+
+    Anything not committed is rolled back, as if it had been closed.
+    """
+    _check_pid()
+    pool = _pools.get(type)
+    if not connection.closed:
+        connection.rollback()
+    if pool is None:
+        # The pool was closed in the meantime
+        connection.close()
+        return
+    pool.putconn(connection, close=bool(connection.closed))
+    return
+
+
+def _check_pid():
+    # Drops the pools and engine inherited from a parent process. They are
+    # kept referenced so they are never closed from this process
+    global _owner_pid
+    pid = os.getpid()
+    if _owner_pid is not None and _owner_pid != pid:
+        _inherited.append((dict(_pools), dict(_engine)))
+        _pools.clear()
+        _engine.clear()
+    _owner_pid = pid
+
+
+def get_pool(type='test'):
+    """Connection pool of this process for a database type"""
+    _check_pid()
+    if type not in _pools:
+        try:
+            _pools[type] = psycopg2.pool.ThreadedConnectionPool(
+                POOL_MIN, POOL_MAX, connect_timeout=CONNECT_TIMEOUT,
+                **connection_params(type))
+        except psycopg2.OperationalError as oe:
+            logger.exception(oe)
+            raise oe
+    return _pools[type]
+
+
+def _getconn(pool):
+    # Waits up to pipe_db_pool_timeout seconds for a free, open connection
+    deadline = time.monotonic() + POOL_TIMEOUT
+    while True:
+        try:
+            connection = pool.getconn()
+        except psycopg2.pool.PoolError as pe:
+            if time.monotonic() > deadline:
+                logger.error("Timed out waiting for a database connection")
+                raise pe
+            time.sleep(0.1)
+            continue
+        if connection.closed:
+            pool.putconn(connection, close=True)
+            continue
+        return connection
+
+
+@contextmanager
+def pooled_connection(type='test'):
+    """Checks out a connection and cursor from the pool
+
+    The transaction is rolled back if the block raises an exception, and the
+    connection goes back to the pool at the end. Waits up to
+    pipe_db_pool_timeout seconds for a free connection.
+
+    Yields:
+        connection, cursor
+    """
+    pool = get_pool(type)
+    connection = _getconn(pool)
+    cur = connection.cursor()
+    try:
+        yield connection, cur
+    except Exception:
+        if not connection.closed:
+            connection.rollback()
+        raise
+    finally:
+        cur.close()
+        pool.putconn(connection, close=bool(connection.closed))
+
+
+def close_pools():
+    """Closes the connections of this process"""
+    _check_pid()
+    for type in list(_pools):
+        _pools.pop(type).closeall()
+    if 'engine' in _engine:
+        _engine.pop('engine').dispose()
+    return
+
+
 def create_alch_engine():
+    """Creates a new engine, use get_engine() to share the process' engine"""
     db_user = os.getenv('pipe_db_user', "")
     db_pswd = os.getenv('pipe_db_pswd', "")
     db_name = os.getenv('pipe_db_name', "")
     db_host = os.getenv('pipe_db_host', "")
     db_port = os.getenv('pipe_db_port', "")
 
-
-
     db_conn_str = sqlalchemy.engine.URL.create(
         drivername='postgresql+psycopg2',
         username=db_user,
@@ -62,20 +183,29 @@ def create_alch_engine():
         port=db_port,
         query={'sslmode': 'require'},
         )
-    cnx = sqlalchemy.create_engine(db_conn_str)
+    cnx = sqlalchemy.create_engine(
+        db_conn_str, pool_size=POOL_MAX, pool_timeout=POOL_TIMEOUT,
+        pool_pre_ping=True,
+        connect_args={'connect_timeout': CONNECT_TIMEOUT})
     return cnx
 
 
+def get_engine():
+    """SQLAlchemy engine shared by this process, don't dispose of it"""
+    _check_pid()
+    if 'engine' not in _engine:
+        _engine['engine'] = create_alch_engine()
+    return _engine['engine']
+
+
 def upload_table(df, table):
     try:
-        cnx = create_alch_engine()
+        cnx = get_engine()
         df.to_sql(table, con=cnx, if_exists='append', index=False)
         logger.debug(f"Uploaded to {table}")
     except Exception as e:
         logger.info(f"Error uploading table to {table}")
         raise e
-    finally:
-        cnx.dispose()
     return
 
 
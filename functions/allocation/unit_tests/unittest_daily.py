@@ -0,0 +1,154 @@
+'''
+unittest_daily.py
+'''
+
+import unittest
+
+import os
+import sys
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+CDIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.append(os.path.join(CDIR, '..'))
+from python_utils.utils.logger import logger
+import alloc_functions.daily as daily
+
+logger.setLevel('CRITICAL')
+
+# logger.setLevel('DEBUG')
+
+SPECS = {'pack': [50., 75.], 'drive': [0.3, 0.35],
+         'rang': [50. / 0.3, 75. / 0.35],
+         'payload': [1725, 1925], 'crates': [80, 100],
+         'max_charge_ac': [7, 7], 'max_charge_dc': [50, 50]}
+PARAMS = {'turnaround': 20, 'min_to_connect': 35, 'charger1': 7,
+          'charger2': 22, 'cap_vehicles': False}
+DAY = pd.Timestamp('2021-06-01')
+
+
+def vehicles(arrivals, mileage):
+    '''A row per vehicle with the end of its last route'''
+    return pd.DataFrame({
+        'allocated_vehicle_id': range(1, len(arrivals) + 1),
+        'arrival_time': [DAY + pd.Timedelta(a) for a in arrivals],
+        'equivalent_mileage': mileage, 'payload': 500.,
+        'number_crates': 20.})
+
+
+def routes(departures, mileage):
+    '''Routes to assign, indexed by route ID'''
+    return pd.DataFrame({
+        'departure_time': [DAY + pd.Timedelta(d) for d in departures],
+        'equivalent_mileage': mileage, 'payload': 500.,
+        'number_crates': 20.},
+        index=pd.Index(range(101, len(departures) + 101), name='route_id'))
+
+
+class TestCostMatrix(unittest.TestCase):
+    def test_turnaround_seconds(self):
+        # The second vehicle is back 40 s too late for the turnaround
+        first = vehicles(['10:00:00', '10:00:40'], 10.)
+        second = routes(['10:20:00'], 10.)
+        cost = daily.cost_matrix(first, second, PARAMS, SPECS)['Cost']
+        self.assertEqual(cost[(101, 1)], 1)
+        self.assertEqual(cost[(101, 2)], -2)
+
+    def test_intershift_slots_seconds(self):
+        # 59 min 50 s after plugging in is a single 30 min slot
+        first = vehicles(['10:00:40'], 110.)
+        second = routes(['11:35:30'], 110.)
+        slots = daily.calculate_IStps(
+            first['arrival_time'][0], second['departure_time'][101],
+            dt.timedelta(minutes=PARAMS['min_to_connect']))
+        self.assertEqual(slots, 1)
+        cost = daily.cost_matrix(first, second, PARAMS, SPECS)['Cost']
+        energy = 220 * SPECS['drive'][1] - SPECS['pack'][1]
+        is_max = 7 * daily.CHARGER_EFF * daily.TP_FRACT_IS * slots
+        self.assertAlmostEqual(cost[(101, 1)], 0.5 - 0.25 * energy / is_max)
+
+    def test_on_time_matches_datetimes(self):
+        rng = np.random.default_rng(0)
+        offsets = rng.integers(8 * 3600, 12 * 3600, 40)
+        first = vehicles([pd.Timedelta(seconds=int(s)) for s in offsets[:20]],
+                         10.)
+        second = routes([pd.Timedelta(seconds=int(s)) for s in offsets[20:]],
+                        10.)
+        cost = daily.cost_matrix(first, second, PARAMS, SPECS)['Cost']
+        turn = dt.timedelta(minutes=PARAMS['turnaround'])
+        for (route, vehicle), c in cost.items():
+            on_time = (first['arrival_time'][vehicle - 1]
+                       <= second['departure_time'][route] - turn)
+            self.assertEqual(c >= 0, on_time)
+
+
+def multi_shift_day(seed, R=24, shifts=3):
+    '''Random routes of a day over several shifts, first shift assigned'''
+    rng = np.random.default_rng(seed)
+    shift = rng.integers(1, shifts + 1, R)
+    dep = np.array([rng.integers(300 * s, 300 * s + 200) for s in shift])
+    dur = rng.integers(60, 280, R)
+    day = pd.DataFrame({
+        'date': DAY, 'shift': shift,
+        'departure_time': [DAY + pd.Timedelta(minutes=int(d)) for d in dep],
+        'arrival_time': [DAY + pd.Timedelta(minutes=int(d + t))
+                         for d, t in zip(dep, dur)],
+        'distance_miles': rng.uniform(20, 180, R),
+        'payload': rng.uniform(0, 1500, R),
+        'number_crates': rng.integers(0, 90, R).astype(float),
+        'route_cost': 0, 'allocated_vehicle_id': 0},
+        index=pd.Index(range(1, R + 1), name='route_id'))
+    day['equivalent_mileage'] = day['distance_miles'] / 0.9
+    shiftidx = daily.separate_shift_idsx(day)
+    for i in shiftidx:
+        shiftidx[i] = shiftidx[i].sort_values()
+    M = len(shiftidx[1])
+    day.loc[shiftidx[1], 'allocated_vehicle_id'] = range(1, M + 1)
+    return day, shiftidx
+
+
+class TestFleetSizeSearch(unittest.TestCase):
+    def test_linear(self):
+        tried = []
+
+        def allocate(n):
+            tried.append(n)
+            # Fits in 3 and 5 vehicles, but not in 4
+            return pd.DataFrame({'route_cost': [1 if n in (3, 5) else -n]})
+
+        search = daily.FLEET_SEARCH
+        try:
+            daily.FLEET_SEARCH = 'linear'
+            N, _ = daily.fleet_size_search(allocate, 1)
+        finally:
+            daily.FLEET_SEARCH = search
+        self.assertEqual(N, 3)
+        self.assertEqual(tried, [1, 2, 3])
+
+    def test_modes_multi_shift(self):
+        added = []
+        for seed in range(8):
+            day, shiftidx = multi_shift_day(seed)
+            N0 = len(shiftidx[1])
+            results = {}
+            for mode in ['linear', 'bisect']:
+                cache = {}
+                results[mode] = daily.fleet_size_search(
+                    lambda n: daily.allocate_shifts(
+                        day, shiftidx, n, PARAMS, SPECS, cache),
+                    N0, mode=mode)
+            N, pairings = results['linear']
+            added.append(N - N0)
+            self.assertGreaterEqual(pairings['route_cost'].min(), 0)
+            # bisect finds a fleet the routes fit in, but not always the
+            # smallest one
+            N_bisect, pairings_bisect = results['bisect']
+            self.assertLessEqual(N, N_bisect)
+            self.assertGreaterEqual(pairings_bisect['route_cost'].min(), 0)
+        self.assertGreater(max(added), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
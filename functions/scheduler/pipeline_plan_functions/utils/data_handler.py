@@ -178,7 +178,7 @@ def add_missing_vehicle_id(ids, client_id, connection, cur):
         connection (_type_): _description_
         cur (_type_): _description_
     """
-    cnx = dbh.create_alch_engine()
+    cnx = dbh.get_engine()
     start_id = get_fps_vehicle_id(connection, cur) + 1
     df = pd.DataFrame(data=ids, columns=['client_vehicle_id'])
     df['site_id'] = 1
@@ -188,7 +188,6 @@ def add_missing_vehicle_id(ids, client_id, connection, cur):
     df['registration'] = ""
     df['client_id'] = client_id
     df.to_sql('t_vehicles', con=cnx, if_exists='append', index=False)
-    cnx.dispose()
     logger.debug(f"New vehicles added to the database from {start_id} to "
                  f"{df['vehicle_id'].max()}")
     return
@@ -1,11 +1,18 @@
 from scheduling_functions import controller
-from scheduling_functions import schedule_scenario
+from scheduling_functions import runner
+import pipeline_plan_functions.utils.pipe_db_handler as dbh
 # import numpy as np
 
 scenarios = []
+# Scenarios that are run again start from their last checkpoint
+resume = False
 
 if __name__ == '__main__':
     if scenarios == []:
         scenarios = controller.main()
-    for scen in scenarios:
-        schedule_scenario.main(scen)
+    else:
+        # Scenarios that are run again
+        with dbh.pooled_connection('test') as (connection, cur):
+            controller.reset_scenarios(scenarios, connection, cur)
+    # Several scenarios are scheduled at the same time (schedule_parallel)
+    runner.main(scenarios, resume=resume)
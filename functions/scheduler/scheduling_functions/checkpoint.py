@@ -0,0 +1,61 @@
+# Checkpoints of the scenarios being scheduled
+# A checkpoint keeps the next day to schedule, the SOC of each vehicle and the
+# running totals of a scenario in a local file, so a scenario that crashed can
+# be resumed from its last committed day instead of from the first day
+
+import os
+import pickle
+from python_utils.utils.logger import logger
+
+logger.setLevel(os.getenv('log_level', "DEBUG"))
+
+# Days scheduled between checkpoints (0 to disable them)
+CHECKPOINT_DAYS = int(os.getenv('schedule_checkpoint_days', 30))
+# Folder of the checkpoint files
+CHECKPOINT_DIR = os.getenv('schedule_checkpoint_dir', 'checkpoints')
+
+
+def checkpoint_path(scenario):
+    """File of a scenario's checkpoint"""
+    return os.path.join(CHECKPOINT_DIR, f"scenario_{scenario}.pkl")
+
+
+def save(scenario, state):
+    """Saves a scenario's checkpoint
+
+    The file is replaced in a single step, so a crash while saving leaves the
+    previous checkpoint.
+
+    Args:
+        scenario (int): scenario ID
+        state (dict): day, rel_charge and the running totals of the scenario
+    """
+    path = checkpoint_path(scenario)
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(path + '.tmp', path)
+    logger.info(f"Checkpoint of scenario {scenario} at day {state['day']}")
+    return
+
+
+def load(scenario):
+    """Loads a scenario's checkpoint, None if it doesn't have one"""
+    path = checkpoint_path(scenario)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError) as e:
+        logger.warning(f"Unable to read checkpoint of scenario {scenario}: "
+                       f"{e}")
+        return None
+
+
+def clear(scenario):
+    """Deletes a scenario's checkpoint once it is scheduled"""
+    path = checkpoint_path(scenario)
+    if os.path.exists(path):
+        os.remove(path)
+    return
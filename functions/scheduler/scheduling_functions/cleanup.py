@@ -1,55 +1,196 @@
 from python_utils.utils.logger import logger
+import io
+import os
+import queue
+import threading
 import pandas as pd
 import psycopg2
 import numpy as np
 
 TIME_FRACT = 0.5
+CHARGE_DEMAND_TABLE = 't_charge_demand'
+CHARGE_DEMAND_COLS = ['datetime', 'allocated_vehicle_id', 'power_demand_kw',
+                      'scenario_id', 'vehicle_soc']
+# Rows of t_charge_demand buffered before they are copied to the database
+FLUSH_ROWS = int(os.getenv('charge_demand_flush_rows', 500000))
+# Copies from a background thread, so the scheduling doesn't wait for it
+BACKGROUND = os.getenv('charge_demand_background', 'true').lower() == 'true'
 
-# Bill adding one parameter
-def export_charge_schedule(output, output_soc, settings, vehicles, times, cnx):
-    """Creates a profile from the scheduler and upload to the database
+
+def charge_demand_csv(times, vehicles, output, output_soc, scenario_id):
+    """Rows of t_charge_demand as CSV, a row per time period and vehicle
 
     Args:
-        output (array): output from optimiser, energy output (in kWh) per
-                HH per vehicle
-        settings (dict): user settings and global variables
-        vehicles (list): list of vehicle IDs
-        times (array): list of time intervals
-        cnx: sqalchemy connection engine
+        times (array): time period labels
+        vehicles (array): vehicle IDs
+        output (2D array): energy output (kWh) per time period per vehicle
+        output_soc (2D array): SOC per time period per vehicle
+        scenario_id (int): scenario ID
+
+    Returns:
+        StringIO: CSV with the CHARGE_DEMAND_COLS columns, without header
     """
-    scenario_id = settings['scenario_id']
-    # Create table of the charging outputs (kWh) per time period per vehicle.
-    charge_outputs = pd.DataFrame(data=output)
-    charge_outputs['datetime'] = times
-    charge_outputs.set_index('datetime', inplace=True)
-    charge_outputs.columns = vehicles
-    # Convert the energy to power (kW)
-    schedule = (charge_outputs.stack() / TIME_FRACT
-                ).to_frame(name='power_demand_kw')
-    schedule['scenario_id'] = scenario_id
-    schedule.reset_index(inplace=True)
-    schedule.rename(columns={'level_1': 'allocated_vehicle_id'}, inplace=True)
-    # Bill adding 
-    soc_outputs = pd.DataFrame(data=output_soc)
-    soc_outputs['datetime'] = times
-    soc_outputs.set_index('datetime', inplace=True)
-    soc_outputs.columns = vehicles
-    schedule_soc = (soc_outputs.stack()
-                ).to_frame(name='vehicle_soc')
-    schedule_soc['scenario_id'] = scenario_id
-    schedule_soc.reset_index(inplace=True)
-    schedule_soc.rename(columns={'level_1': 'allocated_vehicle_id'}, inplace=True)
-    schedule = schedule.merge(schedule_soc,on=['datetime','allocated_vehicle_id','scenario_id'],how='left')
-    postgreSQLTable = "t_charge_demand"
-    try:
-        schedule.to_sql(postgreSQLTable, con=cnx, if_exists='append',
-                        index=False)
-        logger.debug(f"Updated schedule for scenario {scenario_id} "
-                     "in t_charge_demand")
-    except Exception as e:
-        logger.error(f"Unable to export schedule for scenario {scenario_id}")
-        logger.exception(e)
-    return
+    T, N = output.shape
+    schedule = pd.DataFrame({
+        'datetime': np.repeat(times, N),
+        'allocated_vehicle_id': np.tile(vehicles, T),
+        # Convert the energy to power (kW)
+        'power_demand_kw': output.reshape(-1) / TIME_FRACT,
+        'scenario_id': scenario_id,
+        'vehicle_soc': output_soc.reshape(-1)})
+    # Periods without an output aren't exported
+    schedule = schedule[schedule['power_demand_kw'].notna()]
+    buffer = io.StringIO()
+    schedule.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+class ChargeDemandWriter():
+    """Buffers a scenario's charge schedules and copies them to the database
+
+    The daily outputs are added to preallocated arrays and written to
+    t_charge_demand with COPY every flush_rows rows, optionally from a
+    background thread. Nothing is committed until checkpoint() or close().
+
+    Args:
+        connection: psycopg2 connection used only by the writer
+        cur: psycopg2 cursor of the connection
+        scenario_id (int): scenario ID
+        vehicles (list): vehicle IDs
+        nperiods (int): number of time periods of the scenario
+        flush_rows (int): copies when this many rows are buffered
+        background (bool): copies from a background thread
+        first_row (int): first time period added, e.g. when a scenario is
+            resumed
+    """
+
+    def __init__(self, connection, cur, scenario_id, vehicles, nperiods,
+                 flush_rows=None, background=None, first_row=0):
+        self.connection = connection
+        self.cur = cur
+        self.scenario_id = scenario_id
+        self.vehicles = np.asarray(vehicles)
+        self.flush_rows = FLUSH_ROWS if flush_rows is None else flush_rows
+        background = BACKGROUND if background is None else background
+        N = len(vehicles)
+        self.times = np.empty(nperiods, dtype=object)
+        self.output = np.zeros((nperiods, N))
+        self.output_soc = np.zeros((nperiods, N))
+        # Rows added, and rows already sent to be copied
+        self.filled = first_row
+        self.flushed = first_row
+        self.rows_written = 0
+        self._error = None
+        self._queue = None
+        if background:
+            self._queue = queue.Queue(maxsize=4)
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def discard(self, start):
+        """Deletes the scenario's rows from start on, so they aren't
+        duplicated when it runs again. Committed with the new rows"""
+        try:
+            self.cur.execute(
+                f"""DELETE FROM {CHARGE_DEMAND_TABLE}
+                WHERE scenario_id={self.scenario_id}
+                AND datetime >= '{start}'""")
+        except (Exception, psycopg2.Error) as error:
+            self.connection.rollback()
+            logger.error("Error deleting the previous schedule of scenario "
+                         f"{self.scenario_id}")
+            raise error
+        return
+
+    def add(self, output, output_soc, times):
+        """Adds the outputs and SOC of some time periods (e.g. a day)"""
+        T = len(output)
+        if self.filled + T > len(self.output):
+            raise ValueError("More time periods than the scenario has")
+        rows = slice(self.filled, self.filled + T)
+        self.times[rows] = pd.DatetimeIndex(times).strftime(
+            '%Y-%m-%d %H:%M:%S')
+        self.output[rows] = output
+        self.output_soc[rows] = output_soc
+        self.filled += T
+        if (self.filled - self.flushed) * len(self.vehicles) >= \
+                self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        """Sends the buffered rows to be copied (not committed)"""
+        self._raise_error()
+        rows = slice(self.flushed, self.filled)
+        self.flushed = self.filled
+        if rows.stop == rows.start:
+            return
+        chunk = (self.times[rows], self.output[rows], self.output_soc[rows])
+        if self._queue is None:
+            self._copy(chunk)
+        else:
+            self._queue.put(chunk)
+
+    def checkpoint(self):
+        """Copies the buffered rows and commits everything written so far"""
+        self.flush()
+        self._wait()
+        self._raise_error()
+        self.connection.commit()
+        logger.debug(f"Committed {self.rows_written} rows of "
+                     f"{CHARGE_DEMAND_TABLE} for scenario {self.scenario_id}")
+
+    def close(self):
+        """Copies the rest of the rows, commits and stops the thread"""
+        try:
+            self.checkpoint()
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stops the background thread, without committing"""
+        if self._queue is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._queue = None
+
+    def _copy(self, chunk):
+        times, output, output_soc = chunk
+        buffer = charge_demand_csv(times, self.vehicles, output, output_soc,
+                                   self.scenario_id)
+        cols = ", ".join(CHARGE_DEMAND_COLS)
+        try:
+            self.cur.copy_expert(
+                f"""COPY {CHARGE_DEMAND_TABLE} ({cols})
+                FROM STDIN WITH (FORMAT csv)""", buffer)
+            self.rows_written += len(output) * len(self.vehicles)
+        except (Exception, psycopg2.Error) as error:
+            self.connection.rollback()
+            logger.error("Unable to export schedule for scenario "
+                         f"{self.scenario_id}")
+            raise error
+
+    def _run(self):
+        # Background thread, copies the chunks until it gets None
+        while True:
+            chunk = self._queue.get()
+            try:
+                if chunk is not None and self._error is None:
+                    self._copy(chunk)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+            if chunk is None:
+                break
+
+    def _wait(self):
+        if self._queue is not None:
+            self._queue.join()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
 
 
 def calculate_breaches(output, capacity):
@@ -70,28 +211,63 @@ def calculate_breaches(output, capacity):
     return breach_vector.sum()
 
 
-def excess_capacity_cost(output, capacity, distribution, connection, cur):
-    """Calculate the electricity excess capacity costs"""
-    if distribution == -1:
+class ScenarioContext():
+    """Tariff constants and system parameters of a scenario, loaded once
+
+    Args:
+        distribution (int): distribution ID, -1 if there isn't one
+        charge_kva (float): excess capacity charge (£/kVA/day)
+        power_factor (float): power factor
+    """
+
+    def __init__(self, distribution, charge_kva=0, power_factor=1):
+        self.distribution = distribution
+        self.charge_kva = charge_kva
+        self.power_factor = power_factor
+
+    @classmethod
+    def load(cls, distribution, connection, cur):
+        """Fetches the constants of a distribution"""
+        if distribution == -1:
+            return cls(distribution)
+        try:
+            # Get excess capacity charge £/kVA/day
+            sql_query = (
+                f"""SELECT exceeded_capacity_charge FROM t_electricity_price
+                WHERE distribution_id={distribution} LIMIT 1""")
+            cur.execute(sql_query)
+            connection.commit()
+            charge_kva = float(cur.fetchall()[0][0])
+            # Get power factor
+            sql_query = (
+                """SELECT parameter_value FROM t_system_parameters
+                WHERE parameter_name='power_factor' LIMIT 1""")
+            cur.execute(sql_query)
+            connection.commit()
+            power = float(cur.fetchall()[0][0])
+        except (Exception, psycopg2.Error) as error:
+            logger.error("Error fetching the excess capacity charges")
+            raise error
+        return cls(distribution, charge_kva, power)
+
+
+def excess_capacity_cost(output, capacity, context):
+    """Calculate the electricity excess capacity costs
+
+    Args:
+        output (2D array): energy output (kWh) per time period per vehicle
+        capacity (1D array): available site capacity (kW) per time period
+        context (ScenarioContext): excess capacity charge and power factor
+
+    Returns:
+        float: excess capacity cost over all the time periods
+    """
+    if context.distribution == -1:
         return 0
     # How many kWh go over the available site capacity
     excess_kwh = np.clip(output.sum(axis=1) - capacity * TIME_FRACT,
                          a_min=0, a_max=None).sum()
-    # Get excess capacity charge £/kVA/day
-    sql_query = (
-        f"""SELECT exceeded_capacity_charge FROM t_electricity_price
-        WHERE distribution_id={distribution}""")
-    cur.execute(sql_query)
-    connection.commit()
-    charge_kva = cur.fetchall()[0][0]
-    # Get power factor
-    sql_query = (
-        """SELECT parameter_value FROM t_system_parameters
-        WHERE parameter_name='power_factor' LIMIT 1""")
-    cur.execute(sql_query)
-    connection.commit()
-    power = float(cur.fetchall()[0][0])
-    return (excess_kwh / power) * charge_kva
+    return (excess_kwh / context.power_factor) * context.charge_kva
 
 
 # Bill adding two parameters
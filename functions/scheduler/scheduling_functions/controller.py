@@ -150,6 +150,69 @@ def new_rows_charging(df):
     return new_df
 
 
+def claim_scenario(connection, cur, scenarios=None):
+    """Claims the next scenario waiting to be scheduled
+
+    Sets its status to "p" (in progress). Rows locked by other runners are
+    skipped, so several processes or hosts can work through the queue
+    without scheduling a scenario twice.
+
+    Args:
+        scenarios (list): only claims these scenario IDs, None for any
+
+    Returns:
+        int: scenario ID, None if there are none left
+    """
+    scenario_filter = ""
+    if scenarios is not None:
+        if len(scenarios) == 0:
+            return None
+        scenario_filter = f"AND scenario_id IN {list_to_string(scenarios)}"
+    try:
+        sql_query = f"""UPDATE t_charging_scenarios SET schedule_status='p'
+            WHERE scenario_id = (
+                SELECT scenario_id FROM t_charging_scenarios
+                WHERE schedule_status='n' {scenario_filter}
+                ORDER BY scenario_id
+                LIMIT 1 FOR UPDATE SKIP LOCKED)
+            RETURNING scenario_id"""
+        cur.execute(sql_query)
+        claimed = cur.fetchone()
+        connection.commit()
+    except (Exception, psycopg2.Error) as error:
+        connection.rollback()
+        logger.error("Error while claiming a scenario")
+        raise error
+    return None if claimed is None else int(claimed[0])
+
+
+def reset_scenarios(scenarios, connection, cur):
+    """Sets scenarios back to "n" so they can be claimed and run again"""
+    try:
+        sql_query = f"""UPDATE t_charging_scenarios SET schedule_status='n'
+            WHERE scenario_id IN {list_to_string(scenarios)}"""
+        cur.execute(sql_query)
+        connection.commit()
+    except (Exception, psycopg2.Error) as error:
+        logger.error("Error resetting t_charging_scenarios status")
+        raise error
+    return
+
+
+def fail_scenario(scenario, connection, cur):
+    """Sets a scenario that couldn't be scheduled to "f" (failed), so it
+    isn't claimed again until it is reset"""
+    try:
+        sql_query = f"""UPDATE t_charging_scenarios SET schedule_status='f'
+            WHERE scenario_id={scenario}"""
+        cur.execute(sql_query)
+        connection.commit()
+    except (Exception, psycopg2.Error) as error:
+        logger.error("Error setting t_charging_scenarios status")
+        raise error
+    return
+
+
 def main():
     logger.debug(f"Started schedulling app at {dt.datetime.now()}")
     try:
@@ -166,7 +229,7 @@ def main():
         SystemExit(e)
     finally:
         cur.close()
-        connection.close()
+        dbh.release_connection(connection)
         logger.info("Closed db connection")
     return df['scenario_id'].values
 
@@ -1,4 +1,7 @@
+import os
+import time
 import numpy as np
+import scipy.sparse as sparse
 from python_utils.utils.logger import logger
 import cvxpy as cp
 
@@ -9,11 +12,445 @@ TIME_FRACT = 0.5
 CHARGER_EFF = 0.9  # FIXME put this in the database
 BATTERY_FACTOR = 0
 ASC_XUSE = 0.9
+# MILP solver and limits, unless t_run_charging sets them (milp_solver,
+# time_limit in seconds and mip_gap, the relative MIP gap). The objective is
+# dominated by the energy delivered, so even a small gap can ignore prices
+MILP_SOLVER = os.getenv('schedule_solver', 'HIGHS')
+TIME_LIMIT = float(os.getenv('solver_time_limit', 120))
+MIP_GAP = float(os.getenv('solver_mip_gap', 0))
+# Tries linear problems before the MILP (see DayProblem)
+FAST_PATH = os.getenv('solver_fast_path', 'true').lower() == 'true'
+# Relative gap to the LP relaxation under which the fast path keeps the
+# rounded fast chargers, if the run's mip_gap is smaller
+FAST_PATH_GAP = 1e-9
+# Statuses for which the MILP is unfeasible too
+UNFEASIBLE = ['infeasible', 'unbounded', 'infeasible_or_unbounded']
+# Solver options for the time and gap limits
+SOLVER_OPTIONS = {
+    'HIGHS': lambda limit, gap: {'time_limit': limit, 'mip_rel_gap': gap},
+    'GLPK_MI': lambda limit, gap: {'tm_lim': int(limit * 1000),
+                                   'mip_gap': gap},
+    'CBC': lambda limit, gap: {'maximumSeconds': int(limit),
+                               'allowableFractionGap': gap},
+}
+
+
+def solver_settings(params):
+    """MILP solver, time limit and MIP gap of a run
+
+    Falls back to HiGHS, then GLPK_MI, if the solver isn't installed.
+
+    Returns:
+        dict: solver, time_limit and mip_gap
+    """
+    solver = (params.get('milp_solver') or MILP_SOLVER).upper()
+    installed = cp.installed_solvers()
+    if solver not in SOLVER_OPTIONS or solver not in installed:
+        fallback = 'HIGHS' if 'HIGHS' in installed else 'GLPK_MI'
+        logger.warning(f"Solver {solver} not available, using {fallback}")
+        solver = fallback
+    time_limit = params.get('time_limit') or TIME_LIMIT
+    mip_gap = params.get('mip_gap')
+    return {'solver': solver, 'time_limit': float(time_limit),
+            'mip_gap': float(MIP_GAP if mip_gap is None else mip_gap)}
+
+
+def solve_milp(problem, outputs, settings, warm_start=False):
+    """Solves a problem with the run's solver and limits
+
+    If the time limit is reached, the best solution found is kept.
+
+    Args:
+        problem (Problem): CVXPY problem
+        outputs (Variable): outputs variable, checked for a solution
+        settings (dict): see solver_settings
+        warm_start (bool): starts from the current value of the variables
+
+    Returns:
+        bool: True if there's a solution
+        dict: solver, status, solve_time (s), nodes and mip_gap
+    """
+    solver = settings['solver']
+    options = SOLVER_OPTIONS[solver](settings['time_limit'],
+                                     settings['mip_gap'])
+    start = time.perf_counter()
+    problem.solve(solver=solver, warm_start=warm_start, **options)
+    stats = {'solver': solver, 'status': problem.status,
+             'solve_time': problem.solver_stats.solve_time,
+             'nodes': None, 'mip_gap': None}
+    if stats['solve_time'] is None:
+        stats['solve_time'] = time.perf_counter() - start
+    solved = (problem.status in cp.settings.SOLUTION_PRESENT
+              and outputs.value is not None)
+    info = problem.solver_stats.extra_stats
+    if solver == 'HIGHS' and info is not None:
+        stats['nodes'] = info.mip_node_count
+        stats['mip_gap'] = info.mip_gap
+        # Stopped at the time limit before finding a solution
+        solved = solved and info.primal_solution_status == 2
+    return solved, stats
+
+
+def session_difference_matrix(sessionM, T, N):
+    """Sparse matrix of the charger changes within charging sessions
+
+    Each row is the difference between two consecutive time periods of the
+    same session, over the (T, N) charger matrix flattened by columns.
+
+    Args:
+        sessionM (2D array): vehicle, first and end time period of each
+            session
+        T (int): number of time periods
+        N (int): number of vehicles
+
+    Returns:
+        sparse matrix: (number of pairs, T*N)
+    """
+    sessions = np.asarray(sessionM, dtype=int).reshape(-1, 3)
+    npairs = np.clip(sessions[:, 2] - sessions[:, 1] - 1, 0, None)
+    total = npairs.sum()
+    # Position of each pair within its session
+    offsets = np.arange(total) - np.repeat(np.cumsum(npairs) - npairs, npairs)
+    first = np.repeat(sessions[:, 0]*T + sessions[:, 1], npairs) + offsets
+    rows = np.arange(total)
+    return sparse.csr_matrix(
+        (np.concatenate([np.ones(total), -np.ones(total)]),
+         (np.concatenate([rows, rows]), np.concatenate([first, first + 1]))),
+        shape=(total, T*N))
+
+
+def session_constraints(chargerM2, sessionM):
+    """Same charger for each session (eq. 10), as a single constraint
+
+    Returns:
+        list: the constraint, empty if no session spans 2 time periods
+    """
+    T, N = chargerM2.shape
+    diff = session_difference_matrix(sessionM, T, N)
+    if diff.shape[0] == 0:
+        return []
+    return [diff @ cp.reshape(chargerM2, (T*N,), order='F') == 0]
+
+
+def session_pair_mask(sessionM, T, N):
+    """Marks the consecutive time periods that belong to the same session
+
+    Returns:
+        2D array: (T-1, N), 1 if periods t and t+1 of a vehicle are in the
+            same session
+    """
+    sessions = np.asarray(sessionM, dtype=int).reshape(-1, 3)
+    sessions = sessions[sessions[:, 2] - sessions[:, 1] > 1]
+    changes = np.zeros((T, N))
+    np.add.at(changes, (sessions[:, 1], sessions[:, 0]), 1)
+    np.add.at(changes, (sessions[:, 2] - 1, sessions[:, 0]), -1)
+    return (np.cumsum(changes, axis=0)[:T-1] > 0).astype(float)
+
+
+def session_blocks(same_session, available):
+    """Groups of time periods that must use the same charger
+
+    Args:
+        same_session (2D array): (T-1, N) see session_pair_mask
+        available (2D array): (T, N) availability
+
+    Returns:
+        2D array: (T, N) block number of each time period, -1 if the vehicle
+            isn't available (a block with an unavailable period can't use a
+            fast charger)
+    """
+    T, N = available.shape
+    new_block = np.ones((T, N), dtype=bool)
+    new_block[1:] = same_session[:T-1] == 0
+    blocks = np.cumsum(new_block.T.reshape(-1)).reshape(N, T).T - 1
+    unavailable = np.unique(blocks[available == 0])
+    blocks[np.isin(blocks, unavailable)] = -1
+    return blocks
+
+
+def assign_fast_chargers(blocks, score, limit):
+    """Gives fast chargers to whole blocks, highest score first
+
+    Blocks are added while every time period has at most limit fast
+    chargers. Fast chargers have no cost, so all the blocks that fit are
+    added.
+
+    Returns:
+        2D array: (T, N) 1 where a fast charger is used
+    """
+    chargers = np.zeros(blocks.shape)
+    used = np.zeros(blocks.shape[0])
+    for b in sorted(np.unique(blocks[blocks >= 0]), key=lambda b: -score[b]):
+        cells = blocks == b
+        periods = cells.any(axis=1)
+        if (used[periods] < limit).all():
+            chargers[cells] = 1
+            used[periods] += 1
+    return chargers
+
+
+class DayProblem():
+    """Daily optimisation problem, compiled once per scenario
+
+    Same model as linear_optimiser_V10 and linear_optimiser_breach, but the
+    data that changes every day (prices, site capacity, availability,
+    energy use, sessions and starting SOC) are CVXPY parameters. The
+    problems are canonicalized once and each day only updates the parameter
+    values before solving.
+
+    The only integer decision is which sessions use a fast charger. With
+    the fast path, each mode first solves linear problems:
+        * if there are enough fast chargers for every available vehicle, the
+        LP with all of them on fast chargers (same optimum as the MILP)
+        * otherwise the LP relaxation, then the LP with the relaxed fast
+        chargers rounded per session, then with a second rounding (repair)
+    The rounded chargers are kept if their objective is within the MIP gap
+    (at least FAST_PATH_GAP) of the LP relaxation, which bounds the MILP.
+    Otherwise the MILP is solved.
+
+    Args:
+        T (int): number of time periods in a day
+        N (int): number of vehicles
+        vehicle_vectors (list): see linear_optimiser_V10
+        params (dict): scenario parameters
+        charger_efficiency (2D array): (T, T) charger efficiency matrix
+        weight_time (float): weight given to charging early
+        battery_factor (float): extra battery allowance
+        fast_path (bool): tries the LP before the MILP, FAST_PATH by default
+    """
+
+    def __init__(self, T, N, vehicle_vectors, params, charger_efficiency,
+                 weight_time=0.01, battery_factor=BATTERY_FACTOR,
+                 fast_path=None):
+        self.T = T
+        self.N = N
+        self.settings = solver_settings(params)
+        self.fast_path = FAST_PATH if fast_path is None else fast_path
+        self.num_charger2 = params['num_charger2']
+        self.battery_factor = battery_factor
+        self.next_req = vehicle_vectors[1]
+        self.battery_cap = vehicle_vectors[2]
+        self.charger1 = min(vehicle_vectors[4].min(), params['charger1'])
+        self.charger2 = min(vehicle_vectors[5].min(), params['charger2'])
+        self.extraCap = params['asc_kw']*params['asc_margin']
+        self.charger_efficiency = charger_efficiency
+        self.timepricing = np.arange(T) * weight_time
+        # Day data
+        self.prices = cp.Parameter(T)
+        self.capacity = cp.Parameter(T)
+        self.available = cp.Parameter((T, N), nonneg=True)
+        # Cumulative energy use plus starting SOC
+        self.offset = cp.Parameter((T, N))
+        self.same_session = cp.Parameter((max(T-1, 1), N), nonneg=True)
+        # Maximum charge rate of each vehicle, time with fixed chargers
+        self.rate = cp.Parameter((T, N), nonneg=True)
+        self.outputs = cp.Variable((T, N), nonneg=True)
+        chargerM2 = cp.Variable((T, N), boolean=True)
+        self.relaxed_chargers = cp.Variable((T, N), nonneg=True)
+        timebreaches = cp.Variable(T, boolean=True)
+
+        # Normal mode, limits the overall site capacity (eq. 2)
+        normal_capacity = self.capacity * TIME_FRACT
+        # Breach mode, limits the site capacity with breaches (eq. 17)
+        breach_capacity = (self.capacity * TIME_FRACT
+                           + timebreaches * TIME_FRACT * self.extraCap)
+        # Breaches have no cost, so the LPs breach in every time period
+        lp_breach_capacity = (self.capacity * TIME_FRACT
+                              + TIME_FRACT * self.extraCap)
+        self.normal = self.problem(chargerM2, normal_capacity)
+        self.breach = self.problem(chargerM2, breach_capacity, breach=True)
+        self.relaxed_normal = self.problem(self.relaxed_chargers,
+                                           normal_capacity)
+        self.relaxed_breach = self.problem(self.relaxed_chargers,
+                                           lp_breach_capacity, breach=True)
+        self.fixed_normal = self.problem(None, normal_capacity)
+        self.fixed_breach = self.problem(None, lp_breach_capacity,
+                                         breach=True)
+        self.compile()
+
+    def problem(self, chargers, capacity, breach=False):
+        """Day problem with a charger variable, or fixed chargers if None"""
+        T = self.T
+        outputs = self.outputs
+        charged = self.charger_efficiency @ outputs
+        constraints = []
+        if T > 1:
+            # Doesn't go over 100%+ SOC or below 0% (eq. 4-5)
+            constraints.append(
+                cp.cumsum(charged, axis=0) + self.offset
+                <= self.battery_factor*np.reshape(self.battery_cap, (1, -1)))
+            constraints.append(
+                cp.cumsum(charged, axis=0) + self.offset
+                + np.reshape(self.battery_cap, (1, -1)) >= 0)
+        if chargers is None:
+            constraints.append(outputs/TIME_FRACT <= self.rate)
+        else:
+            if T > 1:
+                # Same charger for each session (eq. 10)
+                constraints.append(
+                    cp.multiply(self.same_session,
+                                chargers[1:] - chargers[:-1]) == 0)
+            # Limits the number of fast chargers (eq. 6)
+            constraints.append(
+                cp.sum(chargers, axis=1) <= self.num_charger2)
+            # Limits the charge rate for each vehicle, time (eq. 7)
+            constraints.append(outputs/TIME_FRACT
+                               <= self.available * self.charger1
+                               + chargers * (self.charger2-self.charger1))
+            # Limits the number of chargers depending on availability (eq. 9)
+            constraints.append(chargers <= self.available)
+        # Limits the overall site capacity (eq. 2, 17)
+        constraints.append(cp.sum(outputs, axis=1) <= capacity)
+        if breach:
+            # Charge EV batteries enough each night (eq. 3)
+            constraints.append(
+                cp.sum(charged, axis=0) + self.offset[T-1] + self.battery_cap
+                >= (-1) * self.next_req)
+        objective = cp.Minimize(
+            cp.sum(self.prices @ outputs)  # total electricity costs
+            - 100000*cp.sum(outputs)  # maximises charging
+            + cp.sum(self.timepricing @ outputs)  # encourages charging earlier
+            )
+        return cp.Problem(objective, constraints)
+
+    def compile(self):
+        """Canonicalizes the problems, so forked processes inherit them"""
+        for param in [self.prices, self.capacity, self.available,
+                      self.offset, self.same_session, self.rate]:
+            param.value = np.zeros(param.shape)
+        problems = [self.normal, self.breach]
+        if self.fast_path:
+            problems += [self.relaxed_normal, self.relaxed_breach,
+                         self.fixed_normal, self.fixed_breach]
+        for problem in problems:
+            problem.get_problem_data(self.settings['solver'])
+        return
+
+    def fits(self, matrices):
+        """True if the day has the same number of periods and vehicles"""
+        return matrices[0].shape == (self.T, self.N)
+
+    def set_day(self, matrices, day_vectors, rel_vector):
+        """Updates the parameters with a day's data"""
+        self.prices.value = np.asarray(day_vectors[0], dtype=float)
+        self.capacity.value = np.asarray(day_vectors[1], dtype=float)
+        self.available.value = np.asarray(matrices[0], dtype=float)
+        self.offset.value = (np.cumsum(matrices[1], axis=0)
+                             + np.reshape(rel_vector, (1, -1)))
+        if self.T > 1:
+            self.same_session.value = session_pair_mask(
+                matrices[2], self.T, self.N)
+        return
+
+    def solve_fixed(self, problem, chargers, warm, solver_stats):
+        """Solves the LP with the fast chargers fixed"""
+        self.rate.value = (self.available.value * self.charger1
+                           + chargers * (self.charger2-self.charger1))
+        solved, stats = solve_milp(problem, self.outputs, self.settings,
+                                   warm_start=warm)
+        solver_stats.update(stats)
+        return solved
+
+    def solve_lp(self, mode, warm, solver_stats):
+        """Fast path: solves a mode with linear problems only
+
+        Returns:
+            bool: True if solved
+            bool: True if the MILP is unfeasible too (no need to try it)
+        """
+        if mode == 'normal':
+            relaxed, fixed = self.relaxed_normal, self.fixed_normal
+        else:
+            relaxed, fixed = self.relaxed_breach, self.fixed_breach
+        available = self.available.value
+        if (available.sum(axis=1) <= self.num_charger2).all():
+            # The fast charger limit can't bind, same optimum as the MILP
+            solver_stats['method'] = 'lp'
+            solved = self.solve_fixed(fixed, available, warm, solver_stats)
+            return solved, (not solved
+                            and solver_stats['status'] in UNFEASIBLE)
+        solver_stats['method'] = 'relaxed'
+        solved, stats = solve_milp(relaxed, self.outputs, self.settings,
+                                   warm_start=warm)
+        solver_stats.update(stats)
+        if not solved:
+            # The relaxation is unfeasible, so is the MILP
+            return False, stats['status'] in UNFEASIBLE
+        # Lower bound of the MILP objective
+        bound = relaxed.value
+        tolerance = max(self.settings['mip_gap'], FAST_PATH_GAP) * abs(bound)
+        # Fast charger use of the relaxation per block
+        blocks = session_blocks(self.same_session.value, available)
+        need = np.clip((self.outputs.value/TIME_FRACT - self.charger1)
+                       / (self.charger2 - self.charger1), 0, None)
+        valid = blocks >= 0
+        nblocks = blocks.max() + 1
+        peak = np.zeros(nblocks)
+        np.maximum.at(peak, blocks[valid], need[valid])
+        total = np.bincount(blocks[valid], weights=need[valid],
+                            minlength=nblocks)
+        relaxed_use = np.bincount(blocks[valid],
+                                  weights=self.relaxed_chargers.value[valid],
+                                  minlength=nblocks)
+        # Rounds by the peak need, then repairs by the total need
+        for method, score in [('rounded', peak + 1e-6 * relaxed_use),
+                              ('repaired', total + 1e-6 * relaxed_use)]:
+            solver_stats['method'] = method
+            chargers = assign_fast_chargers(blocks, score, self.num_charger2)
+            if (self.solve_fixed(fixed, chargers, warm, solver_stats)
+                    and fixed.value - bound <= tolerance):
+                return True, False
+        return False, False
+
+    def solve_mode(self, mode, warm, solver_stats):
+        """Solves normal or breach mode, the fast path first"""
+        if self.fast_path:
+            solved, unfeasible = self.solve_lp(mode, warm, solver_stats)
+            if solved or unfeasible:
+                return solved
+        problem = self.normal if mode == 'normal' else self.breach
+        solver_stats['method'] = 'milp'
+        solved, stats = solve_milp(problem, self.outputs, self.settings,
+                                   warm_start=warm)
+        solver_stats.update(stats)
+        return solved
+
+    def solve(self, matrices, day_vectors, vehicle_vectors, warm_start=None,
+              solver_stats=None):
+        """Solves a day in normal mode, then breach mode, then magic
+
+        Args:
+            warm_start (2D array): initial guess of the outputs, e.g. the
+                solution of the previous overlapping window
+            solver_stats (dict): updated with the stats of the last solve
+
+        Returns:
+            opt_level (int): 0 normal, 1 breach, 2 magic charging
+            evout (2D array): Outputs (kWh) for each time period per vehicle
+        """
+        self.set_day(matrices, day_vectors, vehicle_vectors[0])
+        warm = warm_start is not None
+        if warm:
+            self.outputs.value = np.asarray(warm_start, dtype=float)
+        solver_stats = {} if solver_stats is None else solver_stats
+        if self.solve_mode('normal', warm, solver_stats):
+            logger.info('Optimisation succesfully run in normal mode')
+            return 0, self.outputs.value
+        logger.warning("=================BREACH========================")
+        solved = self.solve_mode('breach', warm, solver_stats)
+        logger.info("Optimisation status (breach mode): "
+                    f"{solver_stats['status']}")
+        if solved:
+            return 1, self.outputs.value
+        logger.warning("=================MAGIC========================")
+        return 2, magic_charging(matrices, vehicle_vectors)
 
 
 def linear_optimiser_V10(matrices, day_vectors, vehicle_vectors, params,
                          final_soc, opt_level, evout_arr, final_soc_arr_h,
-                         weight_time=0.01, battery_factor=BATTERY_FACTOR):
+                         weight_time=0.01, battery_factor=BATTERY_FACTOR,
+                         day_problem=None, warm_start=None,
+                         solver_stats=None):
     """Linear optimisation for a single day charging, mixed fleet
 
     This optimiser uses CVXPY to find optimal power outputs over a day.
@@ -27,6 +464,11 @@ def linear_optimiser_V10(matrices, day_vectors, vehicle_vectors, params,
         weight_time (float): weight given to charging early
         battery_factor (float): extra battery allowance to fully recharge the
             battery when the rate drops (above ~80%)
+        day_problem (DayProblem): problem compiled for the scenario, used
+            instead of building a new one if the day has the same size
+        warm_start (2D array): initial guess of the outputs for day_problem
+        solver_stats (dict): updated with the solver, status, solve time,
+            nodes and MIP gap of the last solve
 
     Returns:
         final_soc (1D array): end of day final SOC for each vehicle
@@ -34,85 +476,92 @@ def linear_optimiser_V10(matrices, day_vectors, vehicle_vectors, params,
         evout (2D array): Outputs (kWh) for each time period per vehicle
 
     """
-    # Bill
-    soc_margin = params['soc_margin']
-    prices = day_vectors[0]
-    rel_vector = vehicle_vectors[0]
-    battery_cap = vehicle_vectors[2]
-    charger1 = min(vehicle_vectors[4].min(), params['charger1'])
-    charger2 = min(vehicle_vectors[5].min(), params['charger2'])
-    sessionM = matrices[2]
-    charger_efficiency = matrices[3]
-    ev_use = matrices[1]
-    availableM = matrices[0]
-    cumul_matrix = np.cumsum(ev_use, axis=0)
-    # Number of vehicles
-    N = availableM.shape[1]
-    # Number of time periods
-    T = availableM.shape[0]
-
-    # Define output variable
-    outputs = cp.Variable((T, N), nonneg=True)
-    # battery = cp.Variable(T)
-    chargerM2 = cp.Variable((T, N), boolean=True)
-
-    constraints = []
-
-    if T > 1:
-        # Doesn't go over 100%+ SOC or below 0% (eq. 4-5)
+    # Number of time periods and vehicles
+    T, N = matrices[0].shape
+    if day_problem is not None and day_problem.fits(matrices):
+        opt_level.value, evout = day_problem.solve(
+            matrices, day_vectors, vehicle_vectors, warm_start=warm_start,
+            solver_stats=solver_stats)
+    else:
+        # Bill
+        soc_margin = params['soc_margin']
+        prices = day_vectors[0]
+        rel_vector = vehicle_vectors[0]
+        battery_cap = vehicle_vectors[2]
+        charger1 = min(vehicle_vectors[4].min(), params['charger1'])
+        charger2 = min(vehicle_vectors[5].min(), params['charger2'])
+        sessionM = matrices[2]
+        charger_efficiency = matrices[3]
+        ev_use = matrices[1]
+        availableM = matrices[0]
+        cumul_matrix = np.cumsum(ev_use, axis=0)
+        # Number of vehicles
+        N = availableM.shape[1]
+        # Number of time periods
+        T = availableM.shape[0]
+
+        # Define output variable
+        outputs = cp.Variable((T, N), nonneg=True)
+        # battery = cp.Variable(T)
+        chargerM2 = cp.Variable((T, N), boolean=True)
+
+        constraints = []
+
+        if T > 1:
+            # Doesn't go over 100%+ SOC or below 0% (eq. 4-5)
+            constraints.append(
+                cp.cumsum(charger_efficiency @ outputs, axis=0) + cumul_matrix
+                + np.reshape(rel_vector, (1, -1))
+                # <= cp.Constant(0.00001))
+                <= battery_factor*np.reshape(battery_cap, (1, -1)))
+            constraints.append(
+                cp.cumsum(charger_efficiency @ outputs, axis=0) + cumul_matrix
+                + np.reshape(rel_vector, (1, -1))
+                + np.reshape(battery_cap, (1, -1))
+                >= cp.Constant(0))
+
+        # Limits the number of fast chargers (eq. 6)
         constraints.append(
-            cp.cumsum(charger_efficiency @ outputs, axis=0) + cumul_matrix
-            + np.reshape(rel_vector, (1, -1))
-            # <= cp.Constant(0.00001))
-            <= battery_factor*np.reshape(battery_cap, (1, -1)))
+            cp.sum(chargerM2, axis=1) <= params['num_charger2'])
+        # Limits the charge rate for each vehicle, time (eq. 7)
+        constraints.append(outputs/TIME_FRACT
+                           <= availableM * charger1
+                           + chargerM2 * (charger2-charger1))
+        # Limits the number of chargers depending on availability (eq. 9)
+        constraints.append(chargerM2 <= availableM)
+        # Same charger for each session (eq. 10)
+        constraints += session_constraints(chargerM2, sessionM)
+        # limits the overall site capacity (eq. 2)
         constraints.append(
-            cp.cumsum(charger_efficiency @ outputs, axis=0) + cumul_matrix
-            + np.reshape(rel_vector, (1, -1))
-            + np.reshape(battery_cap, (1, -1))
-            >= cp.Constant(0))
-
-    # Limits the number of fast chargers (eq. 6)
-    constraints.append(cp.sum(chargerM2, axis=1) <= params['num_charger2'])
-    # Limits the charge rate for each vehicle, time (eq. 7)
-    constraints.append(outputs/TIME_FRACT
-                       <= availableM * charger1
-                       + chargerM2 * (charger2-charger1))
-    # Limits the number of chargers depending on availability (eq. 9)
-    constraints.append(chargerM2 <= availableM)
-    # Same charger for each session (eq. 10)
-    for s in sessionM:
-        i = s[1]
-        while i+1 < s[2]:
-            constraints.append(chargerM2[i, s[0]] == chargerM2[i+1, s[0]])
-            i += 1
-    # limits the overall site capacity (eq. 2)
-    constraints.append(
-        (cp.sum(outputs, axis=1) <= day_vectors[1] * TIME_FRACT))
-
-    T = len(prices)
-    timepricing = [i*weight_time for i in range(T)]
-    objective = cp.Minimize(  # eq 2
-        cp.sum(prices @ outputs)  # total electricity costs
-        - 100000*cp.sum(outputs)  # maximises charging
-        + cp.sum(timepricing @ outputs)  # encourages charging earlier
-        )
-    problem = cp.Problem(objective, constraints)
-
-    # Solve and print to the screen
-    problem.solve(solver=cp.GLPK_MI)  # 'CBC', GLPK_MI
-
-    # If unfeasible, tries to charge to next day
-    if problem.status in ["infeasible", "unbounded"]:
-        logger.warning("=================BREACH========================")
-        opt_level.value, evout = linear_optimiser_breach(
-            matrices, day_vectors, vehicle_vectors, params)
-    else:
-        logger.info('Optimisation succesfully run in normal mode')
-        # opt_level = 'main'
-        opt_level.value = 0
-        evout = outputs.value
-        # chout = chargerM2.value
-        # bout = 0  # battery.value
+            (cp.sum(outputs, axis=1) <= day_vectors[1] * TIME_FRACT))
+
+        T = len(prices)
+        timepricing = [i*weight_time for i in range(T)]
+        objective = cp.Minimize(  # eq 2
+            cp.sum(prices @ outputs)  # total electricity costs
+            - 100000*cp.sum(outputs)  # maximises charging
+            + cp.sum(timepricing @ outputs)  # encourages charging earlier
+            )
+        problem = cp.Problem(objective, constraints)
+
+        # Solve and print to the screen
+        solved, stats = solve_milp(problem, outputs, solver_settings(params))
+        if solver_stats is not None:
+            solver_stats.update(stats)
+
+        # If unfeasible, tries to charge to next day
+        if not solved:
+            logger.warning("=================BREACH========================")
+            opt_level.value, evout = linear_optimiser_breach(
+                matrices, day_vectors, vehicle_vectors, params,
+                solver_stats=solver_stats)
+        else:
+            logger.info('Optimisation succesfully run in normal mode')
+            # opt_level = 'main'
+            opt_level.value = 0
+            evout = outputs.value
+            # chout = chargerM2.value
+            # bout = 0  # battery.value
 
     # Generate a final SoC array
     rel_vector = vehicle_vectors[0] 
@@ -125,11 +574,7 @@ def linear_optimiser_V10(matrices, day_vectors, vehicle_vectors, params,
     evout_arr[:] = evout.reshape(-1)
     # returned_values = [final_soc, opt_level, evout_arr]
     # Bill
-    soc_matrix = np.zeros((T,N))
-    soc_matrix[0] = [100] * N
-    for r in range (1, T):
-        for c in range(N):
-            soc_matrix[r,c] = soc_matrix[r-1,c] + (charger_efficiency @ evout)[r,c] + ev_use[r,c] 
+    soc_matrix = soc_trajectory(charger_efficiency @ evout, ev_use)
     final_soc_arr_h[:] = soc_matrix.reshape(-1)
     returned_values = [final_soc, opt_level, evout_arr,final_soc_arr_h]
     return returned_values
@@ -137,7 +582,8 @@ def linear_optimiser_V10(matrices, day_vectors, vehicle_vectors, params,
 
 def linear_optimiser_breach(matrices, day_vectors, vehicle_vectors, params,
                             weight_time=0.01,
-                            battery_factor=BATTERY_FACTOR):
+                            battery_factor=BATTERY_FACTOR,
+                            solver_stats=None):
     """Linear opt for EV charging with capacity breaches
 
     This optimiser uses CVXPY to find optimal power outputs over a day.
@@ -157,6 +603,7 @@ def linear_optimiser_breach(matrices, day_vectors, vehicle_vectors, params,
         cost_fullcharge (float): weight given to prioritising a full charge
             each night
         weight_time (float): weight given to charging early
+        solver_stats (dict): updated with the stats of the solve
 
     Returns:
         opt_level (str): the level of optimisation that was feasible
@@ -220,11 +667,7 @@ def linear_optimiser_breach(matrices, day_vectors, vehicle_vectors, params,
     # Limits the number of chargers depending on availability (eq. 9)
     constraints.append(chargerM2 <= availableM)
     # Same charger for each session (eq. 10)
-    for s in sessionM:
-        i = s[1]
-        while i+1 < s[2]:
-            constraints.append(chargerM2[i, s[0]] == chargerM2[i+1, s[0]])
-            i += 1
+    constraints += session_constraints(chargerM2, sessionM)
 
     objective = cp.Minimize(  # eq.16
         cp.sum(prices @ outputs)  # Cost of charging EVs
@@ -234,11 +677,13 @@ def linear_optimiser_breach(matrices, day_vectors, vehicle_vectors, params,
     problem = cp.Problem(objective, constraints)
 
     # Solve and print to the screen
-    problem.solve(solver=cp.GLPK_MI)  # 'CBC', GLPK_MI
+    solved, stats = solve_milp(problem, outputs, solver_settings(params))
+    if solver_stats is not None:
+        solver_stats.update(stats)
     logger.info(f"Optimisation status (breach mode): {problem.status}")
 
     # If unfeasible, tries to charge to next day
-    if problem.status in ["infeasible", "unbounded"]:
+    if not solved:
         logger.warning("=================MAGIC========================")
         opt_level = 2
         evout = magic_charging(matrices, vehicle_vectors)
@@ -272,6 +717,25 @@ def magic_charging(matrices, vehicle_vectors):
     return evout
 
 
+def soc_trajectory(charged, ev_use, start=100):
+    """SOC of each time period, starting at start in the first period
+
+    Each period adds its charged energy and energy use to the SOC of the
+    previous period (the first period's are ignored).
+
+    Args:
+        charged (2D array): energy charged per time period per vehicle
+        ev_use (2D array): energy use per time period per vehicle
+        start (float): SOC of the first time period
+
+    Returns:
+        2D array: SOC per time period per vehicle
+    """
+    steps = charged + ev_use
+    steps[0] = start
+    return np.cumsum(steps, axis=0)
+
+
 # ~~~~~~~~~~~~~~~~~~ THESE AREN'T IN USE ~~~~~~~~~~~~~~~~~~~
 
 
@@ -324,11 +788,7 @@ def normal_constraints(matrices, vehicle_vectors, params,
     # Limits the number of chargers depending on availability (eq. 9)
     constraints.append(chargerM2 <= availableM)
     # Same charger for each session (eq. 10)
-    for s in sessionM:
-        i = s[1]
-        while i+1 < s[2]:
-            constraints.append(chargerM2[i, s[0]] == chargerM2[i+1, s[0]])
-            i += 1
+    constraints += session_constraints(chargerM2, sessionM)
     # TODO Add battery storage
     return constraints, outputs, chargerM2
 
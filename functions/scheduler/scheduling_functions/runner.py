@@ -0,0 +1,124 @@
+# Runs several charging scenarios at the same time
+# Each runner thread claims a scenario from t_charging_scenarios, schedules
+# it with its own database connection and claims the next one until there are
+# none left. All the threads share a pool of solver workers
+
+import os
+import threading
+import pipeline_plan_functions.utils.pipe_db_handler as dbh
+from python_utils.utils.logger import logger
+from scheduling_functions import controller
+from scheduling_functions import schedule_scenario
+from scheduling_functions.solver_pool import SolverPool
+
+logger.setLevel(os.getenv('log_level', "DEBUG"))
+
+# Number of scenarios scheduled at the same time
+PARALLEL = int(os.getenv('schedule_parallel', 1))
+# Pooled connections kept by a scenario being scheduled (its own and the
+# writer's)
+SCENARIO_CONNECTIONS = 2
+
+
+def claim_next(scenarios=None):
+    """Claims the next scenario with a pooled connection"""
+    with dbh.pooled_connection('test') as (connection, cur):
+        return controller.claim_scenario(connection, cur, scenarios)
+
+
+def fail(scenario):
+    """Marks a scenario as failed with a pooled connection"""
+    with dbh.pooled_connection('test') as (connection, cur):
+        controller.fail_scenario(scenario, connection, cur)
+
+
+def pool_size(parallel):
+    """Makes the connection pool big enough for the runners
+
+    Each runner keeps SCENARIO_CONNECTIONS connections while it schedules a
+    scenario, plus one to claim the next scenario or mark it failed. The
+    pools are recreated if they are smaller.
+    """
+    needed = SCENARIO_CONNECTIONS * parallel + 1
+    if dbh.POOL_MAX < needed:
+        logger.info(f"Connection pool raised from {dbh.POOL_MAX} to {needed}"
+                    f" for {parallel} scenarios at the same time")
+        dbh.close_pools()
+        dbh.POOL_MAX = needed
+    return
+
+
+def drain(pool, scenarios=None, resume=False):
+    """Schedules claimed scenarios until there are none left
+
+    A scenario that fails is set to "f" (failed) instead of staying in
+    progress. runner.resume() sets it back to "n".
+
+    Args:
+        pool (SolverPool): solver workers
+        scenarios (list): scenario IDs to schedule, None for any
+        resume (bool): starts each scenario from its last checkpoint
+
+    Returns:
+        list: scenario IDs scheduled by this runner
+    """
+    done = []
+    while True:
+        scenario = claim_next(scenarios)
+        if scenario is None:
+            break
+        logger.info(f"Claimed scenario {scenario}")
+        if schedule_scenario.main(scenario, pool, resume=resume):
+            done.append(scenario)
+        else:
+            logger.error(f"Scenario {scenario} failed")
+            fail(scenario)
+    return done
+
+
+def main(scenarios=None, parallel=None, resume=False):
+    """Schedules the waiting scenarios with several runners
+
+    Args:
+        scenarios (list): scenario IDs to schedule, None for every scenario
+            waiting to be scheduled (e.g. to help another host with a run)
+        parallel (int): number of scenarios scheduled at the same time,
+            schedule_parallel by default
+        resume (bool): starts each scenario from its last checkpoint
+    """
+    parallel = PARALLEL if parallel is None else parallel
+    if scenarios is not None:
+        scenarios = [int(s) for s in scenarios]
+    pool_size(parallel)
+    done = []
+    with SolverPool(processes=parallel) as pool:
+        def runner():
+            try:
+                done.extend(drain(pool, scenarios, resume))
+            except Exception as e:
+                logger.error(e)
+        threads = [threading.Thread(target=runner, name=f"runner-{i}")
+                   for i in range(parallel)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    dbh.close_pools()
+    logger.info(f"Scheduled {len(done)} scenarios")
+    return sorted(done)
+
+
+def resume(scenarios, parallel=None):
+    """Schedules scenarios again from their last checkpoints
+
+    Args:
+        scenarios (list): scenario IDs, e.g. scenarios that crashed
+        parallel (int): number of scenarios scheduled at the same time
+    """
+    with dbh.pooled_connection('test') as (connection, cur):
+        controller.reset_scenarios(scenarios, connection, cur)
+    return main(scenarios, parallel, resume=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,9 @@ from python_utils.utils.logger import logger
 from scheduling_functions import optimisation as opt
 # import optimisation as opt
 from scheduling_functions import cleanup
-import multiprocessing
+from scheduling_functions import checkpoint
+from scheduling_functions.solver_pool import SolverPool
+from types import SimpleNamespace
 
 logger.setLevel(os.getenv('log_level', "DEBUG"))
 
@@ -22,7 +24,14 @@ CHARGER_EFF = 0.9  # FIXME put this in the database
 BATTERY_FACTOR = 0
 ASC_XUSE = 0.9
 DEFAULT_EPRICE = 0.12
-THREAD_WAIT = 300
+# Rolling horizon: days optimised together and days kept from each window
+HORIZON_DAYS = int(os.getenv('schedule_horizon_days', 1))
+COMMIT_DAYS = int(os.getenv('schedule_commit_days', 1))
+# Running totals of a scenario kept in its checkpoints
+CHECKPOINT_TOTALS = ['breaches', 'output_kwh', 'excess_costs', 'breach_days',
+                     'magic_days', 'timeout_days', 'soc_range', 'check_dict']
+SOLVER_STATS = ['solver', 'method', 'status', 'solve_time', 'nodes',
+                'mip_gap']
 
 
 def get_scheduling_inputs(scenario, connection, cur, cnx):
@@ -104,6 +113,47 @@ def create_time_periods(dates, params, delta_min=30):
     return times
 
 
+def time_slots(times, values, side):
+    """Position of each value in the sorted time periods (np.searchsorted)
+
+    Args:
+        times (array): sorted time periods
+        values (Series): datetimes, NaT is placed after the last period
+        side (str): 'left' for the first period >= value, 'right' for the
+            first period > value
+    """
+    times = pd.DatetimeIndex(times).values
+    values = pd.to_datetime(values).values
+    return np.searchsorted(times, values, side=side)
+
+
+def vehicle_columns(vehicles, routes):
+    """Column of each route's vehicle in the matrices"""
+    columns = {v: i for i, v in enumerate(vehicles)}
+    return routes['allocated_vehicle_id'].map(
+        lambda v: columns[v]).values.astype(int)
+
+
+def fill_intervals(T, N, first, last, columns):
+    """1 in the time periods [first, last) of each column, 0 elsewhere
+
+    Overlapping intervals are added with a difference array.
+    """
+    keep = last > first
+    changes = np.zeros((T + 1, N))
+    np.add.at(changes, (first[keep], columns[keep]), 1)
+    np.add.at(changes, (last[keep], columns[keep]), -1)
+    return (changes.cumsum(axis=0)[:T] > 0).astype(float)
+
+
+def assign_last(matrix, rows, columns, values):
+    """matrix[rows, columns] = values, the last value wins if repeated"""
+    cells = pd.DataFrame({'r': rows, 'c': columns, 'v': values})
+    cells = cells.drop_duplicates(subset=['r', 'c'], keep='last')
+    matrix[cells['r'].values, cells['c'].values] = cells['v'].values
+    return matrix
+
+
 def availability_matrix(vehicles, routes, times):
     """Creates a matrix of vehicle availability and energy use
 
@@ -121,21 +171,23 @@ def availability_matrix(vehicles, routes, times):
     """
     T = len(times)
     N = len(vehicles)
-    availability = np.ones((T, N))
     evuse = np.zeros((T, N))
     time_int = dt.timedelta(hours=TIME_FRACT)
-
-    for idx in routes.index:
-        mask = ((times > routes.loc[idx, 'departure_time'] - time_int / 2)
-                & (times < routes.loc[idx, 'end_time'] - time_int / 2))
-        vehicle = vehicles.index(routes.loc[idx, 'allocated_vehicle_id'])
-        # Assign 0 to availability when vehicle is out
-        availability[mask, vehicle] = 0
-        # Assign energy used when vehicle returns
-        if mask.sum() > 0:
-            return_idx = np.where(mask)[0][-1]
-            evuse[return_idx,
-                  vehicle] = -routes.loc[idx, 'energy_required_kwh']
+    columns = vehicle_columns(vehicles, routes)
+    # The vehicle is out in the periods strictly between the departure and
+    # the end time (both shifted by half a period)
+    first = time_slots(times, routes['departure_time'] - time_int / 2,
+                       'right')
+    last = time_slots(times, routes['end_time'] - time_int / 2, 'left')
+    valid = (routes['departure_time'].notna()
+             & routes['end_time'].notna()).values
+    last = np.where(valid, last, first)
+    # Assign 0 to availability when vehicle is out
+    availability = 1 - fill_intervals(T, N, first, last, columns)
+    # Assign energy used when vehicle returns
+    out = last > first
+    assign_last(evuse, last[out] - 1, columns[out],
+                -routes['energy_required_kwh'].values[out])
     return availability, evuse
 
 
@@ -156,27 +208,73 @@ def availability_matrix_depot(vehicles, routes, times):
     """
     T = len(times)
     N = len(vehicles)
-    availability = np.zeros((T, N))
     evuse = np.zeros((T, N))
     time_int = dt.timedelta(hours=TIME_FRACT / 2)
-
-    for idx in routes.index:
-        # Looks at the period where each HGV is available to recharge
-        depot_end = (routes.loc[idx, 'end_time'] +
-                     dt.timedelta(hours=routes.loc[idx, 'recharge_hours']))
-        mask = ((times >= routes.loc[idx, 'end_time'] - time_int)
-                & (times <= depot_end - time_int))
-        vehicle = vehicles.index(routes.loc[idx, 'allocated_vehicle_id'])
-        # Assign 1 to availability when vehicle is at depot
-        availability[mask, vehicle] = 1
-        # Assign energy used when vehicle returns
-        if mask.sum() > 0:
-            return_idx = np.where(mask)[0][0] - 1
-            evuse[return_idx,
-                  vehicle] = -routes.loc[idx, 'energy_required_kwh']
+    columns = vehicle_columns(vehicles, routes)
+    # Looks at the period where each HGV is available to recharge
+    depot_end = (routes['end_time']
+                 + pd.to_timedelta(routes['recharge_hours'], unit='h'))
+    first = time_slots(times, routes['end_time'] - time_int, 'left')
+    last = time_slots(times, depot_end - time_int, 'right')
+    valid = (routes['end_time'].notna() & depot_end.notna()).values
+    last = np.where(valid, last, first)
+    # Assign 1 to availability when vehicle is at depot
+    availability = fill_intervals(T, N, first, last, columns)
+    # Assign energy used when vehicle returns (the period before it's
+    # available, the last period if it's available from the start)
+    back = last > first
+    assign_last(evuse, (first[back] - 1) % T, columns[back],
+                -routes['energy_required_kwh'].values[back])
     return availability, evuse
 
 
+def session_runs(session_matrix):
+    """Charging sessions of a session matrix, using run-length encoding
+
+    Each vehicle column is split into runs of the same session number. A
+    session spans from its first to its last time period.
+
+    Args:
+        session_matrix (2D array): (T, N) session number of each time
+            period and vehicle, 0 if not available
+
+    Raises:
+        Exception: if a session is assigned to more than one vehicle
+
+    Returns:
+        2D array: a row per session (in session order) with the columns
+            0: vehicle index
+            1: initial time period
+            2: final time period
+    """
+    T, N = session_matrix.shape
+    flat = session_matrix.flatten('F')
+    if len(flat) == 0:
+        return np.zeros((0, 3), int)
+    # Runs of the same value along each column (columns are consecutive)
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(flat) != 0) + 1])
+    ends = np.append(starts[1:], len(flat)) - 1
+    sessions = flat[starts] > 0
+    starts, ends = starts[sessions], ends[sessions]
+    unique_sessions, run_session = np.unique(flat[starts],
+                                             return_inverse=True)
+    nsessions = len(unique_sessions)
+    first = np.full(nsessions, T)
+    last = np.full(nsessions, -1)
+    min_vehicle = np.full(nsessions, N)
+    max_vehicle = np.full(nsessions, -1)
+    np.minimum.at(first, run_session, starts % T)
+    np.maximum.at(last, run_session, ends % T)
+    np.minimum.at(min_vehicle, run_session, starts // T)
+    np.maximum.at(max_vehicle, run_session, ends // T)
+    different_vehicles = np.flatnonzero(min_vehicle != max_vehicle)
+    if len(different_vehicles) > 0:
+        s = unique_sessions[different_vehicles[0]]
+        raise Exception(f"Mistake defining charging sessions. Session {s} "
+                        "assigned to multiple vehicles")
+    return np.stack([min_vehicle, first, last + 1], axis=1).astype(int)
+
+
 def vehicle_matrices(vehicles, routes, times):
     """Creates matrices representing the charging requirements
 
@@ -190,10 +288,11 @@ def vehicle_matrices(vehicles, routes, times):
         times (array): time intervals
 
     Raises:
-        Exception: _description_
+        Exception: if a session is assigned to more than one vehicle
 
     Returns:
-        _type_: _description_
+        availability (2D array), evuse (2D array), sessionM (2D array), see
+            session_runs
     """
     T = len(times)
     N = len(vehicles)
@@ -210,22 +309,7 @@ def vehicle_matrices(vehicles, routes, times):
     session_matrix = np.reshape(return_matrix.flatten('F').cumsum(), (T, N),
                                 order='F')
     session_matrix = session_matrix * availability
-    unique_sessions = np.unique(session_matrix)
-    unique_sessions = unique_sessions[unique_sessions > 0]
-    sessionM = np.zeros((len(unique_sessions), 3), int)
-    # The columns are
-    # 0: vehicle index
-    # 1: initial time period
-    # 2: final time period
-    for i, s in enumerate(unique_sessions):
-        idxs = np.where(session_matrix == s)
-        sessionM[i, 1] = idxs[0][0]
-        sessionM[i, 2] = idxs[0][-1] + 1
-        sessionM[i, 0] = idxs[1][0]
-        different_vehicles = (idxs[1] != idxs[1][0]).any()
-        if different_vehicles:
-            raise Exception(f"Mistake defining charging sessions. Session {s}"
-                            "assigned to multiple vehicles")
+    sessionM = session_runs(session_matrix)
     return availability, evuse, sessionM
 
 
@@ -364,14 +448,19 @@ def vehicle_spec_vectors(routes, vehicles, connection, cur):
     return battery_cap, charger_rate_ac, charger_rate_dc
 
 
-def day_matrices(available, evuse, sessionM, charger_efficiency, start, end):
+def day_matrices(available, evuse, sessionM, charger_efficiency, start, end,
+                 length=24):
     """Creates the input matrix for a specific day by cropping the full ones
+
+    Args:
+        length (int): sessions are clipped to the first length time periods
     """
     available_day = available[start:end]
     evuse_day = evuse[start:end]
     shifted_sessions = sessionM[:, 1:3] - start
-    mask = ((shifted_sessions >= 0) & (shifted_sessions <= 24)).any(axis=1)
-    sessions_day = np.clip(shifted_sessions[mask], a_min=0, a_max=24)
+    mask = ((shifted_sessions >= 0)
+            & (shifted_sessions <= length)).any(axis=1)
+    sessions_day = np.clip(shifted_sessions[mask], a_min=0, a_max=length)
     sessions_day = np.concatenate(
         [sessionM[mask, 0].reshape(-1, 1), sessions_day], axis=1)
     return [available_day, evuse_day, sessions_day, charger_efficiency]
@@ -384,6 +473,29 @@ def day_site_vectors(vectors, start, end):
     return day_vectors
 
 
+def horizon_settings(params):
+    """Days optimised together and days kept from each window
+
+    Read from t_run_charging (horizon_days, commit_days) if they are set,
+    from schedule_horizon_days and schedule_commit_days otherwise. The
+    default (1, 1) optimises each day on its own.
+    """
+    horizon = params.get('horizon_days') or HORIZON_DAYS
+    commit = params.get('commit_days') or COMMIT_DAYS
+    horizon = max(int(horizon), 1)
+    commit = min(max(int(commit), 1), horizon)
+    return horizon, commit
+
+
+def shift_warm_start(evout, offset, T):
+    """Previous window's outputs from time period offset, as a T rows guess
+    """
+    warm = np.zeros((T, evout.shape[1]))
+    rows = evout[offset:offset+T]
+    warm[:len(rows)] = rows
+    return warm
+
+
 # TODO MOVE these to data handler functions (and in allocation code)
 
 
@@ -411,38 +523,101 @@ def get_routes_fromid(routeids, table, cnx):
 
 
 # Bill adding for QA check
-def count_dc_num(evout,params):
-    num_charger2 = params['num_charger2']
+def count_dc_num(evout, params, T=None):
+    """Counts the time periods that use more fast chargers than allowed
+
+    Args:
+        evout (2D array): outputs (kWh) per time period per vehicle
+        params (dict): scenario parameters, with num_charger2
+        T (int): time periods per day, to count each day separately
+
+    Returns:
+        int: number of time periods, or an array with the count of each day
+            if T is given
+    """
     # convert to boolean
-    dc_charger  = (evout > 11)
-    dc_charger_day = dc_charger.sum(axis=1) 
-    filtered = filter(lambda a : a > num_charger2, dc_charger_day)
-    count = len(list(filtered))
-    return count
+    dc_charger = (evout > 11)
+    over = dc_charger.sum(axis=1) > params['num_charger2']
+    if T is None:
+        return int(over.sum())
+    return over.reshape(-1, T).sum(axis=1)
+
 
-def soc_change_check(evout,soc_out):
-    count = 0
-    # filter where evout > 0
-    operate_charger = (evout > 0)
-    # Find true indexes
-    charger_bool = np.where(operate_charger)
-    for r in range(charger_bool[0].shape[0]):
-        r_index = charger_bool[0][r]
-        c_index = charger_bool[1][r]
-        # calculate soc difference
-        soc_change = soc_out[r_index][c_index] - soc_out[r_index-1][c_index]
-        # make comparison
-        if evout[r_index][c_index] < soc_change:
-            count += 1
+def soc_change_check(evout, soc_out, T=None):
+    """Counts the outputs smaller than the SOC change they produce
+
+    The SOC change of the first period of a day is taken from the last
+    period of the same day.
+
+    Args:
+        evout (2D array): outputs (kWh) per time period per vehicle
+        soc_out (2D array): SOC per time period per vehicle
+        T (int): time periods per day, to count each day separately
+
+    Returns:
+        int: number of outputs, or an array with the count of each day if T
+            is given
+    """
+    days = 1 if T is None else -1
+    T = len(evout) if T is None else T
+    evout = evout.reshape(days, T, evout.shape[1])
+    soc_out = soc_out.reshape(days, T, soc_out.shape[1])
+    # calculate soc difference
+    soc_change = soc_out - np.roll(soc_out, 1, axis=1)
+    # filter where evout > 0 and make comparison
+    count = ((evout > 0) & (evout < soc_change)).sum(axis=(1, 2))
+    if days == 1:
+        return int(count[0])
     return count
-         
-         
-def main(scenario):
+
+
+def check_days(check_dict, soc_range, output, output_soc, params, T):
+    """Adds the QA checks of some days to check_dict
+
+    Args:
+        check_dict (dict): QA checks of each day
+        soc_range (list): minimum and maximum SOC so far
+        output (2D array): outputs (kWh) of whole days
+        output_soc (2D array): SOC of the same days
+        params (dict): scenario parameters
+        T (int): time periods per day
+
+    Returns:
+        list: minimum and maximum SOC including the new days
+    """
+    if len(output) == 0:
+        return soc_range
+    check_dict['num_charger2_violation'] += list(
+        count_dc_num(output, params, T))
+    check_dict['num_soc_change_violation'] += list(
+        soc_change_check(output, output_soc, T))
+    return [min(soc_range[0], output_soc.min()),
+            max(soc_range[1], output_soc.max())]
+
+
+def main(scenario, pool=None, resume=False):
+    """Schedules the charging of a scenario
+
+    Args:
+        scenario (int): scenario ID
+        pool (SolverPool): solver workers shared with other scenarios. If
+            None, a pool is started for this scenario
+        resume (bool): starts from the scenario's last checkpoint, if it has
+            one, instead of the first day
+
+    Returns:
+        bool: True if the scenario was scheduled, False if it failed
+    """
     logger.debug(f"Started schedulling scenario {scenario}")
+    scheduled = False
+    own_pool = None
+    writer = None
+    connection = cur = None
+    writer_connection = None
     try:
         connection, cur = dbh.database_connection('test')
         # Get run input parameters
-        cnx = dbh.create_alch_engine()
+        cnx = dbh.get_engine()
         params = get_scheduling_inputs(scenario, connection, cur, cnx)
         params = get_site_data(params, connection, cur)
         # params['asc_kw'] = 60  #############
@@ -484,6 +659,10 @@ def main(scenario):
             charger_rate_ac, charger_rate_dc
         ]
         site_vectors = [electricity, capacity, times]
+        # Tariff constants and system parameters, loaded once
+        context = cleanup.ScenarioContext.load(params['distribution_id'],
+                                               connection, cur)
+        T = int(24 / TIME_FRACT)
         # iterate over each day and filter inputs
         breach_days = []
         magic_days = []
@@ -491,14 +670,37 @@ def main(scenario):
         breaches = 0
         output_kwh = 0
         excess_costs = 0
-        # Bill adding
-        final_min_soc = 100
-        final_max_soc = 0
+        # Minimum and maximum SOC
+        soc_range = [100, 0]
         # For QA check
-        num_charger2_violation = 10
-        num_soc_change_violation = 10
         check_dict = {'num_charger2_violation':[],
                       'num_soc_change_violation':[]}
+        # Solver stats of each day
+        for c in SOLVER_STATS:
+            check_dict[c] = []
+        first_day = 0
+        state = checkpoint.load(scenario) if resume else None
+        if state is not None and (state['ndays'] != ndays
+                                  or state['vehicles'] != list(vehicles)):
+            logger.warning(f"Checkpoint of scenario {scenario} doesn't match "
+                           "its inputs, starting from the first day")
+            state = None
+        if state is not None:
+            first_day = state['day']
+            vehicle_vectors[0] = state['rel_charge']
+            (breaches, output_kwh, excess_costs, breach_days, magic_days,
+             timeout_days, soc_range, check_dict) = [
+                 state[k] for k in CHECKPOINT_TOTALS]
+            logger.info(f"Resuming scenario {scenario} from day {first_day}")
+        # The schedules are copied by the writer with its own connection and
+        # committed at each checkpoint and once the scenario is scheduled.
+        # Rows left by a previous run from the first day on are replaced
+        writer_connection, writer_cur = dbh.database_connection('test')
+        writer = cleanup.ChargeDemandWriter(
+            writer_connection, writer_cur, scenario, vehicles,
+            len(times), first_row=first_day * T)
+        writer.discard(times[first_day * T])
+        checked = first_day * T
         debug_log = {
             'day': [],
             'output_kwh': [],
@@ -507,103 +709,160 @@ def main(scenario):
             # Bill added
             'min_soc':[]
         }
-        day_itr = range(0, ndays)
-        # day_itr = [69]
-        for day in day_itr:
-            # for day in range(500, ndays):
-            start = int(day * 24 / TIME_FRACT)
-            end = int((day + 1) * 24 / TIME_FRACT)
-            logger.info('day %d: start %d - end %d' % (day, start, end))
-            matrices = day_matrices(available, evuse, session_matrix,
-                                    charger_efficiency, start, end)
-            day_vectors = day_site_vectors(site_vectors, start, end)
-            # run linear optimiser for each day
-            final_soc_arr = multiprocessing.Array('d', np.zeros(len(vehicles)))
-            opt_level = multiprocessing.Value('i', -1)
-            ev_out_arr = multiprocessing.Array(
-                'd', range(len(vehicles) * int(24 / TIME_FRACT)))
-            # Bill added
-            final_soc_arr_h = multiprocessing.Array(
-                'd', range(len(vehicles) * int(24 / TIME_FRACT)))
-            # Bill editing final_soc_arr_h in process 
-            p = multiprocessing.Process(
-                target=opt.linear_optimiser_V10,
-                args=(matrices, day_vectors, vehicle_vectors, params,
-                      final_soc_arr, opt_level, ev_out_arr,final_soc_arr_h))
-            p.start()
-            # Wait for 10 seconds or until process finishes
-            p.join(THREAD_WAIT)
-            # If thread is still active
-            if p.is_alive():
-                print("running... let's kill it...")
-                # Terminate - may not work if process is stuck for good
-                p.terminate()
-                p.join()
-            evout = np.array(ev_out_arr[:]).reshape(int(24 / TIME_FRACT),
-                                                    len(vehicles))
-            # Bill adding
-            soc_out = np.array(final_soc_arr_h[:]).reshape(int(24 / TIME_FRACT),
-                                                    len(vehicles))
-            min_soc = soc_out.min()
-            max_soc = soc_out.max()
-            final_soc = np.array(final_soc_arr[:])
-            if opt_level.value == 1:
-                # there was a site capacity breach
-                breach_days.append(day)
-                logger.warning('Breach!!! day: %d' % day)
-            elif opt_level.value == 2:
-                # The optimisation was unfeasible
-                magic_days.append(day)
-                logger.warning('Magic!!! day: %d' % day)
-            elif opt_level.value == -1:
-                # The optimisation timed out
-                opt_level.value = 2
-                evout = opt.magic_charging(matrices, vehicle_vectors)
-                timeout_days.append(day)
-                logger.warning('Timeout!!! day: %d' % day)
-            # Export each day
-            # Bill adding one parameter
-            cleanup.export_charge_schedule(evout, soc_out, params, vehicles,
-                                           times[start:end], cnx)
-            breaches += cleanup.calculate_breaches(evout, day_vectors[1])
-            output_kwh += evout.sum()
-            excess_cost = cleanup.excess_capacity_cost(
-                evout, day_vectors[1], params['distribution_id'], connection,
-                cur)
-            # logger.info('day %d(%s-%s): excess cost: %d, output_kwh: %d' %
-            #             (day, times[start], times[end], excess_cost, output_kwh))
-            excess_costs += excess_cost
-            debug_log['day'].append(day)
-            debug_log['output_kwh'].append(output_kwh)
-            debug_log['excess_cost'].append(excess_cost)
-            debug_log['opt_level'].append(opt_level.value)
-            # Bill added
-            final_min_soc = min(final_min_soc,min_soc).round(2)
-            final_max_soc = max(final_max_soc,max_soc).round(2)
-            num_charger2_violation = count_dc_num(evout, params)
-            num_soc_change_violation = soc_change_check(evout,soc_out)
-            check_dict['num_charger2_violation'].append(num_charger2_violation)
-            check_dict['num_soc_change_violation'].append(num_soc_change_violation)
-            # update relative energy vector
-            vehicle_vectors[0] = final_soc
+        if pool is None:
+            pool = own_pool = SolverPool()
+        horizon, commit = horizon_settings(params)
+        window_efficiency = {}
+        previous = None
+        single_day = False
+        # iterate over each window of days, keeping the first days
+        window_start = first_day
+        last_checkpoint = first_day
+        while window_start < ndays:
+            window_days = min(horizon, ndays - window_start)
+            if single_day:
+                window_days = 1
+            start = window_start * T
+            end = (window_start + window_days) * T
+            logger.info('days %d-%d: start %d - end %d' % (
+                window_start, window_start + window_days - 1, start, end))
+            if window_days not in window_efficiency:
+                window_efficiency[window_days] = np.diag(
+                    np.full(window_days * T, CHARGER_EFF))
+            matrices = day_matrices(
+                available, evuse, session_matrix,
+                window_efficiency[window_days], start, end,
+                length=24 if window_days == 1 else end - start)
+            window_vectors = day_site_vectors(site_vectors, start, end)
+            warm_start = None
+            if previous is not None:
+                warm_start = shift_warm_start(
+                    previous[1], start - previous[0], end - start)
+            # run linear optimiser for the window in a solver worker
+            level, _, window_evout, window_soc, stats = pool.solve(
+                matrices, window_vectors, vehicle_vectors, params,
+                key=scenario, warm_start=warm_start)
+            logger.info(f"Solver stats: {stats}")
+            previous = None
+            if level in [-1, 2] and window_days > 1:
+                # An unfeasible day makes the whole window unfeasible, so
+                # the first day is solved on its own before magic charging
+                logger.warning('Window unfeasible, solving day %d alone' % (
+                    window_start))
+                single_day = True
+                continue
+            single_day = False
+            if level in [0, 1] and horizon > commit:
+                previous = (start, window_evout)
+            if level == -1:
+                window_evout = opt.magic_charging(matrices, vehicle_vectors)
+            for day in range(window_start,
+                             window_start + min(commit, window_days)):
+                start = day * T
+                end = (day + 1) * T
+                rows = slice(start - window_start * T, end - window_start * T)
+                evout = window_evout[rows]
+                soc_out = window_soc[rows]
+                if day > window_start:
+                    # The SOC matrix starts at 100 each day
+                    soc_out = soc_out + 100 - soc_out[0]
+                day_vectors = day_site_vectors(site_vectors, start, end)
+                if level == -1:
+                    final_soc = np.zeros(len(vehicles))
+                else:
+                    final_soc = (vehicle_vectors[0] + (
+                        (charger_efficiency @ evout).sum(axis=0)
+                        + evuse[start:end].sum(axis=0))).round(6)
+                opt_level = SimpleNamespace(value=level)
+                if opt_level.value == 1:
+                    # there was a site capacity breach
+                    breach_days.append(day)
+                    logger.warning('Breach!!! day: %d' % day)
+                elif opt_level.value == 2:
+                    # The optimisation was unfeasible
+                    magic_days.append(day)
+                    logger.warning('Magic!!! day: %d' % day)
+                elif opt_level.value == -1:
+                    # The optimisation timed out
+                    opt_level.value = 2
+                    timeout_days.append(day)
+                    logger.warning('Timeout!!! day: %d' % day)
+                # Export each day
+                writer.add(evout, soc_out, times[start:end])
+                breaches += cleanup.calculate_breaches(evout, day_vectors[1])
+                output_kwh += evout.sum()
+                excess_cost = cleanup.excess_capacity_cost(
+                    evout, day_vectors[1], context)
+                excess_costs += excess_cost
+                debug_log['day'].append(day)
+                debug_log['output_kwh'].append(output_kwh)
+                debug_log['excess_cost'].append(excess_cost)
+                debug_log['opt_level'].append(opt_level.value)
+                for c in SOLVER_STATS:
+                    check_dict[c].append(stats.get(c))
+                # update relative energy vector
+                vehicle_vectors[0] = final_soc
+            window_start += min(commit, window_days)
+            if (checkpoint.CHECKPOINT_DAYS > 0 and window_start < ndays
+                    and window_start - last_checkpoint
+                    >= checkpoint.CHECKPOINT_DAYS):
+                # The schedules are committed before the checkpoint is saved
+                writer.checkpoint()
+                rows = slice(checked, writer.filled)
+                soc_range = check_days(
+                    check_dict, soc_range, writer.output[rows],
+                    writer.output_soc[rows], params, T)
+                checked = writer.filled
+                state = {'day': window_start, 'ndays': ndays,
+                         'vehicles': list(vehicles),
+                         'rel_charge': vehicle_vectors[0]}
+                totals = [breaches, output_kwh, excess_costs, breach_days,
+                          magic_days, timeout_days, soc_range, check_dict]
+                state.update(zip(CHECKPOINT_TOTALS, totals))
+                checkpoint.save(scenario, state)
+                last_checkpoint = window_start
+        writer.close()
+        # SOC range and QA checks of the days since the last checkpoint, from
+        # the buffered schedules
+        rows = slice(checked, writer.filled)
+        soc_range = check_days(check_dict, soc_range, writer.output[rows],
+                               writer.output_soc[rows], params, T)
+        final_min_soc = np.round(soc_range[0], 2)
+        final_max_soc = np.round(soc_range[1], 2)
         n_breach_days = len(breach_days)
         n_magic_days = len(magic_days)
         n_timeout = len(timeout_days)
         cleanup.update_scenarios(breaches, n_breach_days, n_magic_days,
                                  n_timeout, output_kwh, excess_costs, scenario, final_min_soc, final_max_soc,
                                  connection, cur)
+        checkpoint.clear(scenario)
         # Bill adding QA check
         df = pd.DataFrame.from_dict(check_dict)
-        df.to_csv('QA_check.csv', index=True)
+        df.to_csv(f'QA_check_{scenario}.csv', index=True)
+        scheduled = True
 
     except Exception as e:
         logger.error(e)
         SystemExit(e)
     finally:
-        cur.close()
-        connection.close()
+        if own_pool is not None:
+            own_pool.close()
+        if writer is not None:
+            # Anything not committed is discarded
+            writer.stop()
+        if writer_connection is not None:
+            dbh.release_connection(writer_connection)
+        if cur is not None:
+            cur.close()
+        if connection is not None:
+            dbh.release_connection(connection)
         logger.info("Closed db connection")
-    return
+    return scheduled
+
+
+def resume(scenario, pool=None):
+    """Schedules a scenario from its last checkpoint, see main"""
+    return main(scenario, pool, resume=True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,242 @@
+# Pool of long-lived processes that solve the daily optimisation
+# Each worker keeps numpy/cvxpy imported and the compiled problems of the
+# last scenarios it solved, and writes its results in a shared memory block
+# owned by the pool. A worker that doesn't answer in time is killed and
+# replaced, and the day is reported as timed out (opt_level -1)
+
+import os
+import queue
+import types
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from python_utils.utils.logger import logger
+from scheduling_functions import optimisation as opt
+
+logger.setLevel(os.getenv('log_level', "DEBUG"))
+
+# Number of worker processes
+WORKERS = int(os.getenv('solver_workers', 1))
+# Seconds to wait for a day to be solved before recycling the worker
+TIMEOUT = float(os.getenv('solver_timeout', 300))
+# Compiled problems kept by each worker, e.g. the window and single day
+# problems of each scenario being run
+PROBLEM_CACHE = int(os.getenv('solver_problem_cache', 8))
+# The workers are started by a fork server (or spawned), as forking the pool's
+# process, which runs a thread per scenario, can deadlock the child
+START_METHOD = ('forkserver'
+                if 'forkserver' in multiprocessing.get_all_start_methods()
+                else 'spawn')
+
+
+def result_views(buffer, T, N):
+    """Final SOC, outputs and SOC matrix views on a shared memory block"""
+    values = np.ndarray((N + 2*T*N,), dtype=np.float64, buffer=buffer)
+    return values[:N], values[N:N+T*N], values[N+T*N:]
+
+
+def _solve_day(shm, matrices, day_vectors, vehicle_vectors, params,
+               opt_level, day_problem, warm_start, stats):
+    # The views must not outlive the call, or the block can't be closed
+    T, N = matrices[0].shape
+    final_soc, evout, soc = result_views(shm.buf, T, N)
+    opt.linear_optimiser_V10(matrices, day_vectors, vehicle_vectors, params,
+                             final_soc, opt_level, evout, soc,
+                             day_problem=day_problem, warm_start=warm_start,
+                             solver_stats=stats)
+    return
+
+
+def _worker(conn, cache_size):
+    # Runs in the worker process. Solves the days it receives until it gets
+    # None, reusing the last cache_size compiled problems. A problem is kept
+    # per scenario and shape, e.g. for the full windows of a scenario, its
+    # shorter last window and the single days retried on their own
+    shm = None
+    problems = OrderedDict()
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        (shm_name, key, matrices, day_vectors, vehicle_vectors, params,
+         warm_start) = task
+        opt_level = types.SimpleNamespace(value=-1)
+        stats = {}
+        try:
+            if shm is None or shm.name != shm_name:
+                if shm is not None:
+                    shm.close()
+                shm = shared_memory.SharedMemory(name=shm_name)
+            day_problem = None
+            if key is not None and cache_size > 0:
+                T, N = matrices[0].shape
+                shape_key = (key, T, N)
+                if shape_key in problems:
+                    problems.move_to_end(shape_key)
+                else:
+                    problems[shape_key] = opt.DayProblem(
+                        T, N, vehicle_vectors, params, matrices[3])
+                    if len(problems) > cache_size:
+                        problems.popitem(last=False)
+                day_problem = problems[shape_key]
+            _solve_day(shm, matrices, day_vectors, vehicle_vectors, params,
+                       opt_level, day_problem, warm_start, stats)
+        except Exception as e:
+            logger.error(e)
+            opt_level.value = -1
+        conn.send((opt_level.value, stats))
+    if shm is not None:
+        shm.close()
+    conn.close()
+
+
+class _Slot():
+    """A worker process, its pipe and its result buffer"""
+
+    def __init__(self, ctx, cache_size):
+        self.ctx = ctx
+        self.cache_size = cache_size
+        self.shm = None
+        self.start()
+
+    def start(self):
+        self.conn, child_conn = self.ctx.Pipe()
+        self.process = self.ctx.Process(target=_worker,
+                                        args=(child_conn, self.cache_size),
+                                        daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def restart(self):
+        """Kills the worker and starts a new one"""
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.start()
+
+    def buffer(self, nbytes):
+        """Shared memory block of at least nbytes"""
+        if self.shm is None or self.shm.size < nbytes:
+            self.release()
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        return self.shm
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def stop(self):
+        if self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        self.conn.close()
+        self.release()
+
+
+class SolverPool():
+    """Long-lived worker processes that run linear_optimiser_V10
+
+    solve() can be called from several threads (e.g. a thread per
+    scenario), each call waits for an idle worker.
+
+    Args:
+        processes (int): number of workers, solver_workers by default
+        timeout (float): seconds to wait for a day, solver_timeout by default
+        cache_size (int): compiled problems kept by each worker,
+            solver_problem_cache by default
+    """
+
+    def __init__(self, processes=None, timeout=None, cache_size=None):
+        self.processes = WORKERS if processes is None else processes
+        self.timeout = TIMEOUT if timeout is None else timeout
+        cache_size = PROBLEM_CACHE if cache_size is None else cache_size
+        # The workers must share the tracker of this process, otherwise a
+        # killed worker's tracker unlinks the blocks it had attached
+        resource_tracker.ensure_running()
+        ctx = multiprocessing.get_context(START_METHOD)
+        if START_METHOD == 'forkserver':
+            # Workers are forked from a server that already imported cvxpy
+            ctx.set_forkserver_preload(['scheduling_functions.solver_pool'])
+        self._slots = [_Slot(ctx, cache_size) for _ in range(self.processes)]
+        self._idle = queue.Queue()
+        for slot in self._slots:
+            self._idle.put(slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def solve(self, matrices, day_vectors, vehicle_vectors, params, key=None,
+              warm_start=None):
+        """Solves a day in a worker
+
+        Args:
+            matrices (list): day matrices, see linear_optimiser_V10
+            day_vectors (list): prices and capacity of the day
+            vehicle_vectors (list): see linear_optimiser_V10
+            params (dict): scenario parameters
+            key: identifies the scenario, so the worker reuses its compiled
+                problem (DayProblem) for the scenario's days. None to build
+                the problem every day
+            warm_start (2D array): initial guess of the outputs
+
+        Returns:
+            opt_level (int): 0 normal, 1 breach, 2 magic, -1 timed out or
+                failed
+            final_soc (1D array): end of day SOC for each vehicle
+            evout (2D array): Outputs (kWh) for each time period per vehicle
+            soc (2D array): SOC for each time period per vehicle
+            stats (dict): solver, status, solve_time, nodes and mip_gap of
+                the last solve (empty if it timed out)
+        """
+        T, N = matrices[0].shape
+        slot = self._idle.get()
+        try:
+            shm = slot.buffer(8 * (N + 2*T*N))
+            slot.conn.send((shm.name, key, matrices, day_vectors,
+                            vehicle_vectors, params, warm_start))
+            opt_level, stats = -1, {}
+            if slot.conn.poll(self.timeout):
+                opt_level, stats = slot.conn.recv()
+            else:
+                logger.warning(f"Solver timed out after {self.timeout}s, "
+                               "recycling the worker")
+                slot.restart()
+        except (EOFError, OSError) as e:
+            # The worker died
+            logger.error(e)
+            slot.restart()
+            opt_level, stats = -1, {}
+        try:
+            if opt_level == -1:
+                final_soc = np.zeros(N)
+                evout, soc = np.zeros((T, N)), np.zeros((T, N))
+            else:
+                final_soc, evout, soc = [
+                    v.copy() for v in result_views(slot.shm.buf, T, N)]
+                evout, soc = evout.reshape(T, N), soc.reshape(T, N)
+        finally:
+            self._idle.put(slot)
+        return opt_level, final_soc, evout, soc, stats
+
+    def close(self):
+        """Stops the workers and frees the shared memory"""
+        for slot in self._slots:
+            slot.stop()
+        self._slots = []
+        return
@@ -0,0 +1,63 @@
+'''
+unittest_checkpoint.py
+'''
+
+import unittest
+
+import os
+import sys
+import tempfile
+import numpy as np
+
+CDIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.append(os.path.join(CDIR, '..'))
+from python_utils.utils.logger import logger
+from scheduling_functions import checkpoint
+
+logger.setLevel('CRITICAL')
+
+# logger.setLevel('DEBUG')
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.checkpoint_dir = checkpoint.CHECKPOINT_DIR
+        checkpoint.CHECKPOINT_DIR = os.path.join(self.folder.name, 'ckpt')
+
+    def tearDown(self):
+        checkpoint.CHECKPOINT_DIR = self.checkpoint_dir
+        self.folder.cleanup()
+
+    def test_round_trip(self):
+        self.assertIsNone(checkpoint.load(3))
+        state = {'day': 31, 'rel_charge': np.array([-10., -2.5]),
+                 'breaches': 4, 'output_kwh': 1234.5,
+                 'check_dict': {'soc_min': [0.1]}}
+        checkpoint.save(3, state)
+        # A later checkpoint replaces the first one
+        state['day'] = 61
+        checkpoint.save(3, state)
+        loaded = checkpoint.load(3)
+        self.assertEqual(loaded['day'], 61)
+        np.testing.assert_array_equal(loaded['rel_charge'],
+                                      state['rel_charge'])
+        self.assertEqual(loaded['check_dict'], state['check_dict'])
+        self.assertIsNone(checkpoint.load(4))
+        self.assertEqual(os.listdir(checkpoint.CHECKPOINT_DIR),
+                         ['scenario_3.pkl'])
+        checkpoint.clear(3)
+        self.assertIsNone(checkpoint.load(3))
+        # Nothing to clear
+        checkpoint.clear(3)
+
+    def test_unreadable(self):
+        os.makedirs(checkpoint.CHECKPOINT_DIR)
+        with open(checkpoint.checkpoint_path(5), 'wb') as f:
+            f.write(b'\x80\x04')
+        self.assertIsNone(checkpoint.load(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
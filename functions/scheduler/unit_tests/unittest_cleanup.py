@@ -0,0 +1,138 @@
+'''
+unittest_cleanup.py
+'''
+
+import unittest
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+CDIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.append(os.path.join(CDIR, '..'))
+from python_utils.utils.logger import logger
+from scheduling_functions import cleanup
+
+logger.setLevel('CRITICAL')
+
+# logger.setLevel('DEBUG')
+
+SCENARIO = 7
+VEHICLES = [11, 12, 13]
+
+
+class FakeConnection():
+    '''Keeps the rows copied to t_charge_demand, committed or not'''
+
+    def __init__(self):
+        self.rows = []
+        self.committed = []
+        self.rollbacks = 0
+
+    def commit(self):
+        self.committed = list(self.rows)
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.rows = list(self.committed)
+
+
+class FakeCursor():
+    def __init__(self, connection):
+        self.connection = connection
+
+    def copy_expert(self, sql, buffer):
+        self.connection.rows += buffer.read().splitlines()
+
+
+def random_days(seed, days=3, T=48):
+    '''Outputs, SOC and times of a few days'''
+    rng = np.random.default_rng(seed)
+    N = len(VEHICLES)
+    times = pd.date_range('2021-06-01', periods=days * T, freq='30min')
+    output = rng.uniform(0, 10, (days * T, N))
+    # Periods without an output aren't exported
+    output[rng.random(output.shape) < 0.1] = np.nan
+    output_soc = rng.uniform(0, 100, (days * T, N))
+    return output, output_soc, times
+
+
+def expected_rows(output, output_soc, times):
+    '''t_charge_demand rows of the outputs, as (datetime, vehicle)'''
+    rows = {}
+    for t, time in enumerate(times):
+        for n, vehicle in enumerate(VEHICLES):
+            if not np.isnan(output[t, n]):
+                rows[(time, vehicle)] = (output[t, n] / cleanup.TIME_FRACT,
+                                         output_soc[t, n])
+    return rows
+
+
+class TestChargeDemandWriter(unittest.TestCase):
+    def assert_rows(self, rows, expected):
+        self.assertEqual(len(rows), len(expected))
+        for row in rows:
+            time, vehicle, power, scenario, soc = row.split(',')
+            self.assertEqual(int(scenario), SCENARIO)
+            value = expected[(pd.Timestamp(time), int(vehicle))]
+            self.assertAlmostEqual(float(power), value[0])
+            self.assertAlmostEqual(float(soc), value[1])
+
+    def test_round_trip(self):
+        output, output_soc, times = random_days(0)
+        for background in [False, True]:
+            for flush_rows in [1, 100, 10**6]:
+                connection = FakeConnection()
+                writer = cleanup.ChargeDemandWriter(
+                    connection, FakeCursor(connection), SCENARIO, VEHICLES,
+                    len(times), flush_rows=flush_rows, background=background)
+                for day in range(3):
+                    rows = slice(day * 48, (day + 1) * 48)
+                    writer.add(output[rows], output_soc[rows], times[rows])
+                    if day == 1:
+                        writer.checkpoint()
+                        self.assert_rows(
+                            connection.committed,
+                            expected_rows(output[:96], output_soc[:96],
+                                          times[:96]))
+                writer.close()
+                self.assert_rows(connection.committed,
+                                 expected_rows(output, output_soc, times))
+                self.assertEqual(writer.rows_written, len(times) * 3)
+
+    def test_resumed(self):
+        # A resumed scenario only has the days after its checkpoint
+        output, output_soc, times = random_days(1)
+        connection = FakeConnection()
+        writer = cleanup.ChargeDemandWriter(
+            connection, FakeCursor(connection), SCENARIO, VEHICLES,
+            len(times), background=False, first_row=48)
+        writer.add(output[48:], output_soc[48:], times[48:])
+        writer.close()
+        self.assert_rows(connection.committed,
+                         expected_rows(output[48:], output_soc[48:],
+                                       times[48:]))
+        with self.assertRaises(ValueError):
+            writer.add(output[:1], output_soc[:1], times[:1])
+
+    def test_copy_error(self):
+        connection = FakeConnection()
+        cur = FakeCursor(connection)
+
+        def copy_expert(sql, buffer):
+            raise IOError('Connection lost')
+        cur.copy_expert = copy_expert
+        output, output_soc, times = random_days(2, days=1)
+        writer = cleanup.ChargeDemandWriter(
+            connection, cur, SCENARIO, VEHICLES, len(times), flush_rows=1)
+        writer.add(output, output_soc, times)
+        with self.assertRaises(IOError):
+            writer.close()
+        self.assertEqual(connection.committed, [])
+        self.assertEqual(connection.rollbacks, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
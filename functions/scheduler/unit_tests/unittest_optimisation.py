@@ -0,0 +1,202 @@
+'''
+unittest_optimisation.py
+'''
+
+import unittest
+
+import os
+import sys
+import numpy as np
+import cvxpy as cp
+
+CDIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.append(os.path.join(CDIR, '..'))
+from python_utils.utils.logger import logger
+import scheduling_functions.optimisation as opt
+
+logger.setLevel('CRITICAL')
+
+# logger.setLevel('DEBUG')
+
+PARAMS = {'charger1': 7, 'charger2': 22, 'asc_kw': 20, 'asc_margin': 1,
+          'soc_margin': 0}
+
+
+def random_day(seed, T=24, N=6):
+    '''Matrices, day and vehicle vectors of a random day
+    Each vehicle has a route between two charging sessions'''
+    rng = np.random.default_rng(seed)
+    available = np.zeros((T, N))
+    use = np.zeros((T, N))
+    sessions = []
+    for n in range(N):
+        a = rng.integers(0, 3)
+        b = rng.integers(a + 3, 10)
+        c = rng.integers(b + 2, 16)
+        for start, end in [(a, b), (c, T)]:
+            available[start:end, n] = 1
+            sessions.append([n, start, end])
+        use[b:c, n] = -rng.uniform(10, 50) / (c - b)
+    matrices = [available, use, np.array(sessions),
+                np.eye(T) * opt.CHARGER_EFF]
+    day_vectors = [rng.uniform(0.1, 0.3, T),
+                   np.full(T, rng.uniform(20, 80))]
+    vehicle_vectors = [-rng.uniform(0, 40, N), -rng.uniform(10, 40, N),
+                       np.full(N, 60.), np.arange(N), np.full(N, 7.),
+                       np.full(N, 22.)]
+    params = dict(PARAMS, num_charger2=int(rng.integers(1, 4)))
+    return matrices, day_vectors, vehicle_vectors, params
+
+
+def baseline_pairs(sessionM):
+    '''Consecutive time periods of each session, as the original loop of
+    the session constraints (eq. 10) listed them'''
+    pairs = []
+    for s in sessionM:
+        i = s[1]
+        while i+1 < s[2]:
+            pairs.append((i, s[0]))
+            i += 1
+    return pairs
+
+
+def baseline_day(matrices, day_vectors, vehicle_vectors, params,
+                 weight_time=0.01):
+    '''Normal mode as the original linear_optimiser_V10 built it, a
+    constraint per session pair and solved with GLPK_MI
+
+    Returns:
+        str: status of the problem
+        2D array: outputs, None if unfeasible
+    '''
+    availableM, ev_use, sessionM, charger_efficiency = matrices
+    rel_vector = vehicle_vectors[0]
+    battery_cap = vehicle_vectors[2]
+    charger1 = min(vehicle_vectors[4].min(), params['charger1'])
+    charger2 = min(vehicle_vectors[5].min(), params['charger2'])
+    cumul_matrix = np.cumsum(ev_use, axis=0)
+    T, N = availableM.shape
+    outputs = cp.Variable((T, N), nonneg=True)
+    chargerM2 = cp.Variable((T, N), boolean=True)
+    soc = (cp.cumsum(charger_efficiency @ outputs, axis=0) + cumul_matrix
+           + np.reshape(rel_vector, (1, -1)))
+    constraints = [
+        soc <= opt.BATTERY_FACTOR*np.reshape(battery_cap, (1, -1)),
+        soc + np.reshape(battery_cap, (1, -1)) >= 0,
+        cp.sum(chargerM2, axis=1) <= params['num_charger2'],
+        outputs/opt.TIME_FRACT <= (availableM * charger1
+                                   + chargerM2 * (charger2-charger1)),
+        chargerM2 <= availableM,
+        cp.sum(outputs, axis=1) <= day_vectors[1] * opt.TIME_FRACT]
+    for i, v in baseline_pairs(sessionM):
+        constraints.append(chargerM2[i, v] == chargerM2[i+1, v])
+    timepricing = [i*weight_time for i in range(T)]
+    problem = cp.Problem(cp.Minimize(
+        cp.sum(day_vectors[0] @ outputs) - 100000*cp.sum(outputs)
+        + cp.sum(timepricing @ outputs)), constraints)
+    problem.solve(solver=cp.GLPK_MI)
+    return problem.status, outputs.value
+
+
+def objective(prices, outputs):
+    '''Objective of the day problem'''
+    T = len(prices)
+    per_period = outputs.sum(axis=1)
+    return (prices @ per_period - 100000 * outputs.sum()
+            + (np.arange(T) * 0.01) @ per_period)
+
+
+class TestSessionMatrices(unittest.TestCase):
+    def test_same_pairs_as_loop(self):
+        rng = np.random.default_rng(0)
+        T, N = 12, 5
+        # Random sessions, some of a single period or overlapping
+        starts = rng.integers(0, T, 20)
+        sessionM = np.column_stack([rng.integers(0, N, 20), starts,
+                                    starts + rng.integers(1, 6, 20)])
+        sessionM[:, 2] = np.minimum(sessionM[:, 2], T)
+        pairs = baseline_pairs(sessionM)
+        diff = opt.session_difference_matrix(sessionM, T, N).toarray()
+        self.assertEqual(diff.shape, (len(pairs), T*N))
+        for row, (i, v) in zip(diff, pairs):
+            expected = np.zeros(T*N)
+            expected[v*T + i] = 1
+            expected[v*T + i + 1] = -1
+            np.testing.assert_array_equal(row, expected)
+        mask = np.zeros((T-1, N))
+        for i, v in pairs:
+            mask[i, v] = 1
+        np.testing.assert_array_equal(
+            opt.session_pair_mask(sessionM, T, N), mask)
+
+    def test_no_pairs(self):
+        sessionM = np.array([[0, 3, 4], [1, 0, 1]])
+        self.assertEqual(opt.session_difference_matrix(sessionM, 6, 2).shape,
+                         (0, 12))
+        np.testing.assert_array_equal(opt.session_pair_mask(sessionM, 6, 2),
+                                      np.zeros((5, 2)))
+
+
+class TestDayProblem(unittest.TestCase):
+    def test_matches_baseline(self):
+        unfeasible = 0
+        for seed in range(10):
+            matrices, day_vectors, vehicle_vectors, params = random_day(seed)
+            if seed >= 8:
+                # Not enough site capacity for the routes
+                day_vectors[1] = np.zeros(len(day_vectors[1]))
+                vehicle_vectors[0] = np.full(len(vehicle_vectors[0]), -50.)
+            T, N = matrices[0].shape
+            status, expected = baseline_day(matrices, day_vectors,
+                                            vehicle_vectors, params)
+            for fast_path in [True, False]:
+                problem = opt.DayProblem(T, N, vehicle_vectors, params,
+                                         matrices[3], fast_path=fast_path)
+                level, outputs = problem.solve(matrices, day_vectors,
+                                               vehicle_vectors)
+                if status != 'optimal':
+                    unfeasible += 1
+                    self.assertGreater(level, 0)
+                    continue
+                self.assertEqual(level, 0)
+                # Same energy, at least as cheap
+                target = objective(day_vectors[0], expected)
+                self.assertLessEqual(objective(day_vectors[0], outputs),
+                                     target + 1e-8 * abs(target))
+                self.assertAlmostEqual(outputs.sum(), expected.sum(),
+                                       places=3)
+        self.assertEqual(unfeasible, 4)
+
+
+class TestFastPath(unittest.TestCase):
+    def test_fast_path_matches_milp(self):
+        methods = set()
+        for seed in range(12):
+            matrices, day_vectors, vehicle_vectors, params = random_day(seed)
+            T, N = matrices[0].shape
+            results = {}
+            for fast_path in [True, False]:
+                problem = opt.DayProblem(T, N, vehicle_vectors, params,
+                                         matrices[3], fast_path=fast_path)
+                stats = {}
+                level, outputs = problem.solve(matrices, day_vectors,
+                                               vehicle_vectors,
+                                               solver_stats=stats)
+                results[fast_path] = (level, outputs, stats['method'])
+            level, outputs, method = results[True]
+            methods.add(method)
+            self.assertEqual(level, results[False][0])
+            if level == 2:
+                continue
+            expected = objective(day_vectors[0], results[False][1])
+            self.assertLessEqual(objective(day_vectors[0], outputs),
+                                 expected + 1e-8 * abs(expected))
+            self.assertAlmostEqual(outputs.sum(), results[False][1].sum(),
+                                   places=3)
+        # Some days keep the rounded chargers, others need the MILP
+        self.assertEqual(methods, {'rounded', 'milp'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+'''
+unittest_schedule_scenario.py
+'''
+
+import unittest
+
+import os
+import sys
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+CDIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.append(os.path.join(CDIR, '..'))
+from python_utils.utils.logger import logger
+from scheduling_functions import schedule_scenario as ss
+
+logger.setLevel('CRITICAL')
+
+# logger.setLevel('DEBUG')
+
+DATES = [dt.datetime(2021, 6, 1), dt.datetime(2021, 6, 2)]
+TIMES = ss.create_time_periods(DATES, {'day_start_hours': 4})
+VEHICLES = [21, 22, 23, 24]
+
+
+def baseline_availability(vehicles, routes, times):
+    '''Availability and energy use, as the original loop over the routes'''
+    T = len(times)
+    N = len(vehicles)
+    availability = np.ones((T, N))
+    evuse = np.zeros((T, N))
+    time_int = dt.timedelta(hours=ss.TIME_FRACT)
+    for idx in routes.index:
+        mask = ((times > routes.loc[idx, 'departure_time'] - time_int / 2)
+                & (times < routes.loc[idx, 'end_time'] - time_int / 2))
+        vehicle = vehicles.index(routes.loc[idx, 'allocated_vehicle_id'])
+        availability[mask, vehicle] = 0
+        if mask.sum() > 0:
+            return_idx = np.where(mask)[0][-1]
+            evuse[return_idx,
+                  vehicle] = -routes.loc[idx, 'energy_required_kwh']
+    return availability, evuse
+
+
+def baseline_availability_depot(vehicles, routes, times):
+    '''Availability and energy use of HGVs, as the original loop'''
+    T = len(times)
+    N = len(vehicles)
+    availability = np.zeros((T, N))
+    evuse = np.zeros((T, N))
+    time_int = dt.timedelta(hours=ss.TIME_FRACT / 2)
+    for idx in routes.index:
+        depot_end = (routes.loc[idx, 'end_time'] +
+                     dt.timedelta(hours=routes.loc[idx, 'recharge_hours']))
+        mask = ((times >= routes.loc[idx, 'end_time'] - time_int)
+                & (times <= depot_end - time_int))
+        vehicle = vehicles.index(routes.loc[idx, 'allocated_vehicle_id'])
+        availability[mask, vehicle] = 1
+        if mask.sum() > 0:
+            return_idx = np.where(mask)[0][0] - 1
+            evuse[return_idx,
+                  vehicle] = -routes.loc[idx, 'energy_required_kwh']
+    return availability, evuse
+
+
+def baseline_sessions(session_matrix):
+    '''Charging sessions, as the original np.where loop over the sessions'''
+    unique_sessions = np.unique(session_matrix)
+    unique_sessions = unique_sessions[unique_sessions > 0]
+    sessionM = np.zeros((len(unique_sessions), 3), int)
+    for i, s in enumerate(unique_sessions):
+        idxs = np.where(session_matrix == s)
+        sessionM[i, 1] = idxs[0][0]
+        sessionM[i, 2] = idxs[0][-1] + 1
+        sessionM[i, 0] = idxs[1][0]
+        different_vehicles = (idxs[1] != idxs[1][0]).any()
+        if different_vehicles:
+            raise Exception(f"Mistake defining charging sessions. Session {s} "
+                            "assigned to multiple vehicles")
+    return sessionM
+
+
+def random_routes(seed, R=30):
+    '''Random routes of the vehicles, some overlapping, before or after the
+    time periods, on the period boundaries or without times'''
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(TIMES[0])
+    # Minutes from the first period, multiples of 15 are on the boundaries
+    departure = rng.integers(-300, 3300, R)
+    departure[::3] = departure[::3] // 15 * 15
+    duration = rng.integers(10, 900, R)
+    duration[::4] = duration[::4] // 15 * 15
+    routes = pd.DataFrame({
+        'route_id': range(R),
+        'allocated_vehicle_id': rng.choice(VEHICLES, R),
+        'departure_time': start + pd.to_timedelta(departure, unit='min'),
+        'end_time': start + pd.to_timedelta(departure + duration, unit='min'),
+        'energy_required_kwh': rng.uniform(5, 80, R).round(2),
+        'recharge_hours': rng.uniform(0.2, 10, R).round(1)})
+    routes.loc[rng.random(R) < 0.1, 'departure_time'] = pd.NaT
+    routes.loc[rng.random(R) < 0.1, 'end_time'] = pd.NaT
+    return routes
+
+
+class TestAvailability(unittest.TestCase):
+    def test_matches_baseline(self):
+        for seed in range(20):
+            routes = random_routes(seed)
+            availability, evuse = ss.availability_matrix(VEHICLES, routes,
+                                                         TIMES)
+            expected = baseline_availability(VEHICLES, routes, TIMES)
+            np.testing.assert_array_equal(availability, expected[0])
+            np.testing.assert_array_equal(evuse, expected[1])
+
+    def test_depot_matches_baseline(self):
+        for seed in range(20):
+            routes = random_routes(seed)
+            availability, evuse = ss.availability_matrix_depot(
+                VEHICLES, routes, TIMES)
+            expected = baseline_availability_depot(VEHICLES, routes, TIMES)
+            np.testing.assert_array_equal(availability, expected[0])
+            np.testing.assert_array_equal(evuse, expected[1])
+
+    def test_overlapping_routes(self):
+        # The second route of the first vehicle starts before the first
+        # ends, the energy of the last one to end in a period is kept
+        start = pd.Timestamp(TIMES[0])
+        routes = pd.DataFrame({
+            'allocated_vehicle_id': [21, 21, 22, 22],
+            'departure_time': start + pd.to_timedelta([60, 120, 60, 60],
+                                                      unit='min'),
+            'end_time': start + pd.to_timedelta([240, 300, 240, 240],
+                                                unit='min'),
+            'energy_required_kwh': [10., 20., 30., 40.],
+            'recharge_hours': 1.})
+        availability, evuse = ss.availability_matrix(VEHICLES, routes, TIMES)
+        expected = baseline_availability(VEHICLES, routes, TIMES)
+        np.testing.assert_array_equal(availability, expected[0])
+        np.testing.assert_array_equal(evuse, expected[1])
+        self.assertEqual(availability[:, 0].sum(), len(TIMES) - 8)
+        self.assertEqual(evuse[:, 1].sum(), -40.)
+
+
+class TestSessionRuns(unittest.TestCase):
+    def test_matches_baseline(self):
+        T = len(TIMES)
+        for seed in range(20):
+            routes = random_routes(seed)
+            for matrices in [ss.availability_matrix,
+                             ss.availability_matrix_depot]:
+                availability, evuse = matrices(VEHICLES, routes, TIMES)
+                # Session matrix of vehicle_matrices
+                return_matrix = (evuse != 0).astype(int)
+                return_matrix[0, :] = 1
+                session_matrix = np.reshape(
+                    return_matrix.flatten('F').cumsum(), (T, len(VEHICLES)),
+                    order='F') * availability
+                np.testing.assert_array_equal(
+                    ss.session_runs(session_matrix),
+                    baseline_sessions(session_matrix))
+
+    def test_no_sessions(self):
+        self.assertEqual(ss.session_runs(np.zeros((4, 2))).shape, (0, 3))
+        self.assertEqual(ss.session_runs(np.zeros((0, 2))).shape, (0, 3))
+
+    def test_multiple_vehicles(self):
+        session_matrix = np.array([[1, 3],
+                                   [1, 3],
+                                   [0, 1],
+                                   [2, 0]])
+        with self.assertRaisesRegex(Exception,
+                                    "Session 1 assigned to multiple"):
+            ss.session_runs(session_matrix)
+        with self.assertRaisesRegex(Exception,
+                                    "Session 1 assigned to multiple"):
+            baseline_sessions(session_matrix)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+# Data access for the TCO calculations
+# Holds a single pooled database connection for the whole run, and loads the
+# tables of every allocation of the run with one query per table, so the per
+# allocation and per scenario loops are served from memory. The results are
+# collected by TcoResults and written in a single transaction
+import io
+import os
+import pandas as pd
+import psycopg2
+import psycopg2.pool
+
+# tables loaded for the allocations of a run, and the rows of each table that
+# belong to the allocations (%(ids)s is the tuple of allocation ids)
+ALLOCATED_ROUTES = ('SELECT route_id FROM t_route_allocated'
+                    ' WHERE allocation_id IN %(ids)s')
+ALLOCATED_SPECS = ('SELECT allocated_spec_id FROM t_route_allocated'
+                   ' WHERE allocation_id IN %(ids)s')
+ALLOCATED_CATEGORIES = ('SELECT vehicle_category FROM t_vehicle_specification'
+                        ' WHERE spec_id IN (' + ALLOCATED_SPECS + ')')
+ALLOCATED_SCENARIOS = ('SELECT scenario_id FROM t_charging_scenarios'
+                       ' WHERE allocation_id IN %(ids)s')
+RUN_TABLES = {
+    't_route_allocated': 'allocation_id IN %(ids)s',
+    't_route_master': 'route_id IN (' + ALLOCATED_ROUTES + ')',
+    't_charging_scenarios': 'allocation_id IN %(ids)s',
+    't_charge_demand': 'scenario_id IN (' + ALLOCATED_SCENARIOS + ')',
+    't_vehicle_specification': 'spec_id IN (' + ALLOCATED_SPECS + ')',
+    't_residual_values': 'vehicle_category IN (' + ALLOCATED_CATEGORIES + ')',
+    't_capital_allowances': ('vehicle_category IN ('
+                             + ALLOCATED_CATEGORIES + ')')}
+
+
+class TcoData():
+    '''Database connection and in-memory tables of a TCO run
+    Args:
+        None'''
+
+    def __init__(self):
+        self.pool = None
+        self.connection = None
+        self.tables = {}
+        self._indices = {}
+
+    def connect(self):
+        '''Open the connection of the run, if it isn't open yet
+        Returns:
+            connection (psycopg2.extensions.connection): connection to FPS
+                database'''
+        if self.connection is not None:
+            return self.connection
+        # Get database credentials from azure key vault
+        try:
+            self.pool = psycopg2.pool.SimpleConnectionPool(
+                1, 1,
+                user=os.getenv('pipe_db_user', ''),
+                password=os.getenv('pipe_db_pswd', ''),
+                host=os.getenv('pipe_db_host', ''),
+                port=os.getenv('pipe_db_port', ''),
+                database=os.getenv('pipe_db_name', ''),
+                sslmode=os.getenv('pipe_ssl_mode', 'require'))
+            self.connection = self.pool.getconn()
+            print('FPS db connection successful')
+        except Exception as err:
+            print('failed to connect to FPS database')
+            raise err
+        return self.connection
+
+    def close(self):
+        '''Close the connection of the run'''
+        if self.pool is not None:
+            self.pool.putconn(self.connection)
+            self.pool.closeall()
+            self.pool = None
+            self.connection = None
+            print('closed db connection successfully')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def query(self, query_str, params_val=None):
+        '''Read the result of a query'''
+        connection = self.connect()
+        try:
+            data = pd.read_sql(query_str, connection, params=params_val)
+        except (Exception, psycopg2.Error) as err:
+            connection.rollback()
+            print('data read unsuccessful')
+            raise err
+        return data
+
+    def read(self, table, key_nam, key_val):
+        '''Read rows from a specified tabled based on a specified
+        column-value, same as read_input_data'''
+        if type(key_val) == list:
+            key_val = tuple(key_val)
+        if type(key_val) == tuple:
+            query_str = ('SELECT * FROM ' + table
+                         + ' WHERE ' + key_nam + ' IN %(key_val)s')
+        else:
+            query_str = ('SELECT * FROM ' + table
+                         + ' WHERE ' + key_nam + ' = %(key_val)s')
+        return self.query(query_str, {'key_val': key_val})
+
+    def load_table(self, table):
+        '''Load a whole table, e.g. a lookup table'''
+        self.tables[table] = self.query('SELECT * FROM ' + table)
+        self._indices = {}
+        return self.tables[table]
+
+    def load_run(self, allocation_ids, tables=None):
+        '''Load the rows of the run's allocations, one query per table
+        Args:
+            allocation_ids (list): allocation ids of the run
+            tables (list): tables to load, RUN_TABLES by default'''
+        tables = list(RUN_TABLES) if tables is None else tables
+        ids = tuple(int(i) for i in allocation_ids)
+        for table in tables:
+            if len(ids) == 0:
+                self.tables[table] = self.query(
+                    'SELECT * FROM ' + table + ' WHERE false')
+                continue
+            self.tables[table] = self.query(
+                'SELECT * FROM ' + table + ' WHERE ' + RUN_TABLES[table],
+                {'ids': ids})
+            print('loaded ' + str(len(self.tables[table])) + ' rows of '
+                  + table)
+        self._indices = {}
+        return
+
+    def table(self, table):
+        '''All the loaded rows of a table'''
+        return self.tables[table]
+
+    def rows(self, table, key_nam, key_val):
+        '''Rows of a loaded table with a column-value, from memory'''
+        if (table, key_nam) not in self._indices:
+            self._indices[(table, key_nam)] = (
+                self.tables[table].groupby(key_nam).indices)
+        index = self._indices[(table, key_nam)].get(key_val, [])
+        return self.tables[table].iloc[index].reset_index(drop=True)
+
+
+class TcoResults():
+    '''Collects the TCO results of a run and writes them together
+    The t_allocation values are copied to a temporary table and applied with
+    a single UPDATE, and the TCO components are copied to their tables, all
+    in one transaction.
+    Args:
+        data (TcoData): data access of the run'''
+
+    def __init__(self, data):
+        self.data = data
+        self.allocations = {}
+        self.components = {}
+
+    def add_allocation(self, allocation_id, **values):
+        '''Sets t_allocation columns of an allocation, e.g.
+        preliminary_tco_lease'''
+        self.allocations.setdefault(int(allocation_id), {}).update(values)
+
+    def add_components(self, table, components):
+        '''Adds rows to a TCO components table, e.g.
+        t_vehicle_tco_components'''
+        self.components.setdefault(table, []).append(components)
+
+    def write(self):
+        '''Writes every result and commits, nothing is written if it fails'''
+        connection = self.data.connect()
+        try:
+            with connection.cursor() as cursor:
+                if self.allocations:
+                    values = pd.DataFrame.from_dict(self.allocations,
+                                                    orient='index')
+                    values.index.name = 'allocation_id'
+                    update_table(cursor, 't_allocation', values)
+                for table, frames in self.components.items():
+                    copy_table(cursor, table, pd.concat(frames,
+                                                        ignore_index=True))
+            connection.commit()
+        except (Exception, psycopg2.Error) as err:
+            connection.rollback()
+            print('data write unsuccessful')
+            raise err
+        print('wrote ' + str(len(self.allocations)) + ' allocations and '
+              + str(sum(len(f) for frames in self.components.values()
+                        for f in frames))
+              + ' component rows')
+        self.allocations = {}
+        self.components = {}
+        return
+
+
+def csv_buffer(data):
+    '''CSV of a dataframe for COPY, without header and index'''
+    data = data.copy()
+    # COPY doesn't cast 1.0 into an integer column, so whole floats are
+    # written as integers
+    for c in data.columns:
+        values = data[c]
+        if values.dtype.kind == 'f' and (values.dropna() % 1 == 0).all():
+            data[c] = values.astype('Int64')
+    buffer = io.StringIO()
+    data.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def copy_table(cursor, table, data):
+    '''Append the given data to the specified database table with COPY'''
+    cols = ', '.join(data.columns)
+    cursor.copy_expert('COPY ' + table + ' (' + cols + ')'
+                       + ' FROM STDIN WITH (FORMAT csv)', csv_buffer(data))
+    return
+
+
+def update_table(cursor, table, values):
+    '''Update columns of a table from a dataframe indexed by its key column,
+    through a temporary table. Missing values are left unchanged'''
+    key = values.index.name
+    values = values.reset_index()
+    cols = ', '.join(values.columns)
+    # Keeps the column types, but not the NOT NULL constraints
+    cursor.execute('CREATE TEMP TABLE tmp_' + table
+                   + ' ON COMMIT DROP AS SELECT ' + cols + ' FROM ' + table
+                   + ' WITH NO DATA')
+    copy_table(cursor, 'tmp_' + table, values)
+    update_string = ', '.join([c + ' = COALESCE(tmp.' + c + ', t.' + c + ')'
+                               for c in values.columns if c != key])
+    cursor.execute('UPDATE ' + table + ' AS t SET ' + update_string
+                   + ' FROM tmp_' + table + ' AS tmp'
+                   + ' WHERE t.' + key + ' = tmp.' + key)
+    return
@@ -1,11 +1,7 @@
 import pandas as pd
-import datetime as dt
-import logging
-import os
-import psycopg2
-import sqlalchemy
 import numpy as np
 import numpy_financial as npf
+import tco_data
 
 successful_uploads = []
 failed_uploads = []
@@ -15,569 +11,388 @@ run_id = 215 # USER INPUT: SET A DESIRED RUN ID HERE
 client_id = 2 # USER INPUT: SET CLIENT ID HERE
 site_ids = [309] # USER INPUT: SET SITE IDS HERE
 
-# database related, maybe can consider store in a seperate file in the future
-def database_connection():
-    '''Open connections to FPS databse for read and write operations
+# fuel price of each fuel type, per unit of energy_use (kWh or litres)
+FUEL_PRICES = {'electric': 'flat_tariff',
+               'diesel': 'diesel_cost',
+               'petrol': 'petrol_cost'}
+# carbon intensity of each fuel type and the scope of its emissions
+FUEL_EMISSIONS = {'diesel': ('scope_1_emissions', 'diesel_gco_litre'),
+                  'petrol': ('scope_1_emissions', 'petrol_gco_litre'),
+                  'electric': ('scope_2_emissions', 'grid_gco_kwh')}
+ICE_FUEL_TYPES = ['diesel', 'petrol']
+# columns of t_vehicle_tco_components
+VEHICLE_TCO_COLUMNS = ['scenario_id', 'allocation_id', 'run_id', 'client_id',
+                       'site_id', 'vehicle_id', 'spec_id', 'annual_mileage',
+                       'mileage_band', 'fuel_type', 'purchase_price',
+                       'purchase_price_w_grant', 'upfront_lease_cost',
+                       'annual_fuel_cost', 'annual_electricity_cost',
+                       'annual_ice_maintenance', 'annual_ev_maintenance',
+                       'annual_tyre_cost', 'annual_ved', 'annual_insurance',
+                       'scope_1_emissions', 'scope_2_emissions',
+                       'scope_3_emissions', 'annualise_factor',
+                       'vehicle_mindate', 'vehicle_maxdate']
+
+
+def vehicle_usage(routes, mileage_thresholds):
+    '''Annualised mileage, mileage band and dates of each allocated vehicle
     Args:
-        None
+        routes (dataframe): allocated routes of every allocation, with the
+            allocation_id, allocated_vehicle_id, allocated_spec_id,
+            distance_miles and departure_time columns
+        mileage_thresholds (list): annual mileage bands for residual values
     Returns:
-        connection (psycopg2.extensions.connection): connection to FPS database
-        cnx (sqlalchemy.engine.base.Engine): engine to interact with FPS database'''
-
-    # Get database credentials from azure key vault
-    db_user = os.getenv('pipe_db_user', '')
-    db_pswd = os.getenv('pipe_db_pswd', '')
-    db_name = os.getenv('pipe_db_name', '')
-    db_host = os.getenv('pipe_db_host', '')
-    db_port = os.getenv('pipe_db_port', '')
-    ssl_mode = os.getenv('pipe_ssl_mode', 'require')
-    # connect to PostgreSQL for update
-    # print('connect to PostgreSQL for update')
-    try:
-        connection = psycopg2.connect(user=db_user,
-                                      password=db_pswd,
-                                      host=db_host,
-                                      port=db_port,
-                                      database=db_name,
-                                      sslmode=ssl_mode)
-        # print('successfully generated connection')
-    except psycopg2.OperationalError as err:
-        print(str(err))
-        raise err
-    except Exception as err:
-        print(str(err))
-        raise err
-
-    # connect to PostgreSQL for pd to sql append
-    # print('connect to PostgreSQL for Pd to sql append')
-    try:
-        db_conn_str = sqlalchemy.engine.URL.create(
-            drivername='postgresql+psycopg2',
-            username=db_user,
-            password=db_pswd,
-            database=db_name,
-            host=db_host,
-            port=db_port,
-            query={'sslmode': 'require'},
-            )
-        cnx = sqlalchemy.create_engine(db_conn_str)
-        # print('successfully generated engine')
-    except sqlalchemy.exc.SQLAlchemyError as err:
-        print(str(err))
-        raise err
-    except Exception as err:
-        print(str(err))
-        raise err
-
-    return(connection, cnx)
-
-
-def read_input_data(table, key_nam, key_val):
-    '''Read rows from a specified tabled based on a specified column-value'''
-    # establish FPS database connection
-    if type(key_val) == list:
-        key_val = tuple(key_val)
-    if type(key_val) == tuple:
-        query_str = ('SELECT * FROM ' + table
-                + ' WHERE ' + key_nam
-                + ' IN %(key_val)s')
-    else:
-        query_str = ('SELECT * FROM ' + table
-                    + ' WHERE ' + key_nam
-                    + ' = %(key_val)s')
-    params_val = {'key_val': key_val}
-    # establish FPS database connection
-    try:
-        connection, cnx = database_connection()
-        print('FPS db connection successful')
-        try:
-            data = pd.read_sql(query_str,
-                                         connection, params=params_val)
-            print('data read successful')
-        except sqlalchemy.exc.OperationalError as err:
-            print('data read unsuccessful')
-            raise err
-        except ValueError as err:
-            print('data read unsuccessful')
-            raise err
-        finally:
-            # close the db connection
-            connection.close()
-            cnx.dispose()
-            print('closed db connection successfully')
-    except Exception as err:
-        print('failed to connect to FPS database')
-        raise err
-
-    return data
-
-def read_system_parameters():
-    '''Find the current system parameters'''
-    # establish FPS database connection
-    try:
-        connection, cnx = database_connection()
-        print('FPS db connection successful')
-        # get vehicle id from t_vehicle table
-        print('reading from system_parameters table')
-        try:
-            system_parameters = pd.read_sql(
-                'SELECT * FROM t_system_parameters', connection)
-            print('system_parameters read successful')
-        except sqlalchemy.exc.OperationalError as err:
-            print('system_parameters read unsuccessful')
-            raise err
-        except ValueError as err:
-            print('system_parameters read unsuccessful')
-            raise err
-        finally:
-            # close the db connection
-            connection.close()
-            cnx.dispose()
-            print('closed db connection successfully')
-    except Exception as err:
-        print('failed to connect to FPS database')
-        raise err
-
-    return system_parameters
-
-def upload_to_database(input_data, table):
-    '''Append the given data to the specified database table'''
-    # establish FPS database connection
-    try:
-        connection, cnx = database_connection()
-        print('FPS db connection successful')
-        print('writing data to table')
-        try:
-            input_data.to_sql(table, con=cnx,
-                              if_exists='append', index=False)
-            print('data write successful')
-        except sqlalchemy.exc.OperationalError as err:
-            print('data write unsuccessful')
-            raise err
-        except ValueError as err:
-            print('data write unsuccessful')
-            raise err
-        finally:
-            # close the db connection
-            connection.close()
-            cnx.dispose()
-            print('closed db connection successfully')
-    except Exception as err:
-        print('failed to connect to FPS database')
-        raise err
-    
-    
-def update_value(table, key_col, key_val, data_col, data_val):
-    '''Update value in selected column where row is contains given key value
+        usage (dataframe): a row per allocation and vehicle'''
+    routes = routes.dropna(subset=['allocated_vehicle_id'])
+    departure = routes['departure_time']
+    # THIS WILL ERRONEOUSLY INCREASE RESULTS IF NO OPERATIONS PURPOSELY OCCUR
+    # AT START OR END OF DATE RANGE
+    routes = routes.assign(
+        dayofyear=departure.dt.dayofyear + departure.dt.year*365)
+    usage = routes.groupby(['allocation_id', 'allocated_vehicle_id']).agg(
+        distance_miles=('distance_miles', 'sum'),
+        vehicle_minday=('dayofyear', 'min'),
+        vehicle_maxday=('dayofyear', 'max'),
+        vehicle_mindate=('departure_time', 'min'),
+        vehicle_maxdate=('departure_time', 'max'),
+        spec_id=('allocated_spec_id', 'first'))
+    # find and apply the annualise factor
+    usage['ndays'] = usage['vehicle_maxday'] - (usage['vehicle_minday'] - 1)
+    usage['annualise_factor'] = 1/(usage['ndays']/365)
+    usage['distance_miles'] = usage['distance_miles']*usage['annualise_factor']
+    # band the annual mileage of each vehicle
+    thresholds = np.asarray(mileage_thresholds)
+    usage['mileage_band'] = (
+        usage['distance_miles'].to_numpy()[:, None] >= thresholds).sum(axis=1) - 1
+    return usage.reset_index()
+
+
+def scenario_charge_costs(charge_demand, tariffs, scenarios):
+    '''Electricity cost of the charge schedule of each vehicle and scenario
     Args:
-        table (str): table name to read data from
-        key_col (str): column name to specify keys from
-        key_val (singleton): value of key_col to access the row of
-        data_col (str): column name to change value of
-        data_val (singleton): value to update data_col with'''
-    # establish FPS database connection
-    print('here 1')
-    query_str = ('UPDATE ' + table
-                 + ' SET ' + data_col + ' = (%s)'
-                 + ' WHERE ' + key_col + ' = (%s)')
-
-    # establish FPS database connection
+        charge_demand (dataframe): rows of t_charge_demand
+        tariffs (dataframe): rows of t_electricity_price
+        scenarios (dataframe): scenario_id with the distribution_id and xmpg
+            of its allocation
+    Returns:
+        charge_costs (dataframe): fuel_cost per scenario_id and
+            allocated_vehicle_id, before annualising'''
+    demand = charge_demand[['scenario_id', 'allocated_vehicle_id',
+                            'datetime', 'power_demand_kw']].merge(
+        scenarios[['scenario_id', 'distribution_id', 'xmpg']],
+        how='inner', on='scenario_id')
+    # time periods without a tariff don't add any cost
+    demand = demand.merge(
+        tariffs[['distribution_id', 'datetime', 'electricity_price_fixed']],
+        how='left', on=['distribution_id', 'datetime'])
+    # find the fuel cost for each half hour, accounting for the fuel
+    # efficiency of the site
+    demand['fuel_cost'] = (demand['electricity_price_fixed']
+                           * demand['power_demand_kw']/(2*demand['xmpg']))
+    return demand.groupby(['scenario_id', 'allocated_vehicle_id'],
+                          as_index=False)['fuel_cost'].sum()
+
+
+def compute_vehicle_tco(routes, specs, lookups, params):
+    '''Vehicle TCO of every vehicle, scenario and allocation of a run
+    Allocations with schedule_charge 1 get a preliminary TCO (with a dummy
+    scenario -1), allocations with schedule_charge 2 get the TCO components
+    of each of their charging scenarios.
+    Args:
+        routes (dataframe): allocated routes of every allocation with their
+            route data, see vehicle_usage
+        specs (dataframe): rows of t_vehicle_specification
+        lookups (dict): dataframes of the run: allocations (rows of
+            t_allocation with the distribution_id of their site), scenarios
+            (rows of t_charging_scenarios), residual_values,
+            capital_allowances and, for time of use tariffs, charge_demand
+            and tariffs
+        params (dict): inputs of t_run_vehicle_tco, the carbon intensities,
+            run_id and client_id
+    Returns:
+        components (dataframe): t_vehicle_tco_components rows of the
+            scheduled allocations
+        preliminary (dataframe): preliminary_tco_lease and
+            preliminary_tco_purchase of each preliminary allocation, with
+            the vehicle costs added'''
+    allocations = lookups['allocations']
+    allocations = allocations[allocations['schedule_charge'] > 0][
+        ['allocation_id', 'site_id', 'distribution_id', 'xmpg',
+         'schedule_charge', 'preliminary_tco_lease',
+         'preliminary_tco_purchase']]
+    # dummy scenario for the preliminary TCO calculation before charge
+    # scheduling, charging scenarios for the final TCO calculation
+    preliminary_ids = allocations.loc[allocations['schedule_charge'] == 1,
+                                      ['allocation_id']]
+    scheduled_ids = allocations.loc[allocations['schedule_charge'] == 2,
+                                    'allocation_id']
+    scenarios = lookups['scenarios']
+    scenarios = pd.concat([
+        preliminary_ids.assign(scenario_id=-1),
+        scenarios.loc[scenarios['allocation_id'].isin(scheduled_ids),
+                      ['allocation_id', 'scenario_id']]],
+        ignore_index=True)
+
+    # create TCO components dataframe, a row per vehicle and scenario
+    tco = vehicle_usage(routes, params['mileage_thresholds'])
+    tco = tco.merge(allocations, how='inner', on='allocation_id')
+    tco = tco.merge(scenarios, how='inner', on='allocation_id')
+    for col in ['lifetime', 'interest_rate', 'finance_period',
+                'upfront_lease', 'client_id']:
+        tco[col] = params[col]
+    tco['tyre_cost'] = params['tyre_cost']*tco['distance_miles']
+    # merge tco components with the vehicle specs
+    tco = tco.merge(specs, how='left', on='spec_id')
+    fuel_type = tco['fuel_type']
+    electric = fuel_type == 'electric'
+
+    # fuel costs accounting for site xmpg efficiency
+    price = fuel_type.map({f: params[p] for f, p in FUEL_PRICES.items()})
+    tco['fuel_cost'] = (tco['distance_miles']*tco['energy_use']
+                        * price/tco['xmpg']).where(price.notna(), 0)
+    if params['tou_tariff'] == 1 and len(scheduled_ids) > 0:
+        # scheduled non ICE vehicles pay the tariff of their charge profiles
+        charge_costs = scenario_charge_costs(
+            lookups['charge_demand'], lookups['tariffs'],
+            tco[['scenario_id', 'distribution_id', 'xmpg']].drop_duplicates(
+                subset='scenario_id'))
+        scheduled_cost = tco[['scenario_id', 'allocated_vehicle_id']].merge(
+            charge_costs, how='left',
+            on=['scenario_id', 'allocated_vehicle_id'])['fuel_cost']
+        scheduled = ((tco['schedule_charge'] == 2)
+                     & ~fuel_type.isin(ICE_FUEL_TYPES))
+        tco['fuel_cost'] = tco['fuel_cost'].where(
+            ~scheduled,
+            scheduled_cost.to_numpy()*tco['annualise_factor'])
+
+    # add the vehicle maintenance costs
+    tco['maintenance_pct'] = np.where(
+        electric, 1 - params['ev_maintenance_disc'], 1)
+    tco['ved'] = tco['ved'].where(~electric, 0)
+    tco['maintenance'] = (params['maintenance']*tco['distance_miles']
+                          * tco['maintenance_pct'])
+    # find residual value
+    tco = tco.merge(lookups['residual_values'], how='inner',
+                    on=['vehicle_category', 'lifetime', 'mileage_band'])
+    # find capital allowance
+    tco = tco.merge(lookups['capital_allowances'], how='inner',
+                    on=['vehicle_category', 'lifetime',
+                        'capital_allowance_rate'])
+    fuel_type = tco['fuel_type']
+    electric = fuel_type == 'electric'
+
+    # calculate net vehicle cost
+    tco['net_purchase_cost'] = tco['vehicle_purchase_price'] - tco['pivg']
+    # calculate capital allowance
+    tco['full_capital_allowance'] = (tco['accumulated_capital_allowance']
+                                     * tco['net_purchase_cost'])
+    # calculate residual value
+    tco['full_residual_value'] = (tco['residual_value_pct']
+                                  * tco['vehicle_purchase_price'])
+    # calculate the annual lease payments
+    tco['annual_lease_payments'] = -12*npf.pmt(
+        (tco['interest_rate']/12).to_numpy(), tco['finance_period'].to_numpy(),
+        (tco['net_purchase_cost']*(1 - tco['upfront_lease'])).to_numpy(),
+        fv=-tco['full_residual_value'].to_numpy(), when=0)
+    running_costs = (tco['fuel_cost'] + tco['ved'] + tco['insurance']
+                     + tco['tyre_cost'] + tco['maintenance'])
+    # calculate the TCO
+    tco['total_cost_ownership'] = (
+        tco['net_purchase_cost'] - tco['full_capital_allowance']
+        - tco['full_residual_value'] + tco['lifetime']*running_costs)
+    tco['annualised_ownership_cost'] = (tco['total_cost_ownership']
+                                        / tco['lifetime'])
+    tco['annual_costs_lease'] = tco['annual_lease_payments'] + running_costs
+    tco['upfront_cost_lease'] = tco['net_purchase_cost']*tco['upfront_lease']
+
+    # preliminary TCO calculation before charge scheduling, lease and
+    # purchase costs of the vehicles added to each allocation
+    first = tco['schedule_charge'] == 1
+    vehicle_costs = pd.DataFrame({
+        'preliminary_tco_lease': (tco['annual_costs_lease']*tco['lifetime']
+                                  + tco['upfront_cost_lease'])[first],
+        'preliminary_tco_purchase': (tco['annualised_ownership_cost']
+                                     * tco['lifetime'])[first],
+        'allocation_id': tco['allocation_id'][first]})
+    vehicle_costs = vehicle_costs.groupby('allocation_id').sum()
+    preliminary = allocations[allocations['schedule_charge'] == 1].set_index(
+        'allocation_id')[['preliminary_tco_lease', 'preliminary_tco_purchase']]
+    preliminary = preliminary + vehicle_costs.reindex(preliminary.index,
+                                                      fill_value=0)
+
+    # find the annual carbon emissions
+    tco['scope_1_emissions'] = 0
+    tco['scope_2_emissions'] = 0
+    tco['scope_3_emissions'] = 0
+    usage = tco['distance_miles']*tco['energy_use']/tco['xmpg']
+    for fuel, (scope, intensity) in FUEL_EMISSIONS.items():
+        is_fuel = fuel_type == fuel
+        tco.loc[is_fuel, scope] = usage[is_fuel]*params[intensity]
+
+    # final TCO calculation after charge scheduling
+    components = tco[tco['schedule_charge'] == 2].copy()
+    components['run_id'] = params['run_id']
+    components.rename(columns={"allocated_vehicle_id": "vehicle_id",
+                               "distance_miles": "annual_mileage",
+                               "vehicle_purchase_price": "purchase_price",
+                               "net_purchase_cost": "purchase_price_w_grant",
+                               "upfront_cost_lease": "upfront_lease_cost",
+                               "tyre_cost": "annual_tyre_cost",
+                               "ved": "annual_ved",
+                               "insurance": "annual_insurance"},
+                      inplace=True)
+    electric = components['fuel_type'] == 'electric'
+    # separate out ice and EV fuel and maintenance costs
+    components['annual_fuel_cost'] = components['fuel_cost'].where(
+        ~electric, 0)
+    components['annual_electricity_cost'] = components['fuel_cost'].where(
+        electric, 0)
+    components['annual_ice_maintenance'] = components['maintenance'].where(
+        ~electric, 0)
+    components['annual_ev_maintenance'] = components['maintenance'].where(
+        electric, 0)
+    # keep only the necessary columns
+    components = components[VEHICLE_TCO_COLUMNS].reset_index(drop=True)
+    return components, preliminary.reset_index()
+
+
+def run_parameters(inputs, system_parameters, run_id, client_id):
+    '''Parameters of a run for compute_vehicle_tco
+    Args:
+        inputs (dataframe): the row of t_run_vehicle_tco
+        system_parameters (dict): carbon intensities of the fuels
+        run_id (int): run id
+        client_id (int): client id
+    Returns:
+        params (dict)'''
+    params = {
+        'run_id': run_id,
+        'client_id': client_id,
+        # read the macro assumptions
+        'lifetime': inputs['asset_lifetime'].item(),
+        # interest rate (annual)
+        'interest_rate': inputs['interest_rate'].item(),
+        # finance period (months)
+        'finance_period': inputs['finance_period'].item(),
+        # upfront lease payment
+        'upfront_lease': inputs['upfront_lease'].item(),
+        # use a time of use tariff or not
+        'tou_tariff': inputs['tou_tariff'].item(),
+        # £/kwh price to use for a flat tariff
+        'flat_tariff': inputs['flat_tariff_rate'].item(),
+        # find the fossil fuel costs
+        'petrol_cost': inputs['petrol_cost'].item(),
+        'diesel_cost': inputs['diesel_cost'].item(),
+        # find the non-fuel vehicle costs
+        'tyre_cost': inputs['tyre_cost_rate'].item(),
+        'maintenance': inputs['maintenance_rate'].item(),
+        'ev_maintenance_disc': inputs['ev_maintenance_discount'].item(),
+        # find the annual mileage bands for residual value lookup
+        'mileage_thresholds': [
+            int(i) for i in inputs['mileage_thresholds'].item().split(', ')]}
+    params.update(system_parameters)
+    return params
+
+
+def main(data=None):
+    '''Vehicle TCO of the allocations of run_id
+    Args:
+        data (TcoData): data access of the run, one with its own connection
+            by default
+    Returns:
+        decide_scheduling (bool): whether the app needs to decide which
+            allocations are scheduled'''
+    if data is None:
+        with tco_data.TcoData() as data:
+            return main(data)
+    # don't rank which should be passed to charge scheduling as default
+    decide_scheduling = False
+
+    # # find the current run_id FOR END TO END MODEL RUNS ONLY
+    # run_id = read_input_data('t_system_parameters', 'parameter_name', 'current_run_id')
+    # run_id = int(run_id['parameter_value'].item())
+
+    # read fuel cabron intensities
+    names = ['diesel_gco_litre', 'petrol_gco_litre', 'grid_gco_kwh']
+    values = data.read('t_system_parameters', 'parameter_name', names)
+    values = values.set_index('parameter_name')['parameter_value']
+    system_parameters = {name: int(values[name]) for name in names}
+    # get the inputs for this run
+    inputs = data.read('t_run_vehicle_tco', 'run_id', run_id)
+    params = run_parameters(inputs, system_parameters, run_id, client_id)
+
+    # # find the client id FOR END TO END MODEL RUNS ONLY
+    # client_id = read_input_data('t_run_master', 'run_id', run_id)
+    # client_id = client_id['client_id'].item()
+
+    # get allocations for this run id
+    allocations = data.read('t_allocation', 'run_id', run_id)
+    # remove ids which should not be analysed based on schedule_charge flag
+    allocations = allocations[allocations['schedule_charge'] > 0]
+    if len(allocations) == 0:
+        print('no allocations to analyse for run ' + str(run_id))
+        return decide_scheduling
+    # find the dno region of each site
+    sites = data.read('t_sites', 'site_id',
+                      pd.unique(allocations['site_id']).tolist())
+    allocations = allocations.merge(
+        sites[['site_id', 'distribution_id']], how='left', on='site_id')
+
+    # load the routes, scenarios, specs and lookups of every allocation
+    tables = ['t_route_allocated', 't_route_master', 't_charging_scenarios',
+              't_vehicle_specification', 't_residual_values',
+              't_capital_allowances']
+    if params['tou_tariff'] == 1:
+        # the timeseries charge profiles
+        tables.append('t_charge_demand')
+    data.load_run(allocations['allocation_id'].tolist(), tables)
+    # USE HISTORIC FROM t_route_master INSTEAD OF SYNTHETIC ROUTES
+    route_data = data.table('t_route_master')
+    routes = data.table('t_route_allocated').merge(
+        route_data[['route_id', 'distance_miles', 'departure_time']],
+        how='left', on='route_id')
+    lookups = {
+        'allocations': allocations,
+        'scenarios': data.table('t_charging_scenarios'),
+        'residual_values': data.table('t_residual_values'),
+        'capital_allowances': data.table('t_capital_allowances')}
+    if params['tou_tariff'] == 1:
+        lookups['charge_demand'] = data.table('t_charge_demand')
+        # find the tariff of each dno region
+        lookups['tariffs'] = data.read(
+            't_electricity_price', 'distribution_id',
+            pd.unique(allocations['distribution_id']).tolist())
+
+    components, preliminary = compute_vehicle_tco(
+        routes, data.table('t_vehicle_specification'), lookups, params)
+    results = tco_data.TcoResults(data)
+
+    # preliminary TCO calculation before charge scheduling
+    for row in preliminary.itertuples():
+        results.add_allocation(
+            row.allocation_id,
+            preliminary_tco_lease=row.preliminary_tco_lease,
+            preliminary_tco_purchase=row.preliminary_tco_purchase)
+    # if the prelim TCO already had a vehicle costs then app needs to decide scheduling
+    prelim_allocations = allocations[allocations['schedule_charge'] == 1]
+    if (prelim_allocations['preliminary_tco_lease'] != 0).any():
+        decide_scheduling = True
+
+    # final TCO calculation after charge scheduling, the tco components of
+    # every scenario
+    results.add_components('t_vehicle_tco_components', components)
+    uploads = components[['site_id', 'allocation_id', 'scenario_id']]
+    uploads = uploads.drop_duplicates().values.tolist()
+    # write the results of the run in one transaction
     try:
-        connection, cnx = database_connection()
-        cursor = connection.cursor()
-        print('FPS db connection successful')
-        try:
-            print('here 2')
-            cursor.execute(query_str, (data_val, key_val))
-            print('query_str = ' + query_str)
-            print('(key_val, data_val) = ' + str((data_val, key_val)))
-            connection.commit()
-            print('data read successful')
-        except sqlalchemy.exc.OperationalError as err:
-            print('data read unsuccessful')
-            raise err
-        except ValueError as err:
-            print('data read unsuccessful')
-            raise err
-        finally:
-            # close the db connection
-            cursor.close()
-            connection.close()
-            cnx.dispose()
-            print('closed db connection successfully')
+        results.write()
+        successful_uploads.extend(uploads)
+        print('SUCCESS ' + str(len(uploads)) + ' scenarios')
     except Exception as err:
-        print('failed to connect to FPS database')
+        failed_uploads.extend(uploads)
+        print('FAIL ' + str(len(uploads)) + ' scenarios')
         raise err
+    return decide_scheduling
 
 
-
-# the main calculation function
-# Bill editing
-# failed_uploads = []
-# successful_uploads = []
-
-# don't rank which should be passed to charge scheduling as default 
-decide_scheduling = False
-
-# # find the current run_id FOR END TO END MODEL RUNS ONLY
-# run_id = read_input_data('t_system_parameters', 'parameter_name', 'current_run_id')
-# run_id = int(run_id['parameter_value'].item())
-
-# read fuel cabron intensities
-diesel_gco_litre = read_input_data('t_system_parameters', 'parameter_name', 'diesel_gco_litre')
-diesel_gco_litre = int(diesel_gco_litre['parameter_value'].item())
-petrol_gco_litre = read_input_data('t_system_parameters', 'parameter_name', 'petrol_gco_litre')
-petrol_gco_litre = int(petrol_gco_litre['parameter_value'].item())
-grid_gco_kwh = read_input_data('t_system_parameters', 'parameter_name', 'grid_gco_kwh')
-grid_gco_kwh = int(grid_gco_kwh['parameter_value'].item())
-
-# get the inputs for this run
-inputs = read_input_data('t_run_vehicle_tco', 'run_id', run_id)
-# read the macro assumptions
-lifetime = inputs['asset_lifetime'].item()
-# interest rate (annual)
-interest_rate = inputs['interest_rate'].item()
-# finance period (months)
-finance_period = inputs['finance_period'].item()
-# upfront lease payment
-upfront_lease = inputs['upfront_lease'].item()
-# use a time of use tariff or not
-tou_tariff = inputs['tou_tariff'].item()
-# £/kwh price to use for a flat tariff
-flat_tariff = inputs['flat_tariff_rate'].item()
-# find the fossil fuel costs
-petrol_cost = inputs['petrol_cost'].item()
-diesel_cost = inputs['diesel_cost'].item()
-# find the non-fuel vehicle costs
-ved = inputs['ved'].item()
-insurance = inputs['insurance'].item()
-tyre_cost = inputs['tyre_cost_rate'].item()
-maintenance = inputs['maintenance_rate'].item()
-ev_maintenance_disc = inputs['ev_maintenance_discount'].item()
-# find the annual mileage bands for residual value lookup
-mileage_thresholds = inputs['mileage_thresholds'].item()
-mileage_thresholds = mileage_thresholds.split(', ')
-mileage_thresholds = [int(i) for i in mileage_thresholds]
-
-# # find the client id FOR END TO END MODEL RUNS ONLY
-# client_id = read_input_data('t_run_master', 'run_id', run_id)
-# client_id = client_id['client_id'].item()
-
-# get allocations for this run id
-allocation_info_all = read_input_data('t_allocation', 'run_id', run_id)
-# find the unique site ids for this run
-site_ids = pd.unique(allocation_info_all['site_id']).tolist()
-
-# site_ids = [6, 12, 3, 4, 5, 7, 10, 20, 2, 11, 21, 23]
-# site_ids = [4, 5, 7, 10, 20, 2, 11, 21, 23]
-# site_ids = [23]
-
-# for each site
-for site_id in site_ids:
-    # get site mileage conversion factor DON'T USE THIS ONE, TAKE xmpg FROM t_allocation
-    site_info = read_input_data('t_sites', 'site_id', site_id)
-    # find the allocation_ids for this site id
-    allocation_ids = allocation_info_all[
-        allocation_info_all['site_id']==site_id]['allocation_id'].tolist()
-    schedule_ids = allocation_info_all[
-        allocation_info_all['site_id']==site_id]['schedule_charge'].tolist()
-    # remove ids which should not be analysed based on schedule_charge flag
-    allocation_ids = [allocation_ids[x] for x in
-                      range(0, len(allocation_ids)) if schedule_ids[x] > 0]
-    print(allocation_ids)
-
-    for allocation_id in allocation_ids:
-        # get allocation run info
-        allocation_info = allocation_info_all[
-            allocation_info_all['allocation_id']==allocation_id]
-        # get site mileage conversion factor
-        xmpg = allocation_info['xmpg'].item()
-        # extract variable indicating which stage of allocation processing
-        schedule_charge = allocation_info['schedule_charge'].item()
-        # get the allocated routes
-        allocated_routes = read_input_data('t_route_allocated',
-                                           'allocation_id', allocation_id)
-        # find the unique vehicles
-        allocated_vehicle_ids = allocated_routes['allocated_vehicle_id'].to_numpy()
-        allocated_spec_ids = allocated_routes['allocated_spec_id'].to_numpy()
-        # extract the unique vehicle ids and matching spec ids
-        allocated_vehicle_ids, idx = np.unique(allocated_vehicle_ids,
-                                                return_index=True)
-        allocated_spec_ids = allocated_spec_ids[idx]
-        # for each unique vehicle spec lookup: purchase price, PIVG, energy/petrol use, maintenance saving
-        unique_spec_ids = np.unique(allocated_spec_ids)
-        unique_spec_ids = tuple(unique_spec_ids.tolist())
-        vehicle_specs = read_input_data('t_vehicle_specification', 'spec_id', unique_spec_ids)
-        # get the full route data for all routes allocated on this id
-        unique_routes = np.unique(allocated_routes['route_id'])
-        unique_routes = tuple(unique_routes.tolist())
-        
-        # synthetic_routes = read_input_data('t_route_synthetic', # SYNTHETIC ROUTES REMOVED FROM WORKFLOW
-        #                                    'synthetic_route_id',
-        #                                    unique_routes)
-        
-        synthetic_routes = read_input_data('t_route_master', # USE HISTORIC FROM t_route_master INSTEAD OF SYNTHETIC ROUTES
-                                           'route_id',
-                                           unique_routes)
-        synthetic_routes.rename(columns={'route_id': 'synthetic_route_id'}, inplace=True)
-        
-        # merge with data from t_route_allocation on the route id 
-        complete_routes = pd.merge(allocated_routes, synthetic_routes,
-                                   how='outer', left_on=['route_id'],
-                                   right_on=['synthetic_route_id'])
-        
-        # group mileages by the vehicle id
-        vehicle_mileages = complete_routes.groupby("allocated_vehicle_id")["distance_miles"].sum()
-        # find the factor to mutiply up by to get annualised results THIS WILL ERRONEOUSLY INCREASE RESULTS IF NO OPERATIONS PURPOSELY OCCUR AT START OR END OF DATE RANGE
-        # find the number of days that each vehicle operates on, and the start and end dates
-        complete_routes['dayofyear'] = complete_routes['departure_time'].dt.dayofyear+(complete_routes['departure_time'].dt.year*365)
-        vehicle_minday = complete_routes.groupby("allocated_vehicle_id")["dayofyear"].min()
-        vehicle_minday = vehicle_minday.rename('vehicle_minday')
-        vehicle_maxday = complete_routes.groupby("allocated_vehicle_id")["dayofyear"].max()
-        vehicle_maxday = vehicle_maxday.rename('vehicle_maxday')
-        vehicle_mindate = complete_routes.groupby("allocated_vehicle_id")["departure_time"].min()
-        vehicle_mindate = vehicle_mindate.rename('vehicle_mindate')
-        vehicle_maxdate = complete_routes.groupby("allocated_vehicle_id")["departure_time"].max()
-        vehicle_maxdate = vehicle_maxdate.rename('vehicle_maxdate')
-        # add to the mileage df
-        vehicle_mileages = vehicle_mileages.to_frame()
-        vehicle_mileages['vehicle_minday'] = vehicle_minday
-        vehicle_mileages['vehicle_maxday'] = vehicle_maxday
-        vehicle_mileages['vehicle_mindate'] = vehicle_mindate
-        vehicle_mileages['vehicle_maxdate'] = vehicle_maxdate
-        # find and apply the annualise factor
-        vehicle_mileages['ndays'] = vehicle_mileages['vehicle_maxday'] - (vehicle_mileages['vehicle_minday'] - 1)
-        vehicle_mileages['annualise_factor'] = 1/(vehicle_mileages['ndays']/365)
-        vehicle_mileages['distance_miles'] = vehicle_mileages['distance_miles']*vehicle_mileages['annualise_factor']
-        # band the annual mileage of each vehicle
-        vehicle_mileage_band = np.zeros(len(vehicle_mileages))
-        for i_band in range(0, len(mileage_thresholds)):
-            thresh = mileage_thresholds[i_band]
-            vehicle_mileage_band = (vehicle_mileage_band
-                                    + (vehicle_mileages['distance_miles'] >= thresh).astype(int))
-        vehicle_mileage_band = vehicle_mileage_band - 1
-        # read the residual value lookup table
-        vehicle_categories = vehicle_specs['vehicle_category'].unique()
-        vehicle_categories = tuple(vehicle_categories.tolist())
-        residual_value_lookup = read_input_data('t_residual_values',
-                                                'vehicle_category',
-                                                vehicle_categories)
-        # read the capital allowances lookup table
-        capital_allowance_lookup = read_input_data('t_capital_allowances',
-                                                'vehicle_category',
-                                                vehicle_categories)
-        
-        # create TCO components dataframe
-        tco_calc = vehicle_mileages
-        tco_calc['spec_id'] = allocated_spec_ids
-        tco_calc['mileage_band'] = vehicle_mileage_band
-        tco_calc['lifetime'] = lifetime
-        tco_calc['interest_rate'] = interest_rate
-        tco_calc['finance_period'] = finance_period
-        tco_calc['upfront_lease'] = upfront_lease
-        # tco_calc['insurance'] = insurance OLD RETAIN FOR FIRST TEST
-        tco_calc['tyre_cost'] = tyre_cost*tco_calc['distance_miles']
-        tco_calc['client_id'] = client_id
-        tco_calc = tco_calc.reset_index()
-        
-
-        # preliminary TCO calculation before charge scheduling
-        if schedule_charge == 1:
-            # set dummy scenario ids
-            scenario_ids = [-1]
-        # final TCO calculation after charge scheduling
-        elif schedule_charge == 2:
-            scenario_info_all = read_input_data('t_charging_scenarios',
-                                                'allocation_id',
-                                                allocation_id)
-            scenario_ids = scenario_info_all['scenario_id'].tolist()
-            # # avoid infeasible scenarios pick first SHORT TERM WORLFOW CHANGE
-            # scenario_ids.sort()
-            # scenario_ids = scenario_ids[0:1]
-        # for each charging scenario
-        for i_scenario in range(0, len(scenario_ids)):
-            scenario_id = scenario_ids[i_scenario]
-            # remove scenario ids which should not be run based on schedule_charge flag NOT REQUIRED AS ONLY RUNNING FIRST SCENARIO
-            
-            # merge tco components with the vehicle specs
-            tco_calc_full = tco_calc.copy(deep=True)
-            tco_calc_full = pd.merge(tco_calc_full,vehicle_specs,how='outer',left_on=['spec_id'],right_on=['spec_id'])
-            # preliminary TCO calculation before charge scheduling
-            if schedule_charge == 1:
-                preliminary_tco_lease = allocation_info['preliminary_tco_lease'].item()
-                preliminary_tco_purchase = allocation_info['preliminary_tco_purchase'].item()
-
-                tco_calc_full['fuel_cost'] = 0
-                # fuel costs accounting for site xmpg efficiency
-                tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'fuel_cost'] = (tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'distance_miles']
-                                                                                            *tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'energy_use']
-                                                                                            *flat_tariff)/xmpg
-                tco_calc_full.loc[tco_calc_full['fuel_type'] == 'diesel', 'fuel_cost'] = (tco_calc_full.loc[tco_calc_full['fuel_type'] == 'diesel', 'distance_miles']
-                                                                                          *tco_calc_full.loc[tco_calc_full['fuel_type'] == 'diesel', 'energy_use']
-                                                                                          *diesel_cost)/xmpg
-                tco_calc_full.loc[tco_calc_full['fuel_type'] == 'petrol', 'fuel_cost'] = (tco_calc_full.loc[tco_calc_full['fuel_type'] == 'petrol', 'distance_miles']
-                                                                                          *tco_calc_full.loc[tco_calc_full['fuel_type'] == 'petrol', 'energy_use']
-                                                                                          *petrol_cost)/xmpg
-            # final TCO calculation after charge scheduling
-            elif schedule_charge == 2:
-                if tou_tariff == 1:
-                    # find the dno region and corresponding tariff
-                    dno_id = site_info['distribution_id'].item()
-                    tariff_data = read_input_data('t_electricity_price',
-                                                'distribution_id',
-                                                dno_id)
-                    # read the timeseries charge profiles
-                    scenario_info = scenario_info_all[
-                                    scenario_info_all['scenario_id'] == scenario_id]
-                    charge_profiles = read_input_data('t_charge_demand',
-                                                    'scenario_id',
-                                                    scenario_id)
-                    charge_profiles = pd.merge(charge_profiles,tariff_data,how='outer',left_on=['datetime'],right_on=['datetime'])
-                    # drop the tariff only datetime rows for which there is no charge profile
-                    charge_profiles = charge_profiles.dropna(subset=['allocated_vehicle_id'])
-                    # find the fuel cost for each half hour, accounting for the fuel efficiency of the site
-                    charge_profiles['fuel_cost'] = charge_profiles['electricity_price_fixed']*charge_profiles['power_demand_kw']/(2*xmpg)
-                    ev_fuel_cost = charge_profiles.groupby("allocated_vehicle_id")["fuel_cost"].sum()
-                    ev_fuel_cost = ev_fuel_cost.rename("fuel_cost")
-                    ev_fuel_cost = ev_fuel_cost.reset_index()
-                    # annualise results
-                    tco_calc_full = pd.merge(tco_calc_full,ev_fuel_cost,how='outer',left_on=['allocated_vehicle_id'],right_on=['allocated_vehicle_id'])
-                    tco_calc_full['fuel_cost'] = tco_calc_full['fuel_cost']*tco_calc_full['annualise_factor']
-                
-                else:
-                    tco_calc_full['fuel_cost'] = 0
-                    # fuel costs accounting for site xmpg efficiency
-                    tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'fuel_cost'] = (tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'distance_miles']
-                                                                                                *tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'energy_use']
-                                                                                                *flat_tariff)/xmpg
-                # add the ice vehicle fuel costs accounting for site xmpg efficiency
-                tco_calc_full.loc[tco_calc_full['fuel_type'] == 'diesel', 'fuel_cost'] = (tco_calc_full.loc[tco_calc_full['fuel_type'] == 'diesel', 'distance_miles']
-                                                                                          *tco_calc_full.loc[tco_calc_full['fuel_type'] == 'diesel', 'energy_use']
-                                                                                          *diesel_cost)/xmpg
-                tco_calc_full.loc[tco_calc_full['fuel_type'] == 'petrol', 'fuel_cost'] = (tco_calc_full.loc[tco_calc_full['fuel_type'] == 'petrol', 'distance_miles']
-                                                                                          *tco_calc_full.loc[tco_calc_full['fuel_type'] == 'petrol', 'energy_use']
-                                                                                          *petrol_cost)/xmpg
-
-    
-            # add the vehicle maintenance costs
-            tco_calc_full['maintenance_pct'] = 1
-            tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric','maintenance_pct'] = 1 - ev_maintenance_disc
-            # tco_calc_full['ved'] = ved OLD RETAIN FOR FIRST TEST
-            tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric','ved'] = 0
-            tco_calc_full['maintenance'] = maintenance*tco_calc_full['distance_miles']*tco_calc_full['maintenance_pct']
-            tco_calc_full_tmp = tco_calc_full.copy(deep=True)
-            # find residual value
-            tco_calc_full = pd.merge(tco_calc_full,residual_value_lookup,
-                                how='inner',left_on=['vehicle_category', 'lifetime', 'mileage_band'],
-                                right_on=['vehicle_category', 'lifetime', 'mileage_band'])
-            # find capital allowance
-            tco_calc_full = pd.merge(tco_calc_full,capital_allowance_lookup,
-                                how='inner',left_on=['vehicle_category', 'lifetime', 'capital_allowance_rate'],
-                                right_on=['vehicle_category', 'lifetime', 'capital_allowance_rate'])
-            # # adjust for EVs
-            # tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'accumulated_capital_allowance'] = 0.19
-            # calculate net vehicle cost
-            tco_calc_full['net_purchase_cost'] = tco_calc_full['vehicle_purchase_price'] - tco_calc_full['pivg']
-            # calculate capital allowance
-            tco_calc_full['full_capital_allowance'] = tco_calc_full['accumulated_capital_allowance']*tco_calc_full['net_purchase_cost']
-            # calculate residual value
-            tco_calc_full['full_residual_value'] = tco_calc_full['residual_value_pct']*tco_calc_full['vehicle_purchase_price']
-
-            
-            # calculate the annual lease payments
-            tco_calc_full['annual_lease_payments'] = -12*npf.pmt((tco_calc_full['interest_rate']/12).to_numpy(), tco_calc_full['finance_period'].to_numpy(),
-                    (tco_calc_full['net_purchase_cost']*(1-tco_calc_full['upfront_lease'])).to_numpy(), fv=-tco_calc_full['full_residual_value'].to_numpy(), when=0)
-            # calculate the TCO
-            tco_calc_full['total_cost_ownership'] = (tco_calc_full['net_purchase_cost'] - tco_calc_full['full_capital_allowance'] - tco_calc_full['full_residual_value']
-                            + tco_calc_full['lifetime']*(tco_calc_full['fuel_cost'] + tco_calc_full['ved'] + tco_calc_full['insurance'] + tco_calc_full['tyre_cost'] + tco_calc_full['maintenance']))
-            tco_calc_full['annualised_ownership_cost'] = tco_calc_full['total_cost_ownership']/tco_calc_full['lifetime']
-            tco_calc_full['annual_costs_lease'] = (tco_calc_full['annual_lease_payments'] + tco_calc_full['fuel_cost'] + tco_calc_full['ved'] + tco_calc_full['insurance'] + tco_calc_full['tyre_cost'] + tco_calc_full['maintenance'])
-            tco_calc_full['upfront_cost_lease'] = tco_calc_full['net_purchase_cost']*tco_calc_full['upfront_lease']
-            
-            # preliminary TCO calculation before charge scheduling
-            if schedule_charge == 1:
-                # find costs for leasing assets
-                vehicle_cost = (tco_calc_full['annual_costs_lease']
-                                * tco_calc_full['lifetime']
-                                + tco_calc_full['upfront_cost_lease']).sum()
-                scenario_cost = preliminary_tco_lease + vehicle_cost
-                # update table
-                update_value('t_allocation', 'allocation_id', allocation_id,
-                            'preliminary_tco_lease', scenario_cost)
-                # find costs for purchasing assets
-                vehicle_cost = (tco_calc_full['annualised_ownership_cost']
-                                * tco_calc_full['lifetime']).sum()
-                scenario_cost = preliminary_tco_purchase + vehicle_cost
-                # update table
-                update_value('t_allocation', 'allocation_id', allocation_id,
-                            'preliminary_tco_purchase', scenario_cost)
-                # if the prelim TCO already had a vehicle costs then app needs to decide scheduling
-                if preliminary_tco_lease != 0:
-                    decide_scheduling = True
-            
-            # find the annual carbon emissions
-            tco_calc_full['scope_1_emissions'] = 0
-            tco_calc_full['scope_2_emissions'] = 0
-            tco_calc_full['scope_3_emissions'] = 0
-            tco_calc_full.loc[tco_calc_full['fuel_type'] == 'diesel', 'scope_1_emissions'] = (tco_calc_full.loc[tco_calc_full['fuel_type'] == 'diesel', 'distance_miles']
-                                                                                            *tco_calc_full.loc[tco_calc_full['fuel_type'] == 'diesel', 'energy_use']
-                                                                                            *diesel_gco_litre)/xmpg
-            tco_calc_full.loc[tco_calc_full['fuel_type'] == 'petrol', 'scope_1_emissions'] = (tco_calc_full.loc[tco_calc_full['fuel_type'] == 'petrol', 'distance_miles']
-                                                                                            *tco_calc_full.loc[tco_calc_full['fuel_type'] == 'petrol', 'energy_use']
-                                                                                            *petrol_gco_litre)/xmpg
-            tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'scope_2_emissions'] = (tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'distance_miles']
-                                                                                                *tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'energy_use']
-                                                                                                *grid_gco_kwh)/xmpg
-            
-            # final TCO calculation after charge scheduling
-            if schedule_charge == 2:
-                tco_calc_full['scenario_id'] = scenario_id
-                tco_calc_full['allocation_id'] = allocation_id
-                tco_calc_full['run_id'] = run_id
-                tco_calc_full['client_id']
-                tco_calc_full['site_id'] = allocation_info['site_id'].item()
-
-                tco_calc_full.rename(columns={"allocated_vehicle_id": "vehicle_id",
-                                            "distance_miles": "annual_mileage",
-                                            "vehicle_purchase_price": "purchase_price",
-                                            "net_purchase_cost": "purchase_price_w_grant",
-                                            "upfront_cost_lease": "upfront_lease_cost",
-                                            "tyre_cost": "annual_tyre_cost",
-                                            "ved": "annual_ved",
-                                            "insurance": "annual_insurance"},
-                                    inplace = True)
-                tco_calc_full_tmpp = tco_calc_full.copy(deep = True)
-                # separate out ice vehicle fuel costs
-                tco_calc_full['annual_fuel_cost'] = tco_calc_full['fuel_cost']
-                tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'annual_fuel_cost'] = 0
-                # separate out EV fuel costs
-                tco_calc_full['annual_electricity_cost'] = 0
-                tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'annual_electricity_cost'] = tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'fuel_cost']
-                # separate out ice vehicle maintenance costs
-                tco_calc_full['annual_ice_maintenance'] = tco_calc_full['maintenance']
-                tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'annual_ice_maintenance'] = 0
-                # separate out ev maintenance costs
-                tco_calc_full['annual_ev_maintenance'] = 0
-                tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'annual_ev_maintenance'] = tco_calc_full.loc[tco_calc_full['fuel_type'] == 'electric', 'maintenance']
-
-                # keep only the necessary columns
-                final_table_columns = ['scenario_id', 'allocation_id', 'run_id', 'client_id',
-                                    'site_id', 'vehicle_id', 'spec_id', 'annual_mileage',
-                                    'mileage_band', 'fuel_type', 'purchase_price',
-                                    'purchase_price_w_grant', 'upfront_lease_cost',
-                                    'annual_fuel_cost', 'annual_electricity_cost',
-                                    'annual_ice_maintenance', 'annual_ev_maintenance',
-                                    'annual_tyre_cost', 'annual_ved', 'annual_insurance',
-                                    'scope_1_emissions', 'scope_2_emissions',
-                                    'scope_3_emissions', 'annualise_factor',
-                                    'vehicle_mindate', 'vehicle_maxdate']
-                tco_calc_full.drop(columns=tco_calc_full.columns.difference(final_table_columns), inplace=True)
-                # upload the tco components
-                try:
-                    upload_to_database(tco_calc_full, 't_vehicle_tco_components')
-                    successful_uploads.append([site_id, allocation_id, scenario_id])
-                    print('SUCCESS ' + str(scenario_id) + ', ' + str(allocation_id) + ', ' + str(site_id))
-                except:
-                    failed_uploads.append([site_id, allocation_id, scenario_id])
-                    print('FAIL ' + str(scenario_id) + ', ' + str(allocation_id) + ', ' + str(site_id))
-        
+if __name__ == '__main__':
+    main()
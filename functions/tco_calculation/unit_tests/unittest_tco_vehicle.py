@@ -0,0 +1,159 @@
+'''
+unittest_tco_vehicle.py
+'''
+
+import unittest
+
+import os
+import sys
+import pandas as pd
+
+CDIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.append(os.path.join(CDIR, '..'))
+from tco_vehicle import compute_vehicle_tco, VEHICLE_TCO_COLUMNS
+
+RUN_ID = 215
+CLIENT_ID = 2
+TIMES = pd.date_range('2021-03-01 00:00', periods=4, freq='30min')
+# expected values, from the original per vehicle calculation of the run
+PRELIMINARY_LEASE = 112444.29718620033
+PRELIMINARY_PURCHASE = 51640.204545454544
+VEHICLES = {
+    1: {'spec_id': 1, 'fuel_type': 'electric', 'annual_mileage': 3650.,
+        'mileage_band': 0, 'purchase_price': 50000,
+        'purchase_price_w_grant': 45000, 'upfront_lease_cost': 4500.,
+        'annual_fuel_cost': 0., 'annual_ice_maintenance': 0.,
+        'annual_ev_maintenance': 255.5, 'annual_tyre_cost': 73.,
+        'annual_ved': 0, 'annual_insurance': 900, 'scope_1_emissions': 0.,
+        'scope_2_emissions': 164250., 'scope_3_emissions': 0.,
+        'annualise_factor': 18.25},
+    2: {'spec_id': 2, 'fuel_type': 'diesel', 'annual_mileage': 73000.,
+        'mileage_band': 3, 'purchase_price': 30000,
+        'purchase_price_w_grant': 30000, 'upfront_lease_cost': 3000.,
+        'annual_fuel_cost': 9125., 'annual_electricity_cost': 0.,
+        'annual_ice_maintenance': 7300., 'annual_ev_maintenance': 0.,
+        'annual_tyre_cost': 1460., 'annual_ved': 300,
+        'annual_insurance': 1000, 'scope_1_emissions': 16060000.,
+        'scope_2_emissions': 0., 'scope_3_emissions': 0.,
+        'annualise_factor': 365.}}
+# electricity cost of the electric vehicle in each scenario
+ELECTRICITY_COST = {0: {100: 136.875, 101: 136.875},
+                    1: {100: 45.625, 101: 68.4375}}
+
+
+def run_inputs(tou_tariff):
+    '''Routes, specs, lookups and parameters of a small run
+    Allocation 1 gets a preliminary TCO, allocation 2 is scheduled with two
+    charging scenarios. Both have an electric and a diesel vehicle'''
+    routes = pd.DataFrame(
+        [[1, 1, 1, 1, 100., '2021-03-01 06:00'],
+         [2, 1, 1, 1, 120., '2021-03-10 07:00'],
+         [3, 1, 2, 2, 80., '2021-03-02 06:00'],
+         [4, 1, 2, 2, 90., '2021-03-05 08:00'],
+         [5, 2, 1, 1, 150., '2021-03-01 05:00'],
+         [6, 2, 1, 1, 50., '2021-03-20 09:00'],
+         [7, 2, 2, 2, 200., '2021-03-03 10:00']],
+        columns=['route_id', 'allocation_id', 'allocated_vehicle_id',
+                 'allocated_spec_id', 'distance_miles', 'departure_time'])
+    routes['departure_time'] = pd.to_datetime(routes['departure_time'])
+    specs = pd.DataFrame({
+        'spec_id': [1, 2], 'fuel_type': ['electric', 'diesel'],
+        'energy_use': [0.3, 0.1], 'vehicle_purchase_price': [50000, 30000],
+        'pivg': [5000, 0], 'vehicle_category': ['van', 'van'],
+        'capital_allowance_rate': ['main', 'main'], 'ved': [0, 300],
+        'insurance': [900, 1000]})
+    allocations = pd.DataFrame({
+        'allocation_id': [1, 2], 'run_id': RUN_ID, 'site_id': [1, 2],
+        'distribution_id': [10, 11], 'xmpg': [1.1, 1.2],
+        'schedule_charge': [1, 2], 'preliminary_tco_lease': [1000., 0.],
+        'preliminary_tco_purchase': [500., 0.]})
+    scenarios = pd.DataFrame({'scenario_id': [100, 101],
+                              'allocation_id': [2, 2]})
+    charge_demand = pd.DataFrame({
+        'scenario_id': [100]*4 + [101]*2 + [101]*2,
+        'allocated_vehicle_id': [1]*6 + [2]*2,
+        'datetime': list(TIMES) + list(TIMES[:2]) + list(TIMES[:2]),
+        'power_demand_kw': [10., 10., 10., 10., 30., 30., 5., 5.]})
+    # the last half hour doesn't have a tariff
+    tariffs = pd.DataFrame({'distribution_id': 11, 'datetime': TIMES[:3],
+                            'electricity_price_fixed': [0.1, 0.2, 0.3]})
+    residual_values = pd.DataFrame({
+        'vehicle_category': 'van', 'lifetime': 5,
+        'mileage_band': [-1, 0, 1, 2, 3],
+        'residual_value_pct': [0.35, 0.3, 0.25, 0.2, 0.15]})
+    capital_allowances = pd.DataFrame({
+        'vehicle_category': 'van', 'lifetime': 5,
+        'capital_allowance_rate': ['main'],
+        'accumulated_capital_allowance': [0.5]})
+    lookups = {'allocations': allocations, 'scenarios': scenarios,
+               'residual_values': residual_values,
+               'capital_allowances': capital_allowances}
+    if tou_tariff == 1:
+        lookups['charge_demand'] = charge_demand
+        lookups['tariffs'] = tariffs
+    params = {
+        'run_id': RUN_ID, 'client_id': CLIENT_ID, 'lifetime': 5,
+        'interest_rate': 0.05, 'finance_period': 48, 'upfront_lease': 0.1,
+        'tou_tariff': tou_tariff, 'flat_tariff': 0.15, 'petrol_cost': 1.4,
+        'diesel_cost': 1.5, 'tyre_cost': 0.02, 'maintenance': 0.1,
+        'ev_maintenance_disc': 0.3,
+        'mileage_thresholds': [0, 10000, 20000, 30000],
+        'diesel_gco_litre': 2640, 'petrol_gco_litre': 2310,
+        'grid_gco_kwh': 180}
+    return routes, specs, lookups, params
+
+
+class TestComputeVehicleTco(unittest.TestCase):
+    def assert_components(self, components, tou_tariff):
+        self.assertEqual(list(components.columns), VEHICLE_TCO_COLUMNS)
+        self.assertEqual(len(components), 4)
+        for row in components.to_dict('records'):
+            self.assertEqual(row['allocation_id'], 2)
+            self.assertEqual(row['site_id'], 2)
+            self.assertEqual(row['run_id'], RUN_ID)
+            self.assertEqual(row['client_id'], CLIENT_ID)
+            expected = dict(VEHICLES[row['vehicle_id']])
+            if row['vehicle_id'] == 1:
+                expected['annual_electricity_cost'] = (
+                    ELECTRICITY_COST[tou_tariff][row['scenario_id']])
+            for col, value in expected.items():
+                if isinstance(value, str):
+                    self.assertEqual(row[col], value)
+                else:
+                    self.assertAlmostEqual(row[col], value, places=6,
+                                           msg=col)
+        self.assertEqual(
+            sorted(zip(components['scenario_id'], components['vehicle_id'])),
+            [(100, 1), (100, 2), (101, 1), (101, 2)])
+
+    def assert_preliminary(self, preliminary):
+        self.assertEqual(preliminary['allocation_id'].tolist(), [1])
+        self.assertAlmostEqual(preliminary['preliminary_tco_lease'][0],
+                               PRELIMINARY_LEASE, places=6)
+        self.assertAlmostEqual(preliminary['preliminary_tco_purchase'][0],
+                               PRELIMINARY_PURCHASE, places=6)
+
+    def test_flat_tariff(self):
+        components, preliminary = compute_vehicle_tco(*run_inputs(0))
+        self.assert_components(components, 0)
+        self.assert_preliminary(preliminary)
+
+    def test_tou_tariff(self):
+        components, preliminary = compute_vehicle_tco(*run_inputs(1))
+        self.assert_components(components, 1)
+        self.assert_preliminary(preliminary)
+
+    def test_preliminary_only(self):
+        routes, specs, lookups, params = run_inputs(1)
+        allocations = lookups['allocations']
+        lookups['allocations'] = allocations[allocations['allocation_id'] == 1]
+        components, preliminary = compute_vehicle_tco(routes, specs, lookups,
+                                                      params)
+        self.assertEqual(len(components), 0)
+        self.assertEqual(list(components.columns), VEHICLE_TCO_COLUMNS)
+        self.assert_preliminary(preliminary)
+
+
+if __name__ == '__main__':
+    unittest.main()